@@ -0,0 +1,107 @@
+"""Recall@k y latencia de la búsqueda IVF frente a la búsqueda exacta.
+
+Uso:
+    python -m benchmarks.bench_ann --tamanos 10000,100000,1000000 --consultas 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ann import IndiceIVF  # noqa: E402
+from utils.similitud import scores_hibridos, mejores_coincidencias, normas_filas  # noqa: E402
+
+
+def galeria_sintetica(n, rng, bloque=100000):
+    # Embeddings con la escala típica de face_recognition (norma ~1, componentes ~N(0, 0.09))
+    matriz = np.empty((n, 128), dtype=np.float32)
+    for inicio in range(0, n, bloque):
+        fin = min(n, inicio + bloque)
+        matriz[inicio:fin] = rng.normal(0, 0.09, (fin - inicio, 128))
+    return matriz
+
+
+def consultas_sinteticas(matriz, n, rng, ruido=0.025):
+    # Cada consulta es otra "foto" de una persona enrolada
+    elegidos = rng.choice(len(matriz), n, replace=False)
+    return elegidos, matriz[elegidos] + rng.normal(0, ruido, (n, 128)).astype(np.float32)
+
+
+def percentiles(tiempos):
+    tiempos = np.asarray(tiempos) * 1000
+    return round(float(np.percentile(tiempos, 50)), 3), round(float(np.percentile(tiempos, 99)), 3)
+
+
+def medir(n, n_consultas, k, sondeos, semilla):
+    rng = np.random.default_rng(semilla)
+    matriz = galeria_sintetica(n, rng)
+    normas = normas_filas(matriz)
+    elegidos, consultas = consultas_sinteticas(matriz, n_consultas, rng)
+
+    inicio = time.perf_counter()
+    indice = IndiceIVF.entrenar(matriz, max(1, int(4 * np.sqrt(n))), semilla)
+    indice.asignar(matriz)
+    construccion = time.perf_counter() - inicio
+
+    tiempos_exacto, tiempos_ivf = [], []
+    aciertos_k, aciertos_1 = 0, 0
+    for elegido, probe in zip(elegidos, consultas):
+        inicio = time.perf_counter()
+        exactos, _ = mejores_coincidencias(scores_hibridos(probe, matriz, normas), umbral=-np.inf, k=k)
+        tiempos_exacto.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        candidatos = indice.candidatos(probe, sondeos)
+        posiciones, _ = mejores_coincidencias(
+            scores_hibridos(probe, matriz[candidatos], normas[candidatos]), umbral=-np.inf, k=k
+        )
+        aproximados = candidatos[posiciones]
+        tiempos_ivf.append(time.perf_counter() - inicio)
+
+        aciertos_k += len(np.intersect1d(exactos, aproximados))
+        aciertos_1 += int(len(aproximados) > 0 and aproximados[0] == elegido)
+
+    p50_exacto, p99_exacto = percentiles(tiempos_exacto)
+    p50_ivf, p99_ivf = percentiles(tiempos_ivf)
+    return {
+        "n": n,
+        "listas": indice.n_listas,
+        "sondeos": sondeos,
+        "construccion_s": round(construccion, 2),
+        f"recall@{k}": round(aciertos_k / (k * n_consultas), 4),
+        "acierto_identidad": round(aciertos_1 / n_consultas, 4),
+        "exacto_p50_ms": p50_exacto,
+        "exacto_p99_ms": p99_exacto,
+        "ivf_p50_ms": p50_ivf,
+        "ivf_p99_ms": p99_ivf,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000,1000000")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--sondeos", type=int, default=8)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    resultados = []
+    for n in (int(t) for t in args.tamanos.split(",")):
+        resultado = medir(n, args.consultas, args.k, args.sondeos, args.semilla)
+        print(json.dumps(resultado))
+        resultados.append(resultado)
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
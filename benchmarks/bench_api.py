@@ -0,0 +1,288 @@
+"""Throughput y latencia (p50/p95/p99) de la API completa, en proceso y sin servicios externos.
+
+La app se ejecuta con el backend local (SQLite + carpeta de fotos en un directorio
+temporal) y se le habla por ASGI con httpx. Para cada tamaño de galería se siembran
+personas con embeddings aleatorios de 128 dimensiones más un historial de
+reconocimientos y alertas, y se mide cada endpoint con varios niveles de concurrencia:
+/reconocer, /registrar_persona, /dashboard/stats y /exportar-pdf (modo "hoy", con la
+caché de PDF invalidada antes de cada petición).
+
+Sin --fotos el modelo facial se sustituye, solo dentro del benchmark, por una función
+que lee el embedding desde los bytes subidos (un JPEG pequeño seguido de un .npy con una
+persona de la galería más ruido; el JPEG permite que el subidor de fotos lo procese). Se sigue midiendo el pool de procesos, el paso de datos entre procesos, la
+búsqueda, la deduplicación, las escrituras y la respuesta; solo se excluye la CNN.
+Con --fotos se usa el pipeline real (requiere face_recognition): las fotos se enrolan
+primero y /reconocer las consulta.
+
+Uso:
+    python -m benchmarks.bench_api --tamanos 1000,10000 --concurrencias 1,8,32 --salida base.json
+    python -m benchmarks.bench_api --tamanos 1000,10000 --concurrencias 1,8,32 --comparar base.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+
+ADMIN_ID = "bench-admin"
+PERSONAS_POR_LOTE = 1000
+# Fracción de personas sintéticas marcadas como requisitoriadas (ejercita el camino de alertas)
+FRACCION_REQUISITORIADOS = 0.05
+
+
+MAGIA_NPY = b"\x93NUMPY"
+# Imagen válida de relleno delante del embedding (los decodificadores JPEG ignoran lo que
+# sigue al marcador de fin)
+JPEG_RELLENO = None
+
+
+def embedding_sintetico(file_bytes, *args):
+    # Sustituto del modelo: el "archivo" lleva el embedding serializado con np.save
+    return np.load(io.BytesIO(file_bytes[file_bytes.rfind(MAGIA_NPY):])).tolist(), {}
+
+
+def jpeg_sintetico(ancho, alto, rng, calidad=90):
+    # Degradado con ruido: se comprime como una foto de cámara, no como un color plano
+    from PIL import Image
+    y, x = np.mgrid[0:alto, 0:ancho]
+    base = np.stack([x * 255 // max(ancho - 1, 1), y * 255 // max(alto - 1, 1), (x + y) * 127 // max(ancho + alto - 2, 1)], -1)
+    pixeles = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixeles, "RGB").save(buffer, "JPEG", quality=calidad)
+    return buffer.getvalue()
+
+
+def sin_precalentar():
+    pass
+
+
+def foto_sintetica(matriz, rng, ruido=0.025):
+    global JPEG_RELLENO
+    if JPEG_RELLENO is None:
+        JPEG_RELLENO = jpeg_sintetico(64, 64, np.random.default_rng(0))
+    probe = matriz[rng.integers(len(matriz))] + rng.normal(0, ruido, 128).astype(np.float32)
+    buffer = io.BytesIO()
+    np.save(buffer, probe)
+    return JPEG_RELLENO + buffer.getvalue()
+
+
+def percentiles(tiempos):
+    tiempos = np.asarray(tiempos) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(tiempos, p)), 3) for p in (50, 95, 99)}
+
+
+async def medir(cliente, nombre, peticion, concurrencia, total):
+    tiempos, errores = [], 0
+    restantes = iter(range(total))
+
+    async def trabajador():
+        nonlocal errores
+        for i in restantes:
+            inicio = time.perf_counter()
+            respuesta = await peticion(cliente, i)
+            tiempos.append(time.perf_counter() - inicio)
+            errores += respuesta.status_code >= 400
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+    return {
+        "endpoint": nombre,
+        "concurrencia": concurrencia,
+        "peticiones": total,
+        "errores": errores,
+        "rps": round(total / duracion, 2),
+        **percentiles(tiempos),
+    }
+
+
+async def sembrar(app_main, desde, hasta, matriz, historial, rng):
+    datos = app_main.datos
+    ids = []
+    for inicio in range(desde, hasta, PERSONAS_POR_LOTE):
+        fin = min(hasta, inicio + PERSONAS_POR_LOTE)
+        filas = [{
+            "id": f"bench-{i}",
+            "nombre": f"Nombre{i}",
+            "apellidos": f"Apellido{i}",
+            "correo": f"persona{i}@bench.local",
+            "kp": matriz[i].tolist(),
+            "foto": "",
+            "requisitoriado": bool(rng.random() < FRACCION_REQUISITORIADOS),
+        } for i in range(inicio, fin)]
+        await datos.insertar_lote("personas", filas)
+        ids += [fila["id"] for fila in filas]
+
+    hoy = time.strftime("%Y-%m-%d")
+    eventos = [{
+        "persona_id": f"bench-{rng.integers(hasta)}",
+        "fecha": hoy if rng.random() < 0.1 else f"2024-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+        "hora": f"{rng.integers(24):02d}:{rng.integers(60):02d}:{rng.integers(60):02d}",
+        "latitud": -8.1,
+        "longitud": -79.0,
+    } for _ in range(historial)]
+    await datos.insertar_lote("reconocimientos", eventos)
+    await datos.insertar_lote("alertas", [{
+        "persona_id": e["persona_id"], "nombre": "Nombre", "apellidos": "Apellido", "score": 0.9,
+        "fecha": e["fecha"], "hora": e["hora"], "metodo_envio": "ambos",
+    } for e in eventos[:historial // 10]])
+
+
+async def ejecutar(args):
+    import httpx
+    import main as app_main
+    from utils import rostros
+    from utils.seguridad import crear_token
+
+    rng = np.random.default_rng(args.semilla)
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+    concurrencias = [int(c) for c in args.concurrencias.split(",")]
+    matriz = galeria_sintetica(tamanos[-1], rng)
+
+    fotos = [open(ruta, "rb").read() for ruta in args.fotos]
+    if not fotos:
+        rostros.extraer_embedding = embedding_sintetico
+        rostros._precalentar = sin_precalentar
+
+    cabeceras = {"Authorization": f"Bearer {crear_token({'sub': ADMIN_ID})}"}
+
+    def foto(i):
+        return fotos[i % len(fotos)] if fotos else foto_sintetica(matriz[:tamano], rng)
+
+    async def reconocer(cliente, i):
+        return await cliente.post("/reconocer", files={"file": ("rostro.jpg", foto(i), "image/jpeg")},
+                                  data={"latitud": "-8.1", "longitud": "-79.0"})
+
+    async def registrar(cliente, i):
+        return await cliente.post("/registrar_persona", files={"file": ("rostro.jpg", foto(i), "image/jpeg")},
+                                  data={"nombre": "Nuevo", "apellidos": f"Bench {i}", "correo": "nuevo@bench.local",
+                                        "requisitoriado": "false"})
+
+    async def estadisticas(cliente, i):
+        return await cliente.get("/dashboard/stats", headers=cabeceras)
+
+    async def exportar_pdf(cliente, i):
+        app_main.generador_reportes.marcar_cambio("alertas")
+        return await cliente.post("/exportar-pdf", data={"modo": "hoy"}, headers=cabeceras)
+
+    endpoints = [
+        ("/reconocer", reconocer, args.peticiones),
+        ("/registrar_persona", registrar, args.peticiones),
+        ("/dashboard/stats", estadisticas, args.peticiones),
+        ("/exportar-pdf", exportar_pdf, args.peticiones_pdf),
+    ]
+
+    resultados = []
+    async with app_main.app.router.lifespan_context(app_main.app):
+        await app_main.arranque.esperar()
+        transporte = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            if fotos:
+                for i in range(len(fotos)):
+                    await registrar(cliente, i)
+
+            sembradas = 0
+            for tamano in tamanos:
+                await sembrar(app_main, sembradas, tamano, matriz, args.historial * (tamano - sembradas) // tamanos[-1], rng)
+                sembradas = tamano
+                await app_main.cargar_galeria()
+                await app_main.estadisticas.reconciliar()
+
+                for concurrencia in concurrencias:
+                    for nombre, peticion, total in endpoints:
+                        resultado = {"galeria": tamano, **await medir(cliente, nombre, peticion, concurrencia, total)}
+                        print(json.dumps(resultado), flush=True)
+                        resultados.append(resultado)
+                # Que el sumidero no arrastre escrituras de un tamaño al siguiente
+                await app_main.sumidero.vaciar()
+    return resultados
+
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, base):
+    # Diferencia relativa por (endpoint, galería, concurrencia); negativo = mejor en latencia
+    previos = {(r["endpoint"], r["galeria"], r["concurrencia"]): r for r in base["resultados"]}
+    print(f"\nComparación con {base.get('commit')}:")
+    for r in actual["resultados"]:
+        previo = previos.get((r["endpoint"], r["galeria"], r["concurrencia"]))
+        if previo is None:
+            continue
+        cambios = {
+            clave: f"{(r[clave] - previo[clave]) / previo[clave] * 100:+.1f}%"
+            for clave in ("rps", "p50_ms", "p95_ms", "p99_ms") if previo[clave]
+        }
+        print(f"{r['endpoint']:<20} n={r['galeria']:<8} c={r['concurrencia']:<4} {cambios}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="1000,10000")
+    parser.add_argument("--concurrencias", default="1,8,32")
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--peticiones-pdf", type=int, default=10)
+    parser.add_argument("--historial", type=int, default=20000,
+                        help="Reconocimientos sembrados para la galería más grande (alertas: 10%%)")
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--fotos", nargs="*", default=[], help="Fotos reales con un rostro (usa face_recognition)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_api_")
+    # La configuración se lee al importar main, así que se fija antes
+    os.environ.update({
+        "ALMACENAMIENTO": "local",
+        "ALMACENAMIENTO_SQLITE": os.path.join(directorio, "bench.db"),
+        "ALMACENAMIENTO_FOTOS": os.path.join(directorio, "fotos"),
+        "ESCRITURA_RESPALDO": os.path.join(directorio, "eventos_pendientes.jsonl"),
+        "ESCRITURA_RECHAZADAS": os.path.join(directorio, "eventos_rechazados.jsonl"),
+        "FOTOS_RESPALDO": os.path.join(directorio, "fotos_pendientes"),
+        "IVF_RUTA": os.path.join(directorio, "indice_ivf.npz"),
+        "EMBEDDINGS_PROCESOS": str(args.procesos),
+        "ADMIN_ID": ADMIN_ID,
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+        # Sin trabajadores de alertas: se encolan (y descartan al llenarse) sin tocar SMTP/Twilio
+        "ALERTAS_TRABAJADORES": "0",
+        "LOG_NIVEL": os.environ.get("LOG_NIVEL") or "WARNING",
+    })
+
+    resultados = asyncio.run(ejecutar(args))
+    salida = {
+        "commit": commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "modelo": "real" if args.fotos else "sintetico",
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "resultados": resultados,
+    }
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(salida, f, indent=2)
+    if args.comparar:
+        with open(args.comparar) as f:
+            comparar(salida, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Arranque en frío: importación de main, preparación (galería y modelos) y primer reconocimiento.
+
+Cada repetición es un proceso nuevo de Python (como un reinicio en Render) que importa
+main, ejecuta el lifespan con el backend local y envía un /reconocer en cuanto la app
+acepta peticiones (la petición espera a que termine la preparación). Se informan los
+tiempos que registra EstadoArranque y el tiempo total desde que se lanzó el proceso.
+
+Sin --fotos el modelo facial se sustituye por el embedding sintético de bench_api, así
+que la etapa "modelos" solo mide la creación del pool; con --fotos se cargan y calientan
+los modelos reales de dlib (requiere face_recognition).
+
+Uso:
+    python -m benchmarks.bench_arranque --galeria 10000 --repeticiones 5
+    python -m benchmarks.bench_arranque --galeria 10000 --fotos rostro.jpg
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+
+ADMIN_ID = "bench-admin"
+
+
+async def sembrar(n, semilla):
+    from utils.codec_kp import codificar_kp
+    from utils.datos import datos
+
+    matriz = galeria_sintetica(n, np.random.default_rng(semilla))
+    await datos.iniciar()
+    try:
+        await datos.insertar_lote("personas", [{
+            "id": f"bench-{i}", "nombre": f"Nombre{i}", "apellidos": f"Apellido{i}",
+            "kp": codificar_kp(matriz[i]), "foto": "", "requisitoriado": False,
+        } for i in range(n)])
+    finally:
+        await datos.cerrar()
+    return matriz
+
+
+async def proceso_hijo(args):
+    # Se ejecuta en el proceso nuevo: todo lo anterior a esta importación es el arranque del intérprete
+    import main as app_main
+    import httpx
+
+    from benchmarks.bench_api import embedding_sintetico, foto_sintetica, sin_precalentar
+    from utils import rostros
+
+    if args.fotos:
+        foto = open(args.fotos[0], "rb").read()
+    else:
+        rostros.extraer_embedding = embedding_sintetico
+        rostros._precalentar = sin_precalentar
+        matriz = galeria_sintetica(args.galeria, np.random.default_rng(args.semilla))
+        foto = foto_sintetica(matriz, np.random.default_rng(args.semilla + 1))
+
+    async with app_main.app.router.lifespan_context(app_main.app):
+        transporte = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post("/reconocer", files={"file": ("rostro.jpg", foto, "image/jpeg")})
+            primera_peticion = time.perf_counter() - inicio
+            desde_lanzamiento = time.time() - args.lanzado
+
+    print(json.dumps({
+        **app_main.arranque.estado(),
+        "estado_http": respuesta.status_code,
+        "primera_peticion_s": round(primera_peticion, 3),
+        "primer_reconocimiento_desde_lanzamiento_s": round(desde_lanzamiento, 3),
+    }), flush=True)
+
+
+def resumir(resultados):
+    claves = ["importacion_s", "listo_s", "primer_reconocimiento_s", "primer_reconocimiento_desde_lanzamiento_s"]
+    claves += [f"etapa_{nombre}" for nombre in resultados[0]["etapas_s"]]
+    resumen = {}
+    for clave in claves:
+        if clave.startswith("etapa_"):
+            valores = [r["etapas_s"].get(clave[len("etapa_"):]) for r in resultados]
+        else:
+            valores = [r.get(clave) for r in resultados]
+        valores = [v for v in valores if v is not None]
+        if valores:
+            resumen[clave] = {"mediana": round(float(np.median(valores)), 3), "max": round(float(max(valores)), 3)}
+    return resumen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--galeria", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--fotos", nargs="*", default=[], help="Foto real con un rostro (usa face_recognition)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--lanzado", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        asyncio.run(proceso_hijo(args))
+        return
+
+    directorio = tempfile.mkdtemp(prefix="bench_arranque_")
+    os.environ.update({
+        "ALMACENAMIENTO": "local",
+        "ALMACENAMIENTO_SQLITE": os.path.join(directorio, "bench.db"),
+        "ALMACENAMIENTO_FOTOS": os.path.join(directorio, "fotos"),
+        "ESCRITURA_RESPALDO": os.path.join(directorio, "eventos_pendientes.jsonl"),
+        "ESCRITURA_RECHAZADAS": os.path.join(directorio, "eventos_rechazados.jsonl"),
+        "FOTOS_RESPALDO": os.path.join(directorio, "fotos_pendientes"),
+        "IVF_RUTA": os.path.join(directorio, "indice_ivf.npz"),
+        "EMBEDDINGS_PROCESOS": str(args.procesos),
+        "ADMIN_ID": ADMIN_ID,
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+        "ALERTAS_TRABAJADORES": "0",
+        "LOG_NIVEL": os.environ.get("LOG_NIVEL") or "WARNING",
+    })
+    asyncio.run(sembrar(args.galeria, args.semilla))
+
+    resultados = []
+    for _ in range(args.repeticiones):
+        comando = [sys.executable, "-m", "benchmarks.bench_arranque", "--hijo", "--lanzado", str(time.time()),
+                   "--galeria", str(args.galeria), "--semilla", str(args.semilla), "--fotos", *args.fotos]
+        salida = subprocess.run(comando, cwd=RAIZ, capture_output=True, text=True, check=True).stdout
+        resultado = json.loads(salida.strip().splitlines()[-1])
+        print(json.dumps(resultado), flush=True)
+        resultados.append(resultado)
+
+    resumen = resumir(resultados)
+    print(json.dumps({"galeria": args.galeria, "resumen": resumen}, indent=2))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"galeria": args.galeria, "resultados": resultados, "resumen": resumen}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
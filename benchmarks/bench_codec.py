@@ -0,0 +1,103 @@
+"""Precisión frente a memoria de los formatos de kp (json, f32, f16, i8).
+
+Para cada formato se codifica la galería sintética como se guardaría en la columna
+`kp`, se reconstruye y se empareja contra consultas genuinas (otra "foto" de una persona
+enrolada) e impostoras (personas no enroladas). Las galerías json/f32/f16 se cargan en
+float32; i8 se queda en memoria como MatrizCuantizada y se puntúa sobre los códigos int8.
+Todo se compara contra float32 con el umbral de coincidencia (0.75): error máximo del
+score, decisiones (coincide / no coincide) que cambian, aciertos de identidad y falsas
+aceptaciones.
+
+Uso:
+    python -m benchmarks.bench_codec --tamanos 10000,100000 --consultas 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica, consultas_sinteticas, percentiles  # noqa: E402
+from utils.codec_kp import FORMATOS, MatrizCuantizada, codificar_kp, decodificar_kp  # noqa: E402
+from utils.similitud import scores_hibridos, normas_filas, UMBRAL_COINCIDENCIA  # noqa: E402
+
+
+def galeria_formato(matriz, formato):
+    # Ida y vuelta por el codec, fila a fila como al cargar desde la base de datos
+    guardados = [codificar_kp(fila, formato) for fila in matriz]
+    bytes_kp = np.mean([len(json.dumps(kp).encode()) for kp in guardados])
+    reconstruida = np.stack([decodificar_kp(kp) for kp in guardados])
+    if formato == "i8":
+        reconstruida = MatrizCuantizada.desde(reconstruida)
+    return reconstruida, bytes_kp
+
+
+def medir(n, n_consultas, semilla):
+    rng = np.random.default_rng(semilla)
+    matriz = galeria_sintetica(n, rng)
+    elegidos, genuinas = consultas_sinteticas(matriz, n_consultas, rng)
+    impostoras = galeria_sintetica(n_consultas, rng)
+    consultas = np.concatenate([genuinas, impostoras])
+
+    normas = normas_filas(matriz)
+    base = [scores_hibridos(probe, matriz, normas) for probe in consultas]
+
+    resultados = []
+    for formato in FORMATOS:
+        galeria, bytes_kp = galeria_formato(matriz, formato)
+        normas_formato = normas_filas(galeria)
+        error_max, cambios, aciertos, falsas, tiempos = 0.0, 0, 0, 0, []
+        for i, probe in enumerate(consultas):
+            inicio = time.perf_counter()
+            scores = scores_hibridos(probe, galeria, normas_formato)
+            tiempos.append(time.perf_counter() - inicio)
+
+            error_max = max(error_max, float(np.abs(scores - base[i]).max()))
+            cambios += int(((scores > UMBRAL_COINCIDENCIA) != (base[i] > UMBRAL_COINCIDENCIA)).sum())
+            mejor = int(np.argmax(scores))
+            if i < n_consultas:
+                aciertos += int(mejor == elegidos[i] and scores[mejor] > UMBRAL_COINCIDENCIA)
+            else:
+                falsas += int(scores[mejor] > UMBRAL_COINCIDENCIA)
+
+        p50, p99 = percentiles(tiempos)
+        resultados.append({
+            "n": n,
+            "formato": formato,
+            "bytes_por_kp": round(float(bytes_kp), 1),
+            "memoria_galeria_mb": round(galeria.nbytes / 2 ** 20, 2),
+            "error_max_score": round(error_max, 6),
+            "decisiones_cambiadas": cambios,
+            "acierto_identidad": round(aciertos / n_consultas, 4),
+            "falsas_aceptaciones": round(falsas / n_consultas, 4),
+            "p50_ms": p50,
+            "p99_ms": p99,
+        })
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000")
+    parser.add_argument("--consultas", type=int, default=200, help="Genuinas (y otras tantas impostoras)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    resultados = []
+    for n in (int(t) for t in args.tamanos.split(",")):
+        for resultado in medir(n, args.consultas, args.semilla):
+            print(json.dumps(resultado), flush=True)
+            resultados.append(resultado)
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Alta masiva: /registrar_personas/lote (ZIP + CSV) frente a un /registrar_persona por persona.
+
+La app corre en proceso con el backend local, como en bench_api. Se arma un ZIP con N
+"fotos" sintéticas (embeddings serializados, ver bench_api) y su manifiesto.csv, y se
+mide:
+  - secuencial: un cliente que llama /registrar_persona una vez por persona, esperando
+    cada respuesta (lo que hace hoy el cliente para enrolar una promoción);
+  - lote: una sola petición al endpoint masivo, leyendo el NDJSON de progreso.
+
+Como el modelo sintético es instantáneo y la carpeta local no tiene latencia de red, se
+pueden simular ambos costos: --costo-ms (tiempo de la CNN por foto, dentro del proceso
+del pool) y --latencia-subida-ms (ida y vuelta al bucket por cada archivo). Las fotos se
+suben en segundo plano, así que además se informa cuánto tarda en vaciarse la cola del
+subidor después de cada modo.
+
+Uso:
+    python -m benchmarks.bench_enrolamiento --personas 2000 --procesos 4 --costo-ms 150 --latencia-subida-ms 80
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+from benchmarks.bench_api import ADMIN_ID, embedding_sintetico, foto_sintetica, sin_precalentar  # noqa: E402
+
+
+def embedding_con_costo(file_bytes, *args):
+    # Se ejecuta en el proceso del pool: simula el tiempo de detección y codificación
+    time.sleep(float(os.environ.get("BENCH_COSTO_MS", "0")) / 1000)
+    return embedding_sintetico(file_bytes)
+
+
+def armar_zip(matriz, rng, errores):
+    # Las últimas `errores` filas apuntan a fotos que no están en el ZIP
+    buffer = io.BytesIO()
+    manifiesto = io.StringIO()
+    escritor = csv.writer(manifiesto)
+    escritor.writerow(["archivo", "nombre", "apellidos", "correo", "requisitoriado"])
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as contenedor:
+        for i in range(len(matriz)):
+            archivo = f"fotos/alumno_{i}.jpg"
+            if i < len(matriz) - errores:
+                contenedor.writestr(archivo, foto_sintetica(matriz[i:i + 1], rng, ruido=0))
+            escritor.writerow([archivo, f"Alumno{i}", f"Lote {i}", f"alumno{i}@bench.local", "0"])
+        contenedor.writestr("manifiesto.csv", manifiesto.getvalue())
+    return buffer.getvalue()
+
+
+async def ejecutar(args):
+    import httpx
+    import main as app_main
+    from utils import rostros
+    from utils.seguridad import crear_token
+
+    rostros.extraer_embedding = embedding_con_costo
+    rostros._precalentar = sin_precalentar
+    rng = np.random.default_rng(args.semilla)
+    matriz = galeria_sintetica(args.personas + args.secuencial, rng)
+    cabeceras = {"Authorization": f"Bearer {crear_token({'sub': ADMIN_ID})}"}
+
+    subir_foto = app_main.datos.subir_foto
+
+    async def subir_con_latencia(*a):
+        await asyncio.sleep(args.latencia_subida_ms / 1000)
+        return await subir_foto(*a)
+
+    app_main.subidor_fotos.subir_foto = subir_con_latencia
+
+    async def esperar_fotos(fin):
+        await app_main.subidor_fotos.esperar()
+        return round(time.perf_counter() - fin, 2)
+
+    resultados = {}
+    async with app_main.app.router.lifespan_context(app_main.app):
+        await app_main.arranque.esperar()
+        transporte = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            inicio = time.perf_counter()
+            errores = 0
+            for i in range(args.secuencial):
+                foto = foto_sintetica(matriz[args.personas + i:args.personas + i + 1], rng, ruido=0)
+                respuesta = await cliente.post(
+                    "/registrar_persona", files={"file": ("rostro.jpg", foto, "image/jpeg")},
+                    data={"nombre": f"Uno{i}", "apellidos": "Secuencial", "correo": "uno@bench.local",
+                          "requisitoriado": "false"},
+                )
+                errores += respuesta.status_code >= 400
+            duracion = time.perf_counter() - inicio
+            resultados["secuencial"] = {"personas": args.secuencial, "errores": errores,
+                                        "duracion_s": round(duracion, 2),
+                                        "personas_por_s": round(args.secuencial / duracion, 2),
+                                        "fotos_pendientes_s": await esperar_fotos(inicio + duracion)}
+            print(json.dumps({"modo": "secuencial", **resultados["secuencial"]}), flush=True)
+
+            contenido = armar_zip(matriz[:args.personas], rng, args.errores)
+            total_antes = app_main.galeria.total
+            inicio = time.perf_counter()
+            eventos = []
+            async with cliente.stream("POST", "/registrar_personas/lote", headers=cabeceras,
+                                      files={"archivo": ("promocion.zip", contenido, "application/zip")}) as respuesta:
+                async for linea in respuesta.aiter_lines():
+                    if linea:
+                        eventos.append(json.loads(linea))
+                        if eventos[-1]["evento"] == "progreso":
+                            print(json.dumps(eventos[-1]), flush=True)
+            duracion = time.perf_counter() - inicio
+            resumen = eventos[-1]
+            resultados["lote"] = {
+                "estado_http": respuesta.status_code,
+                "personas": args.personas,
+                "filas_ok": sum(e["evento"] == "fila" and e["estado"] == "ok" for e in eventos),
+                "filas_error": sum(e["evento"] == "fila" and e["estado"] == "error" for e in eventos),
+                "en_galeria": app_main.galeria.total - total_antes,
+                "duracion_s": round(duracion, 2),
+                "personas_por_s": round(resumen.get("registradas", 0) / duracion, 2),
+                "fotos_pendientes_s": await esperar_fotos(inicio + duracion),
+                "resumen": resumen,
+            }
+            print(json.dumps({"modo": "lote", **resultados["lote"]}), flush=True)
+            resultados["fotos"] = app_main.subidor_fotos.estado()
+            print(json.dumps({"fotos": resultados["fotos"]}), flush=True)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--personas", type=int, default=2000)
+    parser.add_argument("--secuencial", type=int, default=100, help="Personas enroladas de a una para comparar")
+    parser.add_argument("--errores", type=int, default=10, help="Filas del manifiesto sin foto en el ZIP")
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--costo-ms", type=float, default=0)
+    parser.add_argument("--latencia-subida-ms", type=float, default=0)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_enrolamiento_")
+    os.environ.update({
+        "ALMACENAMIENTO": "local",
+        "ALMACENAMIENTO_SQLITE": os.path.join(directorio, "bench.db"),
+        "ALMACENAMIENTO_FOTOS": os.path.join(directorio, "fotos"),
+        "ESCRITURA_RESPALDO": os.path.join(directorio, "eventos_pendientes.jsonl"),
+        "ESCRITURA_RECHAZADAS": os.path.join(directorio, "eventos_rechazados.jsonl"),
+        "FOTOS_RESPALDO": os.path.join(directorio, "fotos_pendientes"),
+        "IVF_RUTA": os.path.join(directorio, "indice_ivf.npz"),
+        "EMBEDDINGS_PROCESOS": str(args.procesos),
+        "ADMIN_ID": ADMIN_ID,
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+        "ALERTAS_TRABAJADORES": "0",
+        "LOG_NIVEL": os.environ.get("LOG_NIVEL") or "WARNING",
+        "BENCH_COSTO_MS": str(args.costo_ms),
+    })
+
+    resultados = asyncio.run(ejecutar(args))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Latencia de /registrar_persona y bytes guardados con fotos de cámara (12 MP por defecto).
+
+La app corre en proceso con el backend local, como en bench_api, y el modelo facial es el
+sustituto sintético (el embedding viaja detrás del JPEG). Se comparan dos modos:
+  - sincrono: la foto original se sube al bucket antes de responder (comportamiento
+    anterior, reproducido sustituyendo subidor_fotos.encolar solo en el benchmark);
+  - fondo: la foto se encola, se comprime a FOTO_MAX_LADO, se genera la miniatura y ambas
+    se suben en segundo plano.
+La subida se simula con --latencia-subida-ms más el tiempo de transferencia a
+--ancho-banda-mbps, así que una foto de varios MB cuesta lo que costaría en la red.
+
+Uso:
+    python -m benchmarks.bench_fotos --peticiones 50 --concurrencia 4 --ancho-banda-mbps 20
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+from benchmarks.bench_api import ADMIN_ID, embedding_sintetico, jpeg_sintetico, percentiles, sin_precalentar  # noqa: E402
+
+
+async def medir_modo(cliente, fotos, concurrencia):
+    tiempos, errores = [], 0
+    restantes = iter(range(len(fotos)))
+
+    async def cliente_http():
+        nonlocal errores
+        for i in restantes:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post(
+                "/registrar_persona", files={"file": ("camara.jpg", fotos[i], "image/jpeg")},
+                data={"nombre": f"Foto{i}", "apellidos": "Bench", "correo": "foto@bench.local",
+                      "requisitoriado": "false"},
+            )
+            tiempos.append(time.perf_counter() - inicio)
+            errores += respuesta.status_code >= 400
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente_http() for _ in range(concurrencia)))
+    return time.perf_counter() - inicio, tiempos, errores
+
+
+async def ejecutar(args):
+    import httpx
+    import main as app_main
+    from utils import rostros
+
+    rostros.extraer_embedding = embedding_sintetico
+    rostros._precalentar = sin_precalentar
+    rng = np.random.default_rng(args.semilla)
+    matriz = galeria_sintetica(2 * args.peticiones, rng)
+    original = jpeg_sintetico(args.ancho, args.alto, rng)
+
+    def foto(i):
+        buffer = io.BytesIO()
+        np.save(buffer, matriz[i])
+        return original + buffer.getvalue()
+
+    subir_foto = app_main.datos.subir_foto
+    bytes_sincronos = 0
+
+    async def subir_con_latencia(nombre, contenido, content_type):
+        segundos = args.latencia_subida_ms / 1000 + len(contenido) * 8 / (args.ancho_banda_mbps * 1e6)
+        await asyncio.sleep(segundos)
+        return await subir_foto(nombre, contenido, content_type)
+
+    async def subir_original(contenido, foto=None):
+        # Comportamiento anterior: la original, tal cual, antes de responder
+        nonlocal bytes_sincronos
+        bytes_sincronos += len(contenido)
+        return await subir_con_latencia(f"{uuid4()}_camara.jpg", contenido, "image/jpeg")
+
+    app_main.subidor_fotos.subir_foto = subir_con_latencia
+    encolar = app_main.subidor_fotos.encolar
+
+    resultados = {"original_bytes": len(original), "original_lado": [args.ancho, args.alto]}
+    async with app_main.app.router.lifespan_context(app_main.app):
+        await app_main.arranque.esperar()
+        transporte = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            for n, modo in enumerate(("sincrono", "fondo")):
+                app_main.subidor_fotos.encolar = subir_original if modo == "sincrono" else encolar
+                fotos = [foto(n * args.peticiones + i) for i in range(args.peticiones)]
+                duracion, tiempos, errores = await medir_modo(cliente, fotos, args.concurrencia)
+                fin = time.perf_counter()
+                await app_main.subidor_fotos.esperar()
+                resultados[modo] = {
+                    "peticiones": args.peticiones,
+                    "errores": errores,
+                    "personas_por_s": round(args.peticiones / duracion, 2),
+                    **percentiles(tiempos),
+                    "fotos_pendientes_s": round(time.perf_counter() - fin, 2),
+                }
+                if modo == "sincrono":
+                    resultados[modo]["bytes_por_persona"] = bytes_sincronos // args.peticiones
+                else:
+                    estado = app_main.subidor_fotos.estado()
+                    resultados[modo]["bytes_por_persona"] = estado["bytes_subidos"] // max(estado["subidas"], 1)
+                    resultados[modo]["fotos"] = estado
+                print(json.dumps({"modo": modo, **resultados[modo]}), flush=True)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peticiones", type=int, default=50)
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--ancho", type=int, default=4000)
+    parser.add_argument("--alto", type=int, default=3000)
+    parser.add_argument("--latencia-subida-ms", type=float, default=80)
+    parser.add_argument("--ancho-banda-mbps", type=float, default=20)
+    parser.add_argument("--procesos", type=int, default=2)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_fotos_")
+    os.environ.update({
+        "ALMACENAMIENTO": "local",
+        "ALMACENAMIENTO_SQLITE": os.path.join(directorio, "bench.db"),
+        "ALMACENAMIENTO_FOTOS": os.path.join(directorio, "fotos"),
+        "ESCRITURA_RESPALDO": os.path.join(directorio, "eventos_pendientes.jsonl"),
+        "ESCRITURA_RECHAZADAS": os.path.join(directorio, "eventos_rechazados.jsonl"),
+        "FOTOS_RESPALDO": os.path.join(directorio, "fotos_pendientes"),
+        "IVF_RUTA": os.path.join(directorio, "indice_ivf.npz"),
+        "EMBEDDINGS_PROCESOS": str(args.procesos),
+        "ADMIN_ID": ADMIN_ID,
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+        "ALERTAS_TRABAJADORES": "0",
+        "LOG_NIVEL": os.environ.get("LOG_NIVEL") or "WARNING",
+    })
+
+    resultados = asyncio.run(ejecutar(args))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Memoria total de N workers con la galería privada (en memoria) o compartida (mapeada).
+
+Se lanza N procesos nuevos que, como workers de uvicorn, cargan la galería y atienden
+una búsqueda. En modo "privada" cada uno construye su propia matriz; en modo
+"compartida" el primero publica la instantánea en GALERIA_COMPARTIDA_DIR y los demás
+la mapean. Se informa la suma de PSS (memoria proporcional: las páginas compartidas se
+reparten entre los procesos que las usan), que es lo que ocupa el conjunto en la máquina.
+
+Uso:
+    python -m benchmarks.bench_galeria_compartida --galeria 200000 --workers 1,2,4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+
+
+def memoria_mb():
+    valores = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for linea in f:
+            partes = linea.split()
+            if partes[0] in ("Rss:", "Pss:"):
+                valores[partes[0][:-1].lower()] = int(partes[1]) / 1024
+    return valores
+
+
+def worker(modo, directorio, n, semilla, listo, continuar, resultados):
+    if modo == "compartida":
+        os.environ["GALERIA_COMPARTIDA_DIR"] = directorio
+    from utils.galeria import GaleriaResidente
+    from utils.similitud import scores_hibridos
+
+    galeria = GaleriaResidente(directorio_compartido=directorio if modo == "compartida" else "")
+    inicio = time.perf_counter()
+    if not galeria.usar_publicada(desde=0):
+        matriz = galeria_sintetica(n, np.random.default_rng(semilla))
+        galeria.cargar([{"id": f"p{i}", "nombre": f"N{i}", "apellidos": "A", "kp": matriz[i]} for i in range(n)])
+        del matriz
+    carga = time.perf_counter() - inicio
+
+    instantanea = galeria.instantanea
+    scores_hibridos(instantanea.matriz[0], instantanea.matriz, instantanea.normas)
+    listo.release()
+    # Se mide cuando todos los workers tienen la galería cargada
+    continuar.wait()
+    resultados.put({"carga_s": round(carga, 2), **memoria_mb()})
+
+
+def medir(modo, workers, n, semilla):
+    directorio = tempfile.mkdtemp(prefix="bench_galeria_")
+    contexto = multiprocessing.get_context("spawn")
+    listo, continuar, resultados = contexto.Semaphore(0), contexto.Event(), contexto.Queue()
+    procesos = []
+    try:
+        for i in range(workers):
+            proceso = contexto.Process(target=worker, args=(modo, directorio, n, semilla, listo, continuar, resultados))
+            proceso.start()
+            procesos.append(proceso)
+            if i == 0:
+                # El primero publica antes de que arranquen los demás (como el primer worker en subir)
+                listo.acquire()
+        for _ in range(workers - 1):
+            listo.acquire()
+        continuar.set()
+        medidas = [resultados.get() for _ in range(workers)]
+    finally:
+        for proceso in procesos:
+            proceso.join()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        "modo": modo,
+        "workers": workers,
+        "galeria": n,
+        "pss_total_mb": round(sum(m["pss"] for m in medidas), 1),
+        "rss_por_worker_mb": round(float(np.mean([m["rss"] for m in medidas])), 1),
+        "carga_s": [m["carga_s"] for m in medidas],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--galeria", type=int, default=200000)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    resultados = []
+    for workers in (int(w) for w in args.workers.split(",")):
+        for modo in ("privada", "compartida"):
+            resultado = medir(modo, workers, args.galeria, args.semilla)
+            print(json.dumps(resultado), flush=True)
+            resultados.append(resultado)
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
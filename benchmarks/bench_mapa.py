@@ -0,0 +1,177 @@
+"""Consultas del mapa de reconocimientos sobre un historial grande, en proceso y sin servicios externos.
+
+Se siembran --reconocimientos puntos (por defecto 500k) repartidos en focos alrededor de
+Trujillo y a lo largo de un año, con el backend local, y se mide:
+  - antes: la consulta que hacía /mapa-reconocimientos (los 100 más recientes con el join
+    de personas), que no muestra el resto del historial;
+  - construcción del índice espacial en memoria (carga completa) y actualización
+    incremental tras insertar --nuevos reconocimientos;
+  - puntos: /mapa-reconocimientos sin zoom (100 más recientes dentro de una caja);
+  - zoom: /mapa-reconocimientos?zoom=z con una vista de 4x3 teselas, en frío (caché vacía)
+    y en caliente, con el tamaño de la respuesta y los puntos que resume;
+  - la misma vista con un rango de fechas de un mes.
+
+Uso:
+    python -m benchmarks.bench_mapa --reconocimientos 500000 --zooms 3,6,9,12,15
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+from benchmarks.bench_api import ADMIN_ID, percentiles, sin_precalentar  # noqa: E402
+
+CENTRO = (-8.11, -79.03)
+LOTE_SIEMBRA = 20000
+
+
+def reconocimientos_sinteticos(n, personas, rng):
+    # Focos con dispersión distinta (plazas, avenidas) más un fondo uniforme en la región
+    focos = rng.uniform((-9.1, -79.1), (-8.0, -77.0), size=(40, 2))
+    focos[:5] = np.asarray(CENTRO) + rng.normal(0, 0.02, size=(5, 2))
+    foco = rng.integers(len(focos), size=n)
+    dispersion = rng.choice([0.001, 0.01, 0.05], size=n)[:, None]
+    coordenadas = focos[foco] + rng.normal(size=(n, 2)) * dispersion
+    fondo = rng.random(n) < 0.1
+    coordenadas[fondo] = rng.uniform((-9.1, -79.1), (-8.0, -77.0), size=(int(fondo.sum()), 2))
+    dias = np.datetime64("today") - rng.integers(0, 365, size=n).astype("timedelta64[D]")
+    segundos = rng.integers(0, 86400, size=n)
+    return [{
+        "persona_id": f"bench-{rng.integers(personas)}",
+        "fecha": str(dias[i]),
+        "hora": f"{segundos[i] // 3600:02d}:{segundos[i] // 60 % 60:02d}:{segundos[i] % 60:02d}",
+        "latitud": round(float(coordenadas[i, 0]), 6),
+        "longitud": round(float(coordenadas[i, 1]), 6),
+    } for i in range(n)]
+
+
+def vista(zoom, ancho=4, alto=3):
+    # Caja de ancho x alto teselas centrada en CENTRO
+    lat, lon = CENTRO
+    grados_x = 360 / 2 ** zoom
+    grados_y = grados_x * math.cos(math.radians(lat))
+    return {"min_lat": lat - grados_y * alto / 2 + 1e-6, "max_lat": lat + grados_y * alto / 2 - 1e-6,
+            "min_lon": lon - grados_x * ancho / 2 + 1e-6, "max_lon": lon + grados_x * ancho / 2 - 1e-6}
+
+
+async def medir(cliente, cabeceras, parametros, repeticiones):
+    tiempos, tamano, cuerpo = [], 0, None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        respuesta = await cliente.get("/mapa-reconocimientos", params=parametros, headers=cabeceras)
+        tiempos.append(time.perf_counter() - inicio)
+        respuesta.raise_for_status()
+        tamano, cuerpo = len(respuesta.content), respuesta.json()
+    return tiempos, tamano, cuerpo
+
+
+async def ejecutar(args):
+    import httpx
+    import main as app_main
+    from utils import rostros
+    from utils.seguridad import crear_token
+
+    rostros._precalentar = sin_precalentar
+    rng = np.random.default_rng(args.semilla)
+    cabeceras = {"Authorization": f"Bearer {crear_token({'sub': ADMIN_ID})}"}
+    indice = app_main.indice_mapa
+    resultados = {}
+
+    async with app_main.app.router.lifespan_context(app_main.app):
+        await app_main.arranque.esperar()
+        datos = app_main.datos
+        matriz = galeria_sintetica(args.personas, rng)
+        await datos.insertar_lote("personas", [{
+            "id": f"bench-{i}", "nombre": f"Nombre{i}", "apellidos": f"Apellido{i}", "correo": "",
+            "kp": matriz[i].tolist(), "foto": "", "requisitoriado": False,
+        } for i in range(args.personas)])
+        await app_main.cargar_galeria()
+        for inicio in range(0, args.reconocimientos, LOTE_SIEMBRA):
+            n = min(LOTE_SIEMBRA, args.reconocimientos - inicio)
+            await datos.insertar_lote("reconocimientos", reconocimientos_sinteticos(n, args.personas, rng))
+
+        inicio = time.perf_counter()
+        await datos.recientes("reconocimientos", "persona_id, latitud, longitud, fecha, hora, personas(nombre, apellidos)", 100)
+        resultados["antes_100_recientes_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+
+        inicio = time.perf_counter()
+        await indice.reconstruir()
+        resultados["indice"] = {"puntos": len(indice.instantanea),
+                                "construccion_s": round(time.perf_counter() - inicio, 2)}
+        await datos.insertar_lote("reconocimientos", reconocimientos_sinteticos(args.nuevos, args.personas, rng))
+        inicio = time.perf_counter()
+        await indice.actualizar()
+        resultados["indice"]["actualizacion_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        resultados["indice"]["nuevos"] = args.nuevos
+        print(json.dumps({"antes_100_recientes_ms": resultados["antes_100_recientes_ms"], **resultados["indice"]}),
+              flush=True)
+
+        transporte = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            tiempos, tamano, _ = await medir(cliente, cabeceras, vista(12), args.repeticiones)
+            resultados["puntos"] = {"bytes": tamano, **percentiles(tiempos)}
+            print(json.dumps({"modo": "puntos", **resultados["puntos"]}), flush=True)
+
+            resultados["zoom"] = []
+            hace_un_mes = str(np.datetime64("today") - np.timedelta64(30, "D"))
+            for zoom in (int(z) for z in args.zooms.split(",")):
+                for rango in ({}, {"desde": hace_un_mes}):
+                    parametros = {**vista(zoom), "zoom": zoom, **rango}
+                    frio, _, _ = await medir(cliente, cabeceras, parametros, 1)
+                    caliente, tamano, cuerpo = await medir(cliente, cabeceras, parametros, args.repeticiones)
+                    fila = {"zoom": zoom, "desde": rango.get("desde"), "teselas": cuerpo["teselas"],
+                            "clusters": len(cuerpo["clusters"]), "puntos_resumidos": cuerpo["total"],
+                            "bytes": tamano, "frio_ms": round(frio[0] * 1000, 2), **percentiles(caliente)}
+                    resultados["zoom"].append(fila)
+                    print(json.dumps(fila), flush=True)
+        resultados["estado"] = indice.estado()
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reconocimientos", type=int, default=500000)
+    parser.add_argument("--personas", type=int, default=2000)
+    parser.add_argument("--nuevos", type=int, default=1000)
+    parser.add_argument("--zooms", default="3,6,9,12,15")
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="bench_mapa_")
+    os.environ.update({
+        "ALMACENAMIENTO": "local",
+        "ALMACENAMIENTO_SQLITE": os.path.join(directorio, "bench.db"),
+        "ALMACENAMIENTO_FOTOS": os.path.join(directorio, "fotos"),
+        "ESCRITURA_RESPALDO": os.path.join(directorio, "eventos_pendientes.jsonl"),
+        "ESCRITURA_RECHAZADAS": os.path.join(directorio, "eventos_rechazados.jsonl"),
+        "FOTOS_RESPALDO": os.path.join(directorio, "fotos_pendientes"),
+        "IVF_RUTA": os.path.join(directorio, "indice_ivf.npz"),
+        "EMBEDDINGS_PROCESOS": "1",
+        "ADMIN_ID": ADMIN_ID,
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "bench",
+        "ALERTAS_TRABAJADORES": "0",
+        # Solo se actualiza cuando lo pide el benchmark
+        "MAPA_INTERVALO_S": "0",
+        "MAPA_RECONSTRUIR_S": "0",
+        "LOG_NIVEL": os.environ.get("LOG_NIVEL") or "WARNING",
+    })
+
+    resultados = asyncio.run(ejecutar(args))
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"parametros": vars(args), "resultados": resultados}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Latencia de decodificación/detección/codificación y deriva del embedding
+según la resolución máxima de detección.
+
+La referencia es el pipeline sin reducción (decodificación y detección a
+resolución completa). Para cada foto y cada configuración se reporta el tiempo
+por etapa, la distancia L2 al embedding de referencia y el score híbrido entre
+ambos (el umbral de coincidencia es 0.75).
+
+Uso (requiere face_recognition y fotos reales con un rostro):
+    python -m benchmarks.bench_preprocesado fotos/*.jpg --lados 0,1600,1200,800,640,480
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rostros import extraer_embedding, _precalentar  # noqa: E402
+from utils.similitud import score_similitud_hibrida  # noqa: E402
+
+
+def medir(contenido, max_decodificacion, max_deteccion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        embedding, etapas = extraer_embedding(contenido, max_decodificacion, max_deteccion)
+        tiempos.append(etapas)
+    promedio = {
+        etapa: round(float(np.median([t[etapa] for t in tiempos])) * 1000, 1)
+        for etapa in tiempos[0]
+    }
+    return np.array(embedding), promedio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fotos", nargs="+")
+    parser.add_argument("--lados", default="0,1600,1200,800,640,480",
+                        help="Lados máximos de detección a probar (0 = original)")
+    parser.add_argument("--max-decodificacion", type=int, default=1600)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--salida", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    _precalentar()
+    resultados = []
+    for ruta in args.fotos:
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        try:
+            referencia, etapas = medir(contenido, 0, 0, args.repeticiones)
+        except ValueError as e:
+            print(f"⚠️ {ruta}: {e}")
+            continue
+        resultados.append({"foto": ruta, "decodificacion": 0, "deteccion": 0, "ms": etapas, "l2": 0.0, "score": 1.0})
+        print(json.dumps(resultados[-1]))
+
+        for lado in (int(x) for x in args.lados.split(",")):
+            if not lado:
+                continue
+            try:
+                embedding, etapas = medir(contenido, args.max_decodificacion, lado, args.repeticiones)
+            except ValueError:
+                resultados.append({"foto": ruta, "decodificacion": args.max_decodificacion, "deteccion": lado,
+                                   "error": "rostro no detectado"})
+                print(json.dumps(resultados[-1]))
+                continue
+            resultados.append({
+                "foto": ruta,
+                "decodificacion": args.max_decodificacion,
+                "deteccion": lado,
+                "ms": etapas,
+                "l2": round(float(np.linalg.norm(embedding - referencia)), 4),
+                "score": round(float(score_similitud_hibrida(embedding, referencia)), 4),
+            })
+            print(json.dumps(resultados[-1]))
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""Consistencia entre la tabla personas y una galería residente alimentada por el registro de cambios.
+
+Con el backend local (SQLite en un directorio temporal) se siembra una galería y varios
+escritores concurrentes hacen altas, cambios de datos o de kp y bajas directamente en la
+base, como lo harían otros workers o instancias. Una galería "seguidora" se mantiene al
+día solo con SincronizadorGaleria mientras un lector busca sin parar en ella. Parte de
+las escrituras también se aplican a la seguidora en el momento (como el worker que las
+hizo), para comprobar que volver a recibirlas por el registro no cambia nada.
+
+Al terminar se sincroniza una última vez y se compara fila por fila (ids, nombres,
+apellidos, requisitoriado y kp) contra la base, y que cada persona se encuentre a sí
+misma como primera coincidencia. Después se fuerza una resincronización completa
+(más cambios pendientes que --max-delta) y se vuelve a comparar. Sale con código 1 si
+hay alguna diferencia.
+
+Uso:
+    python -m benchmarks.consistencia_galeria --galeria 20000 --escritores 8 --operaciones 5000
+    python -m benchmarks.consistencia_galeria --galeria 20000 --cuantizada --formato i8
+    python -m benchmarks.consistencia_galeria --galeria 20000 --compartida
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_ann import galeria_sintetica  # noqa: E402
+from utils.ann import EmparejadorGaleria  # noqa: E402
+from utils.cambios import COLUMNAS_GALERIA, SincronizadorGaleria  # noqa: E402
+from utils.codec_kp import codificar_kp, decodificar_kp  # noqa: E402
+from utils.datos_local import DatosLocales  # noqa: E402
+from utils.galeria import GaleriaResidente  # noqa: E402
+
+
+def persona_sintetica(persona_id, vector, rng):
+    return {
+        "id": persona_id,
+        "nombre": f"Nombre{rng.integers(1e9)}",
+        "apellidos": f"Apellido{rng.integers(1e9)}",
+        "requisitoriado": bool(rng.random() < 0.05),
+        "kp": vector,
+    }
+
+
+def fila_db(persona, formato):
+    return {**persona, "kp": codificar_kp(persona["kp"], formato), "foto": ""}
+
+
+async def escritor(datos, galeria, vivos, rng, operaciones, formato, fraccion_local, contador):
+    # vivos: ids presentes en la base (compartido entre escritores)
+    for _ in range(operaciones):
+        operacion = rng.choice(["alta", "datos", "kp", "baja"], p=[0.35, 0.25, 0.2, 0.2])
+        local = rng.random() < fraccion_local
+        if operacion == "alta" or not vivos:
+            persona = persona_sintetica(f"c-{contador['altas']}-{rng.integers(1e9)}",
+                                        galeria_sintetica(1, rng)[0], rng)
+            contador["altas"] += 1
+            await datos.insertar_persona(fila_db(persona, formato))
+            vivos.add(persona["id"])
+            if local:
+                galeria.agregar({**persona, "kp": codificar_kp(persona["kp"], formato)})
+            continue
+
+        persona_id = random.Random(int(rng.integers(1e9))).choice(tuple(vivos))
+        if operacion == "baja":
+            vivos.discard(persona_id)
+            await datos.eliminar_persona(persona_id)
+            if local:
+                galeria.eliminar(persona_id)
+        elif operacion == "datos":
+            campos = {"nombre": f"Editado{rng.integers(1e9)}", "requisitoriado": bool(rng.random() < 0.5)}
+            await datos.actualizar_persona(persona_id, campos)
+            if local:
+                galeria.actualizar_datos(persona_id, campos)
+        else:
+            kp = codificar_kp(galeria_sintetica(1, rng)[0], formato)
+            await datos.actualizar_persona(persona_id, {"kp": kp})
+            if local:
+                galeria.actualizar_datos(persona_id, {"kp": kp})
+        # Cede el turno para que las escrituras de los distintos escritores se intercalen
+        await asyncio.sleep(0)
+
+
+async def lector(galeria, emparejador, detener, rng, resultado):
+    # Búsquedas continuas mientras llegan los cambios: nunca debe aparecer una baja
+    while not detener.is_set():
+        instantanea = galeria.instantanea
+        if len(instantanea):
+            i = int(rng.integers(len(instantanea)))
+            indices, _ = emparejador.buscar(instantanea.matriz[i], instantanea, umbral=-1, k=5)
+            resultado["busquedas"] += 1
+            if instantanea.activos is not None and len(indices) and not instantanea.activos[indices].all():
+                resultado["bajas_devueltas"] += 1
+        await asyncio.sleep(0.001)
+
+
+async def comparar(datos, galeria, emparejador, tolerancia, muestra, rng):
+    esperadas = {}
+    for fila in await datos.listar_todo("personas", COLUMNAS_GALERIA):
+        vector = decodificar_kp(fila["kp"])
+        if vector is not None:
+            esperadas[fila["id"]] = (fila, vector)
+
+    instantanea = galeria.instantanea
+    diferencias = []
+    faltantes = set(esperadas) - set(instantanea.posiciones)
+    sobrantes = set(instantanea.posiciones) - set(esperadas)
+    diferencias += [f"falta {persona_id}" for persona_id in faltantes]
+    diferencias += [f"sobra {persona_id}" for persona_id in sobrantes]
+    if instantanea.activos is not None and int(instantanea.activos.sum()) != len(instantanea.posiciones):
+        diferencias.append("filas activas distintas de las posiciones")
+
+    for persona_id, (fila, vector) in esperadas.items():
+        i = instantanea.posiciones.get(persona_id)
+        if i is None:
+            continue
+        persona = instantanea.persona(i)
+        if instantanea.activos is not None and not instantanea.activos[i]:
+            diferencias.append(f"{persona_id}: fila marcada como baja")
+        for campo in ("nombre", "apellidos"):
+            if (persona[campo] or "") != (fila.get(campo) or ""):
+                diferencias.append(f"{persona_id}: {campo} {persona[campo]!r} != {fila.get(campo)!r}")
+        if persona["requisitoriado"] != bool(fila.get("requisitoriado")):
+            diferencias.append(f"{persona_id}: requisitoriado")
+        if not np.allclose(instantanea.matriz[i], vector, atol=tolerancia):
+            diferencias.append(f"{persona_id}: kp")
+
+    # Cada persona debe encontrarse a sí misma (comprueba normas y máscara de bajas)
+    ids = list(esperadas)
+    for persona_id in (ids[j] for j in rng.choice(len(ids), min(muestra, len(ids)), replace=False)):
+        indices, _ = emparejador.buscar(esperadas[persona_id][1], instantanea, umbral=-1, k=1)
+        if not len(indices) or instantanea.ids[indices[0]] != persona_id:
+            diferencias.append(f"{persona_id}: no es su propia primera coincidencia")
+    return len(esperadas), diferencias
+
+
+async def ejecutar(args):
+    directorio = tempfile.mkdtemp(prefix="consistencia_galeria_")
+    rng = np.random.default_rng(args.semilla)
+    datos = DatosLocales(os.path.join(directorio, "consistencia.db"), os.path.join(directorio, "fotos"))
+    await datos.iniciar()
+    try:
+        matriz = galeria_sintetica(args.galeria, rng)
+        await datos.insertar_lote("personas", [
+            fila_db(persona_sintetica(f"p-{i}", matriz[i], rng), args.formato) for i in range(args.galeria)
+        ])
+
+        galeria = GaleriaResidente(cuantizada=args.cuantizada,
+                                   directorio_compartido=os.path.join(directorio, "galeria") if args.compartida else "")
+        emparejador = EmparejadorGaleria(modo=args.modo, ruta="")
+        tiempos_recarga = []
+
+        async def recargar():
+            inicio = time.perf_counter()
+            galeria.cargar(await datos.listar_todo("personas", COLUMNAS_GALERIA))
+            await asyncio.to_thread(emparejador.preparar, galeria.instantanea)
+            tiempos_recarga.append(time.perf_counter() - inicio)
+
+        sincronizador = SincronizadorGaleria(galeria, datos, recargar, intervalo_s=args.intervalo,
+                                             max_delta=args.max_delta, resincronizar_s=0)
+        await sincronizador.marcar_inicio()
+        await recargar()
+
+        # Tiempo de cada ronda de sincronización, para comparar con una recarga completa
+        tiempos_ronda = []
+        sincronizar = sincronizador.sincronizar
+
+        async def sincronizar_medido():
+            inicio = time.perf_counter()
+            aplicados = await sincronizar()
+            if aplicados:
+                tiempos_ronda.append((time.perf_counter() - inicio, aplicados))
+            return aplicados
+
+        sincronizador.sincronizar = sincronizar_medido
+        sincronizador.iniciar()
+
+        vivos = {f"p-{i}" for i in range(args.galeria)}
+        contador = {"altas": 0}
+        lectura = {"busquedas": 0, "bajas_devueltas": 0}
+        detener = asyncio.Event()
+        tarea_lector = asyncio.create_task(lector(galeria, emparejador, detener, rng, lectura))
+        inicio = time.perf_counter()
+        por_escritor = args.operaciones // args.escritores
+        await asyncio.gather(*(
+            escritor(datos, galeria, vivos, np.random.default_rng(args.semilla + 1 + n), por_escritor,
+                     args.formato, args.fraccion_local, contador)
+            for n in range(args.escritores)
+        ))
+        escritura_s = time.perf_counter() - inicio
+        detener.set()
+        await tarea_lector
+        await sincronizador.cerrar()
+
+        # Última ronda: todo lo registrado queda aplicado
+        while await sincronizador.sincronizar():
+            pass
+        tolerancia = 2e-2 if args.cuantizada or args.formato == "i8" else 2e-3
+        total, diferencias = await comparar(datos, galeria, emparejador, tolerancia, args.muestra, rng)
+        resultado = {
+            "galeria_inicial": args.galeria,
+            "personas_finales": total,
+            "operaciones": por_escritor * args.escritores,
+            "escritores": args.escritores,
+            "escritura_s": round(escritura_s, 2),
+            "sincronizacion": sincronizador.estado(),
+            "galeria": galeria.estado(),
+            "lector": lectura,
+            "ronda_media_ms": round(1000 * float(np.mean([t for t, _ in tiempos_ronda])), 2) if tiempos_ronda else None,
+            "filas_por_ronda": round(float(np.mean([n for _, n in tiempos_ronda])), 1) if tiempos_ronda else None,
+            "recarga_completa_ms": round(1000 * tiempos_recarga[0], 2),
+            "diferencias": len(diferencias) + lectura["bajas_devueltas"],
+        }
+
+        # Resincronización completa: más cambios pendientes de los que conviene aplicar uno a uno
+        resincronizaciones = sincronizador.resincronizaciones
+        await asyncio.gather(*(
+            escritor(datos, galeria, vivos, np.random.default_rng(args.semilla + 100 + n),
+                     (args.max_delta + 50) // 4, args.formato, 0, contador)
+            for n in range(4)
+        ))
+        await sincronizador.sincronizar()
+        _, diferencias_resincronizacion = await comparar(datos, galeria, emparejador, tolerancia, args.muestra, rng)
+        resultado["resincronizacion_forzada"] = sincronizador.resincronizaciones > resincronizaciones
+        resultado["diferencias_tras_resincronizar"] = len(diferencias_resincronizacion)
+
+        for diferencia in (diferencias + diferencias_resincronizacion)[:20]:
+            print("❌", diferencia, file=sys.stderr)
+        print(json.dumps(resultado, indent=2))
+        return (not diferencias and not diferencias_resincronizacion and not lectura["bajas_devueltas"]
+                and resultado["resincronizacion_forzada"])
+    finally:
+        await datos.cerrar()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--galeria", type=int, default=20000)
+    parser.add_argument("--escritores", type=int, default=8)
+    parser.add_argument("--operaciones", type=int, default=5000)
+    parser.add_argument("--fraccion-local", type=float, default=0.3,
+                        help="Fracción de escrituras que también se aplican a la galería en el momento")
+    parser.add_argument("--intervalo", type=float, default=0.05, help="Segundos entre rondas de sincronización")
+    parser.add_argument("--max-delta", type=int, default=2000)
+    parser.add_argument("--muestra", type=int, default=500, help="Personas que se buscan a sí mismas al comparar")
+    parser.add_argument("--modo", choices=["exacto", "ivf"], default="exacto")
+    parser.add_argument("--cuantizada", action="store_true", help="Galería residente en int8")
+    parser.add_argument("--compartida", action="store_true", help="Galería publicada en disco (varios workers)")
+    parser.add_argument("--formato", choices=["json", "f32", "f16", "i8"], default="f16", help="Formato del kp en la base")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+
+    if not asyncio.run(ejecutar(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
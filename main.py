@@ -1,54 +1,225 @@
+# El arranque en frío se mide desde el inicio de la importación de main
+import time
+INICIO_ARRANQUE = time.perf_counter()
+
 # FastAPI Core
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Body, BackgroundTasks
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Body, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-
-# Librerías externas
-import face_recognition
-import numpy as np
-from scipy.spatial.distance import cosine, euclidean, cityblock
-from PIL import Image
-from fpdf import FPDF
-from jose import JWTError, jwt
-from twilio.rest import Client
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-import requests
-import csv
+from fastapi.staticfiles import StaticFiles
 
 # Utilidades del sistema
 import os
-import io
-import json
-from uuid import uuid4
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 import random
-from datetime import datetime, timedelta, date
+from datetime import datetime
 from dotenv import load_dotenv
 
-# Supabase
-from supabase import create_client
-from supabase_client import supabase
-
 # Funciones propias
 from utils.seguridad import crear_token, verificar_token, verificar_token_general
+from utils.datos import datos, ALMACENAMIENTO
+from utils.galeria import galeria
+from utils.codec_kp import codificar_kp
+from utils.ann import emparejador
+from utils.rostros import ejecutor_embeddings, ColaSaturada
+from utils.seguimiento import SeguidorRostros
+from utils.dedupe import cache_reconocidos
+from utils.escritura import SumideroEventos
+from utils.plantillas import EntrenadorPlantillas
+from utils.alertas import DespachadorAlertas, TransporteCorreo, TransporteSMS
+from utils.reportes import GeneradorReportes, MODOS_REPORTE, bloques
+from utils.estadisticas import EstadisticasDashboard
+from utils.cambios import SincronizadorGaleria
+from utils.mapa import IndiceMapa, MapaNoListo
+from utils.enrolamiento import EnroladorMasivo
+from utils.fotos import SubidorFotos, url_miniatura
+from utils.arranque import EstadoArranque, ArranqueFallido, ARRANQUE_REINTENTO_S, ARRANQUE_REINTENTO_MAX_S
+from utils.registro import configurar_registro
+from utils.metricas import metricas, cronometro, perfilador, ETAPAS, PETICIONES, COINCIDENCIAS, PERFILADOR_ACTIVO
 
 
 load_dotenv()
 
+configurar_registro()
+logger = logging.getLogger("facecontrol")
 
 ADMIN_ID = os.getenv("ADMIN_ID")
+# max-age de las respuestas agrupadas del mapa (el navegador reutiliza teselas al desplazarse)
+MAPA_CACHE_HTTP_S = int(os.getenv("MAPA_CACHE_HTTP_S", "5"))
 SECRET_KEY = os.getenv("SECRET_KEY") 
 ALGORITHM = "HS256"
-BUCKET_NAME = os.getenv("BUCKET_NAME", "rostros")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+arranque = EstadoArranque(INICIO_ARRANQUE)
+
+
+async def insertar_filas(tabla, filas):
+    await datos.insertar_lote(tabla, filas)
+    personas = [fila["persona_id"] for fila in filas] if tabla == "reconocimientos" else ()
+    estadisticas.registrar_insertadas(tabla, len(filas), personas)
+    generador_reportes.marcar_cambio(tabla)
+    if tabla == "reconocimientos":
+        indice_mapa.marcar_cambio()
+
+
+# reconocimientos, entrenamientos y alertas se escriben en lotes, fuera de la respuesta
+sumidero = SumideroEventos(insertar_filas)
 
 
-app = FastAPI()
+async def guardar_kps(kps):
+    await datos.actualizar_lote("personas", {persona_id: {"kp": codificar_kp(kp)} for persona_id, kp in kps.items()})
+
+
+# Entrenamiento adaptativo: media incremental sobre la galería, guardada cada cierto tiempo
+entrenador = EntrenadorPlantillas(galeria, guardar_kps)
+
+despachador_alertas = DespachadorAlertas({"correo": TransporteCorreo(), "sms": TransporteSMS()})
+
+# Fotos de personas: se comprimen, se genera la miniatura y se suben al bucket en segundo plano
+subidor_fotos = SubidorFotos(datos.subir_foto, datos.url_publica)
+
+
+generador_reportes = GeneradorReportes(datos.pagina_reciente)
+
+async def obtener_agregados_dashboard():
+    # Todo se agrega en la base (conteos exactos y RPC); nada recorre las tablas
+    personas, reconocimientos, alertas, top, requisitoriados, reciente = await asyncio.gather(
+        datos.contar("personas"),
+        datos.contar("reconocimientos"),
+        datos.contar("alertas"),
+        datos.top_personas_reconocidas(),
+        datos.contar_requisitoriados_reconocidos(),
+        datos.recientes("reconocimientos", "fecha,hora,personas(nombre,apellidos)", 1),
+    )
+    return {
+        "total_personas": personas,
+        "total_reconocimientos": reconocimientos,
+        "total_alertas": alertas,
+        "top": top,
+        "requisitoriados_reconocidos": requisitoriados,
+        "persona_mas_reciente": reciente[0] if reciente else None,
+    }
+
+
+# Estadísticas del dashboard: agregados de la base refrescados periódicamente más lo escrito por este worker
+estadisticas = EstadisticasDashboard(obtener_agregados_dashboard)
+
+
+async def cambiar_galeria(funcion, *args):
+    # Con galería compartida cada cambio toma el flock y publica en disco: fuera del loop
+    # (los cambios que coinciden se agrupan en una sola publicación)
+    if galeria.compartida is not None:
+        return await asyncio.to_thread(funcion, *args)
+    return funcion(*args)
+
+
+async def cargar_galeria(forzar=True):
+    # Con galería compartida (varios workers), al arrancar se mapea la que ya publicó otro worker
+    if forzar or not galeria.usar_publicada():
+        filas = await datos.listar_todo("personas", "id, nombre, apellidos, kp, requisitoriado")
+        await cambiar_galeria(galeria.cargar, filas)
+    # En modo ivf puede entrenar k-means: en un hilo, el índice se publica al terminar
+    await asyncio.to_thread(emparejador.preparar, galeria.instantanea)
+
+
+# Aplica a la galería los cambios de personas hechos por otros workers o instancias
+sincronizador = SincronizadorGaleria(galeria, datos, cargar_galeria)
+
+# Índice espacial de los reconocimientos para el mapa (teselas agrupadas y en caché)
+indice_mapa = IndiceMapa(datos, galeria)
+
+
+async def cargar_modelos():
+    # Crea los procesos del pool y carga y calienta en cada uno el detector y el codificador de dlib
+    with arranque.etapa("modelos"):
+        try:
+            await asyncio.to_thread(ejecutor_embeddings.iniciar)
+        except Exception:
+            # Un pool a medio crear se descarta antes del reintento
+            ejecutor_embeddings.cerrar()
+            raise
+    logger.info("✅ Pool de embeddings listo: %d procesos", ejecutor_embeddings.procesos)
+
+
+async def cargar_estado():
+    # Solo lo imprescindible para servir: puede reintentarse entero si falla
+    with arranque.etapa("galeria"):
+        await sincronizador.marcar_inicio()
+        await cargar_galeria(forzar=False)
+    logger.info("✅ Galería cargada: %d personas (versión %d)", galeria.total, galeria.version)
+
+    with arranque.etapa("cache_reconocidos"):
+        desde = datetime.now() - cache_reconocidos.ttl
+        recientes = await datos.reconocimientos_desde(desde.date().isoformat())
+        cache_reconocidos.calentar(recientes)
+
+
+def iniciar_tareas_de_fondo():
+    # Tras el arranque: sincronización de la galería, índice del mapa y estadísticas (su
+    # reconciliación completa corre en segundo plano, fuera del camino de /ready)
+    sincronizador.iniciar()
+    indice_mapa.iniciar()
+    estadisticas.iniciar()
+
+
+async def preparar():
+    # Se ejecuta en segundo plano: el puerto ya está abierto (/ y /ready responden) y las
+    # demás peticiones esperan a que termine. Los modelos se cargan en los procesos del
+    # pool, así que van en paralelo con la galería. Una fase que falla se reintenta con
+    # espera exponencial; las que ya terminaron no se repiten.
+    pendientes = {"modelos": cargar_modelos, "estado": cargar_estado}
+    espera = ARRANQUE_REINTENTO_S
+    while True:
+        resultados = await asyncio.gather(*(fase() for fase in pendientes.values()), return_exceptions=True)
+        errores = []
+        for nombre, resultado in zip(list(pendientes), resultados):
+            if isinstance(resultado, BaseException):
+                errores.append(resultado)
+            else:
+                del pendientes[nombre]
+        if not errores:
+            break
+        arranque.marcar_error(errores[0], espera)
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, ARRANQUE_REINTENTO_MAX_S)
+    iniciar_tareas_de_fondo()
+    arranque.marcar_listo()
+
+
+@asynccontextmanager
+async def ciclo_de_vida(app):
+    with arranque.etapa("datos"):
+        await datos.iniciar()
+    await sumidero.iniciar()
+    entrenador.iniciar()
+    despachador_alertas.iniciar()
+    subidor_fotos.iniciar()
+    if PERFILADOR_ACTIVO:
+        perfilador.iniciar()
+    preparacion = asyncio.create_task(preparar())
+
+    yield
+
+    if not preparacion.done():
+        preparacion.cancel()
+        with suppress(asyncio.CancelledError):
+            await preparacion
+    await sumidero.cerrar()
+    await entrenador.cerrar()
+    await despachador_alertas.cerrar()
+    await subidor_fotos.cerrar()
+    await estadisticas.cerrar()
+    await sincronizador.cerrar()
+    await indice_mapa.cerrar()
+    generador_reportes.cerrar()
+    perfilador.cerrar()
+    ejecutor_embeddings.cerrar()
+    # Último en cerrarse: el sumidero y el entrenador todavía escriben al apagar
+    await datos.cerrar()
+
+
+app = FastAPI(lifespan=ciclo_de_vida)
 
 
 # CORS habilitado
@@ -60,77 +231,135 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Con el backend local las fotos se sirven desde la carpeta en disco
+if ALMACENAMIENTO == "local":
+    app.mount("/fotos", StaticFiles(directory=datos.directorio_fotos), name="fotos")
+
+# Rutas que responden aunque el arranque no haya terminado
+RUTAS_SIN_ESPERA = {"/", "/ready", "/metrics"}
+
+
+@app.middleware("http")
+async def esperar_arranque(request: Request, call_next):
+    if not arranque.listo and request.url.path not in RUTAS_SIN_ESPERA:
+        try:
+            await arranque.esperar()
+        except ArranqueFallido as e:
+            return JSONResponse(status_code=503, content={"error": str(e)})
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def medir_peticiones(request: Request, call_next):
+    inicio = time.perf_counter()
+    estado = 500
+    try:
+        respuesta = await call_next(request)
+        estado = respuesta.status_code
+        return respuesta
+    finally:
+        fin = time.perf_counter()
+        ruta = getattr(request.scope.get("route"), "path", "otra")
+        PETICIONES.observar(fin - inicio, request.method, ruta, estado)
+        perfilador.revisar(f"{request.method} {ruta}", inicio, fin)
+
+
+# Series que se leen de los contadores que ya llevan la galería y las cachés
+metricas.externa("facecontrol_galeria_personas", "Personas en la galería residente", "gauge", [],
+                 lambda: [((), galeria.total)])
+metricas.externa(
+    "facecontrol_cache_aciertos_total", "Aciertos por caché y nivel", "counter", ["cache", "nivel"],
+    lambda: [(("dedupe", "memoria"), cache_reconocidos.aciertos), (("mapa", "memoria"), indice_mapa.aciertos)] + (
+        [(("embeddings", nivel), n) for nivel, n in ejecutor_embeddings.cache.aciertos.items()]
+        if ejecutor_embeddings.cache is not None else []
+    ),
+)
+metricas.externa(
+    "facecontrol_cache_fallos_total", "Fallos por caché", "counter", ["cache"],
+    lambda: [(("dedupe",), cache_reconocidos.fallos), (("mapa",), indice_mapa.fallos)] + (
+        [(("embeddings",), ejecutor_embeddings.cache.fallos)] if ejecutor_embeddings.cache is not None else []
+    ),
+)
+metricas.externa("facecontrol_escrituras_pendientes", "Filas en el sumidero pendientes de insertar", "gauge", [],
+                 lambda: [((), sum(sumidero.estado()["pendientes"].values()))])
+metricas.externa("facecontrol_fotos_pendientes", "Fotos encoladas pendientes de comprimir y subir", "gauge", [],
+                 lambda: [((), subidor_fotos.estado()["pendientes"])])
+metricas.externa("facecontrol_arranque_segundos", "Tiempos del arranque en frío por fase", "gauge", ["fase"],
+                 lambda: [((fase,), segundos) for fase, segundos in arranque.tiempos()])
+
+
 @app.get("/")
 def root():
     return {"message": "🚀 API corriendo correctamente"}
 
-@app.get("/reconocimientos")
-def get_reconocimientos():
+
+@app.get("/ready")
+def listo():
+    # A diferencia de /, responde 200 solo cuando la galería y los modelos ya están cargados
+    estado = arranque.estado()
+    if not arranque.listo:
+        return JSONResponse(status_code=503, content=estado)
+    return estado
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def exponer_metricas():
+    # Formato de texto de Prometheus
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/galeria/version")
+def version_galeria(user_id: str = Depends(verificar_token)):
+    return {"version": galeria.version, "total": galeria.total}
+
+
+@app.post("/galeria/refrescar")
+async def refrescar_galeria(user_id: str = Depends(verificar_token)):
     try:
-        response = supabase.table("reconocimientos") \
-            .select("persona_id, fecha, hora, personas(nombre, apellidos)") \
-            .order("fecha", desc=True) \
-            .order("hora", desc=True) \
-            .limit(10) \
-            .execute()
-
-        datos = []
-        for a in response.data:
-            datos.append({
-                "nombre": a["personas"]["nombre"],
-                "apellidos": a["personas"]["apellidos"],
-                "timestamp": f'{a["fecha"]} {a["hora"]}'
-            })
-        return datos
+        await cargar_galeria()
+        return {"message": "✅ Galería recargada", "version": galeria.version, "total": galeria.total}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.get("/sistema/estado")
+def estado_sistema(user_id: str = Depends(verificar_token)):
+    return {
+        "galeria": {
+            **galeria.estado(),
+            "sincronizacion": sincronizador.estado(),
+        },
+        "embeddings": ejecutor_embeddings.estado(),
+        "dedupe": cache_reconocidos.estado(),
+        "escrituras": sumidero.estado(),
+        "plantillas": entrenador.estado(),
+        "enrolamiento": enrolador.estado(),
+        "alertas": despachador_alertas.estado(),
+        "mapa": indice_mapa.estado(),
+        "fotos": subidor_fotos.estado(),
+        "datos": datos.estado(),
+        "arranque": arranque.estado(),
+    }
 
 
-def ya_fue_reconocido_recientemente(persona_id: str) -> bool:
-    ahora = datetime.now()
-    fecha_actual = ahora.date().isoformat()
-    hora_limite = (ahora - timedelta(hours=1)).time().isoformat()
+@app.get("/reconocimientos")
+async def get_reconocimientos():
     try:
-        reconocimientos = supabase.table("reconocimientos") \
-            .select("hora") \
-            .eq("persona_id", persona_id) \
-            .eq("fecha", fecha_actual) \
-            .execute()
-        for registro in reconocimientos.data:
-            if registro["hora"] > hora_limite:
-                return True
-        return False
-    except:
-        return False
-
-def extraer_embedding(file_bytes):
-    img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    img_np = np.array(img)
-
-    face_locations = face_recognition.face_locations(img_np)
-    if not face_locations:
-        raise ValueError("No se detectó ningún rostro en la imagen.")
-    
-    embeddings = face_recognition.face_encodings(img_np, face_locations)
-    if not embeddings:
-        raise ValueError("No se pudieron extraer las características del rostro.")
-    
-    return embeddings[0].tolist()  # Vector de 128 valores
+        filas = await datos.recientes("reconocimientos", "persona_id, fecha, hora, personas(nombre, apellidos)", 10)
+
+        resultado = []
+        for a in filas:
+            resultado.append({
+                "nombre": a["personas"]["nombre"],
+                "apellidos": a["personas"]["apellidos"],
+                "timestamp": f'{a["fecha"]} {a["hora"]}'
+            })
+        return resultado
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
 
-def score_similitud_hibrida(vec1, vec2):
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
 
-    # Distancias
-    cos_sim = 1 - cosine(vec1, vec2)  # Similitud del coseno (1 - distancia)
-    euc_dist = euclidean(vec1, vec2)
-    l1_dist = cityblock(vec1, vec2)
 
-    # Normalización simple de distancias para el score final
-    score = (cos_sim * 0.6) + ((1 / (1 + euc_dist)) * 0.2) + ((1 / (1 + l1_dist)) * 0.2)
-    return score
 
 
 @app.post("/registrar_persona")
@@ -143,31 +372,31 @@ async def registrar_persona(
 ):
     try:
         contents = await file.read()
-        embedding = extraer_embedding(contents)
+        # Una recompresión de una foto ya procesada reutiliza su embedding (no emite tokens)
+        embedding = await ejecutor_embeddings.extraer(contents, casi_duplicados=True)
 
-        file_name = f"{uuid.uuid4()}_{file.filename}"
-        upload_result = supabase.storage.from_("rostros").upload(file_name, contents, {"content-type": file.content_type})
-
-        # Validación de subida
-        if hasattr(upload_result, "data") and upload_result.data is None:
-            return JSONResponse(status_code=500, content={"error": "Error al subir imagen al bucket Supabase."})
-
-        # URL pública
-        public_url_response = supabase.storage.from_("rostros").get_public_url(file_name)
-        foto_url = public_url_response.get("publicUrl") if isinstance(public_url_response, dict) else public_url_response
+        # La URL ya es la definitiva; la foto se encola solo si la fila se guardó
+        # (así un insert fallido no deja fotos huérfanas en el bucket)
+        foto, foto_url = subidor_fotos.reservar()
 
         # Registro en BD
-        response_db = supabase.table("personas").insert({
+        persona = await datos.insertar_persona({
             "nombre": nombre,
             "apellidos": apellidos,
             "correo": correo,
-            "kp": embedding,
+            "kp": codificar_kp(embedding),
             "foto": foto_url,
             "requisitoriado": requisitoriado
-        }).execute()
+        })
+        # Se comprime y se sube en segundo plano
+        await subidor_fotos.encolar(contents, foto)
+        await cambiar_galeria(galeria.agregar, persona)
+        estadisticas.registrar_persona()
 
-        return {"message": "✅ Persona registrada exitosamente.", "persona_id": response_db.data[0]["id"]}
+        return {"message": "✅ Persona registrada exitosamente.", "persona_id": persona["id"]}
 
+    except ColaSaturada as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -175,197 +404,289 @@ async def registrar_persona(
 
 
 
-def enviar_correo_alerta(persona, file_bytes):
-    try:
-        cuerpo = (
-            f"🚨 ALERTA: Persona requisitoriada detectada\n\n"
-            f"Nombre: {persona['nombre']} {persona['apellidos']}\n"
-            f"ID: {persona['id']}\n"
-            f"Score: {persona['score']}"
-        )
-
-        # Construcción del correo
-        msg = MIMEMultipart()
-        msg['Subject'] = '🚨 ALERTA DE SEGURIDAD'
-        msg['From'] = os.getenv("SMTP_USER")
-        msg['To'] = os.getenv("ALERTA_DESTINO_MAIL")
-
-        # Cuerpo del mensaje
-        msg.attach(MIMEText(cuerpo, 'plain'))
-
-        # Adjuntar la imagen como .jpg
-        part = MIMEBase('application', 'octet-stream')
-        part.set_payload(file_bytes)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', 'attachment; filename="rostro_detectado.jpg"')
-        msg.attach(part)
-
-        # Enviar
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASS"))
-        server.send_message(msg)
-        server.quit()
-
-        print("✅ Correo enviado correctamente con imagen")
-    except Exception as e:
-        print("❌ Error al enviar correo:", e)
+async def personas_enroladas(filas):
+    await cambiar_galeria(galeria.aplicar_cambios, filas)
+    estadisticas.registrar_persona(len(filas))
 
 
+# Alta masiva: ZIP de fotos + manifiesto CSV, con embeddings en el pool y filas por lotes
+enrolador = EnroladorMasivo(ejecutor_embeddings.extraer, subidor_fotos.reservar, subidor_fotos.encolar,
+                            datos.insertar_lote, personas_enroladas, procesos=ejecutor_embeddings.procesos)
 
 
+@app.post("/registrar_personas/lote")
+async def registrar_personas_lote(
+    archivo: UploadFile = File(...),  # ZIP con las fotos
+    manifiesto: UploadFile = File(None),  # CSV archivo,nombre,apellidos,correo,requisitoriado; si falta se usa manifiesto.csv del ZIP
+    user_id: str = Depends(verificar_token)
+):
+    if user_id != ADMIN_ID:
+        raise HTTPException(status_code=403, detail="❌ Solo el administrador puede registrar personas en lote.")
 
-def enviar_sms_alerta(persona):
     try:
-        client = Client(os.getenv("TWILIO_SID"), os.getenv("TWILIO_AUTH"))
-        mensaje = (
-            f"🚨 ALERTA: {persona['nombre']} {persona['apellidos']} fue detectado como REQUISITORIADO."
-        )
-
-        message = client.messages.create(
-            body=mensaje,
-            from_=os.getenv("TWILIO_PHONE"),
-            to=os.getenv("ALERTA_DESTINO_SMS")
-        )
-        print("✅ SMS enviado correctamente")
+        contenido_manifiesto = await manifiesto.read() if manifiesto is not None else None
+        # El ZIP se lee desde el archivo temporal de la subida, sin cargarlo entero en memoria
+        lote = await asyncio.to_thread(EnroladorMasivo.abrir, archivo.file, contenido_manifiesto)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
-        print("❌ Error al enviar SMS:", e)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+    # Una línea JSON por fila registrada o con error, progreso por lote y un resumen final
+    return StreamingResponse(enrolador.ndjson(*lote), media_type="application/x-ndjson")
 
 
+def caja_a_dict(caja):
+    top, right, bottom, left = caja
+    return {"top": top, "right": right, "bottom": bottom, "left": left}
 
 
+def procesar_coincidencia(persona, score, encoding_actual, contents, latitud, longitud, entrenar=True):
+    ahora = datetime.now()
+
+    COINCIDENCIAS.incrementar()
+    logger.debug("Coincidencia: %s %s | Score: %.3f", persona["nombre"], persona["apellidos"], score)
+
+    if cache_reconocidos.marcar_si_nuevo(persona["id"], ahora):
+        lat = latitud if latitud is not None else round(random.uniform(-9.1, -8.0), 6)
+        lon = longitud if longitud is not None else round(random.uniform(-79.1, -77.0), 6)
+
+        logger.debug("Encolando reconocimiento -> latitud: %s, longitud: %s", lat, lon)
+
+        sumidero.agregar("reconocimientos", {
+            "persona_id": persona["id"],
+            "fecha": ahora.date().isoformat(),
+            "hora": ahora.time().strftime("%H:%M:%S"),
+            "latitud": lat,
+            "longitud": lon
+        })
+        estadisticas.registrar_reconocimiento(persona, ahora.date().isoformat(), ahora.time().strftime("%H:%M:%S"))
+
+    # Entrenamiento adaptativo (solo con la mejor coincidencia del rostro)
+    if entrenar:
+        entrenador.agregar_muestra(persona["id"], encoding_actual)
+
+    # 🔐 Token
+    token = crear_token({"sub": persona["id"]})
+
+    match_info = {
+        "id": persona["id"],
+        "nombre": persona["nombre"],
+        "apellidos": persona["apellidos"],
+        "requisitoriado": persona["requisitoriado"],
+        "score": round(score, 3),
+        "is_admin": persona["id"] == ADMIN_ID,
+        "token": token
+    }
+
+    if persona["requisitoriado"]:
+        logger.warning("🚨 ALERTA DE SEGURIDAD -> Persona requisitoriada: %s %s (%s)",
+                       persona["nombre"], persona["apellidos"], persona["id"])
+        envio = despachador_alertas.encolar(match_info, contents)
+
+        sumidero.agregar("alertas", {
+            "persona_id": persona["id"],
+            "nombre": persona["nombre"],
+            "apellidos": persona["apellidos"],
+            "score": round(score, 3),
+            "fecha": ahora.date().isoformat(),
+            "hora": ahora.time().strftime("%H:%M:%S"),
+            # Las agrupadas o descartadas se registran igual, pero no se enviaron
+            "metodo_envio": "ambos" if envio == "encolada" else envio
+        })
+
+    return match_info
+
 
 @app.post("/reconocer")
 async def reconocer_rostro(
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     latitud: float = Form(None),
-    longitud: float = Form(None)
+    longitud: float = Form(None),
+    multiples: bool = Form(False)  # True: reconoce todos los rostros del fotograma
 ):
     try:
         contents = await file.read()
-        encoding_actual = extraer_embedding(contents)
-
-        personas = supabase.table("personas").select("id, nombre, apellidos, kp, requisitoriado").execute()
-        matches = []
-
-        for persona in personas.data:
-            if not persona["kp"]:
-                continue
-
-            score = score_similitud_hibrida(encoding_actual, persona["kp"])
-
-            if score > 0.75:
-                ahora = datetime.now()
-
-                print(f"\n[DEBUG] Coincidencia: {persona['nombre']} {persona['apellidos']} | Score: {round(score, 3)}")
-
-                if not ya_fue_reconocido_recientemente(persona["id"]):
-                    lat = latitud if latitud is not None else round(random.uniform(-9.1, -8.0), 6)
-                    lon = longitud if longitud is not None else round(random.uniform(-79.1, -77.0), 6)
-
-                    print(f"[DEBUG] Insertando en reconocimientos -> latitud: {lat}, longitud: {lon}")
-
-                    resp_reco = supabase.table("reconocimientos").insert({
-                        "persona_id": persona["id"],
-                        "fecha": ahora.date().isoformat(),
-                        "hora": ahora.time().strftime("%H:%M:%S"),
-                        "latitud": lat,
-                        "longitud": lon
-                    }).execute()
-                    print(f"[DEBUG] Supabase resp_reco: {resp_reco}")
-
-                # Entrenamiento adaptativo
-                print("[DEBUG] Insertando en entrenamiento")
-                resp_entrena = supabase.table("entrenamientos").insert({
-                    "persona_id": persona["id"],
-                    "kp": json.loads(json.dumps(encoding_actual)),
-                    "fecha": ahora.date().isoformat(),
-                    "hora": ahora.time().strftime("%H:%M:%S")
-                }).execute()
-                print(f"[DEBUG] Supabase resp_entrena: {resp_entrena}")
-
-                entrenamientos = supabase.table("entrenamientos") \
-                    .select("kp") \
-                    .eq("persona_id", persona["id"]) \
-                    .limit(10) \
-                    .execute()
-
-                if len(entrenamientos.data) == 10:
-                    print("[DEBUG] Promediando KP de entrenamiento")
-                    vectores = [np.array(e["kp"]) for e in entrenamientos.data]
-                    promedio = np.mean(vectores, axis=0).tolist()
-
-                    supabase.table("personas").update({"kp": promedio}).eq("id", persona["id"]).execute()
-                    supabase.table("entrenamientos").delete().eq("persona_id", persona["id"]).execute()
-
-                # 🔐 Token
-                token = crear_token({"sub": persona["id"]})
-
-                match_info = {
-                    "id": persona["id"],
-                    "nombre": persona["nombre"],
-                    "apellidos": persona["apellidos"],
-                    "requisitoriado": persona["requisitoriado"],
-                    "score": round(score, 3),
-                    "is_admin": persona["id"] == ADMIN_ID,
-                    "token": token
-                }
-
-                matches.append(match_info)
-
-                if persona["requisitoriado"]:
-                    print(f"\n🚨 ALERTA DE SEGURIDAD -> Persona requisitoriada: {match_info}")
-                    background_tasks.add_task(enviar_correo_alerta, match_info, contents)
-                    background_tasks.add_task(enviar_sms_alerta, match_info)
-
-                    print("[DEBUG] Insertando en alertas")
-                    resp_alerta = supabase.table("alertas").insert({
-                        "persona_id": persona["id"],
-                        "nombre": persona["nombre"],
-                        "apellidos": persona["apellidos"],
-                        "score": round(score, 3),
-                        "fecha": ahora.date().isoformat(),
-                        "hora": ahora.time().strftime("%H:%M:%S"),
-                        "metodo_envio": "ambos"
-                    }).execute()
-                    print(f"[DEBUG] Supabase resp_alerta: {resp_alerta}")
+        instantanea = galeria.instantanea
+
+        if multiples:
+            rostros = await ejecutor_embeddings.extraer_todos(contents)
+            with cronometro(ETAPAS, "emparejamiento"):
+                busquedas = emparejador.buscar_lote([encoding for _, encoding in rostros], instantanea)
+            arranque.registrar_reconocimiento()
+
+            resultados = []
+            for (caja, encoding), (indices, scores) in zip(rostros, busquedas):
+                resultados.append({
+                    "caja": caja_a_dict(caja),
+                    "coincidencias": [
+                        procesar_coincidencia(instantanea.persona(i), score, encoding, contents,
+                                              latitud, longitud, entrenar=n == 0)
+                        for n, (i, score) in enumerate(zip(indices, scores.tolist()))
+                    ]
+                })
+
+            if any(r["coincidencias"] for r in resultados):
+                return {"message": "✅ Rostro reconocido", "rostros": resultados}
+            return {"message": "❌ Rostro no reconocido", "rostros": resultados}
+
+        encoding_actual = await ejecutor_embeddings.extraer(contents)
+        with cronometro(ETAPAS, "emparejamiento"):
+            indices, scores = emparejador.buscar(encoding_actual, instantanea)
+        arranque.registrar_reconocimiento()
+
+        matches = [
+            procesar_coincidencia(instantanea.persona(i), score, encoding_actual, contents,
+                                  latitud, longitud, entrenar=n == 0)
+            for n, (i, score) in enumerate(zip(indices, scores.tolist()))
+        ]
 
         if matches:
             return {"message": "✅ Rostro reconocido", "coincidencias": matches}
         else:
             return {"message": "❌ Rostro no reconocido"}
 
+    except ColaSaturada as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
     except Exception as e:
-        print(f"❌ ERROR FATAL EN /reconocer: {e}")
+        logger.exception("❌ ERROR FATAL EN /reconocer")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.websocket("/ws/reconocer")
+async def reconocer_stream(websocket: WebSocket, latitud: float = None, longitud: float = None):
+    # El cliente envía cada fotograma como mensaje binario (JPEG/PNG). Solo se
+    # emiten eventos cuando una pista queda identificada o cuando se pierde.
+    await websocket.accept()
+    try:
+        await arranque.esperar()
+    except ArranqueFallido as e:
+        await websocket.send_json({"evento": "error", "error": str(e)})
+        await websocket.close()
+        return
+    seguidor = SeguidorRostros()
+    # Si el procesamiento va más lento que la cámara, se conserva solo el último fotograma
+    cola = asyncio.Queue(maxsize=1)
+
+    async def recibir():
+        try:
+            while True:
+                contenido = await websocket.receive_bytes()
+                if cola.full():
+                    cola.get_nowait()
+                cola.put_nowait(contenido)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if cola.full():
+                cola.get_nowait()
+            cola.put_nowait(None)
+
+    receptor = asyncio.create_task(recibir())
+    try:
+        while (contenido := await cola.get()) is not None:
+            try:
+                rostros = await ejecutor_embeddings.analizar(contenido, seguidor.cajas_omitibles(), seguidor.umbral_iou)
+            except ColaSaturada:
+                continue
+            except Exception as e:
+                await websocket.send_json({"evento": "error", "error": str(e)})
+                continue
+
+            pistas, perdidas = seguidor.actualizar([caja for caja, _ in rostros])
+            instantanea = galeria.instantanea
+            eventos = []
+
+            for pista, (caja, encoding) in zip(pistas, rostros):
+                if encoding is None:
+                    continue
+                pista.ultimo_intento = seguidor.fotograma
+                with cronometro(ETAPAS, "emparejamiento"):
+                    indices, scores = emparejador.buscar(encoding, instantanea, k=1)
+                if not len(indices) or scores[0] <= pista.score:
+                    continue
+
+                persona = instantanea.persona(indices[0])
+                score = float(scores[0])
+                if not pista.identificar(persona, score):
+                    continue
+
+                match_info = procesar_coincidencia(persona, score, encoding, contenido, latitud, longitud)
+                eventos.append({"evento": "identificado", "pista": pista.id, "caja": caja_a_dict(caja), "coincidencia": match_info})
+
+            for pista in perdidas:
+                if pista.persona is not None:
+                    eventos.append({"evento": "salida", "pista": pista.id, "persona_id": pista.persona["id"]})
+
+            for evento in eventos:
+                await websocket.send_json(evento)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receptor.cancel()
+
+
+
 
 
 
+def caja_consulta(min_lat, min_lon, max_lat, max_lon):
+    # Caja opcional: o se envían los cuatro límites o ninguno
+    limites = (min_lat, min_lon, max_lat, max_lon)
+    if all(v is None for v in limites):
+        return None
+    if any(v is None for v in limites):
+        raise ValueError("⚠️ La caja necesita min_lat, min_lon, max_lat y max_lon.")
+    return limites
+
 
 @app.get("/mapa-reconocimientos")
-def get_mapa_reconocimientos(user_id: str = Depends(verificar_token)):
+async def get_mapa_reconocimientos(
+    min_lat: float = None,
+    min_lon: float = None,
+    max_lat: float = None,
+    max_lon: float = None,
+    desde: str = None,  # AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS
+    hasta: str = None,
+    zoom: int = None,  # con zoom se devuelven grupos por celda en lugar de puntos
+    limite: int = 100,
+    user_id: str = Depends(verificar_token)
+):
+    # Solo se devuelven reconocimientos de personas que siguen en la galería: los de personas
+    # borradas se omiten (no cuentan en `total` ni en los grupos) aunque la fila siga en la tabla
+    # hasta que la retención la elimine.
     try:
-        response = supabase.table("reconocimientos") \
-            .select("persona_id, latitud, longitud, fecha, hora, personas(nombre, apellidos)") \
-            .order("fecha", desc=True) \
-            .order("hora", desc=True) \
-            .limit(100) \
-            .execute()
-
-        resultados = []
-        for registro in response.data:
-            resultados.append({
-                "nombre": registro["personas"]["nombre"],
-                "apellidos": registro["personas"]["apellidos"],
-                "latitud": registro["latitud"],
-                "longitud": registro["longitud"],
-                "timestamp": f'{registro["fecha"]} {registro["hora"]}'
-            })
+        caja = caja_consulta(min_lat, min_lon, max_lat, max_lon)
+        if zoom is None:
+            # Los reconocimientos más recientes (hasta `limite`) dentro de la caja y las fechas
+            return await indice_mapa.puntos(caja, desde, hasta, limite)
+        respuesta = await indice_mapa.agrupar(zoom, caja, desde, hasta)
+        return JSONResponse(content=respuesta, headers={"Cache-Control": f"private, max-age={MAPA_CACHE_HTTP_S}"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except MapaNoListo as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 
-        return resultados
+@app.get("/mapa-reconocimientos/teselas/{z}/{x}/{y}")
+async def get_tesela_reconocimientos(
+    z: int,
+    x: int,
+    y: int,
+    desde: str = None,
+    hasta: str = None,
+    user_id: str = Depends(verificar_token)
+):
+    try:
+        respuesta = await indice_mapa.tesela(z, x, y, desde, hasta)
+        return JSONResponse(content=respuesta, headers={"Cache-Control": f"private, max-age={MAPA_CACHE_HTTP_S}"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except MapaNoListo as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -375,18 +696,21 @@ def get_mapa_reconocimientos(user_id: str = Depends(verificar_token)):
 
 
 @app.get("/personas")
-def listar_personas(user_id: str = Depends(verificar_token)):
+async def listar_personas(user_id: str = Depends(verificar_token)):
     try:
         # Verificamos si es el admin
         is_admin = user_id == ADMIN_ID
 
         if is_admin:
-            response = supabase.table("personas").select("*").order("nombre", desc=True).execute()
+            personas = await datos.listar_personas()
         else:
             # Un usuario solo puede verse a sí mismo
-            response = supabase.table("personas").select("*").eq("id", user_id).execute()
+            persona = await datos.persona(user_id)
+            personas = [persona] if persona else []
 
-        return {"personas": response.data}
+        # Miniatura para el panel (None en fotos subidas antes de generarlas)
+        personas = [{**p, "miniatura": url_miniatura(p.get("foto"))} for p in personas]
+        return {"personas": personas}
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -408,27 +732,12 @@ async def actualizar_persona(
         nueva_url = None
 
         if file:
-            extension = file.filename.split('.')[-1]
-            nombre_archivo = f"{str(uuid4())}.{extension}"
             contenido = await file.read()
 
-            subir = supabase.storage.from_("rostros").upload(
-                nombre_archivo,
-                contenido,
-                {"content-type": file.content_type}
-            )
-
-            # ✅ Validar si hubo error en la subida
-            if hasattr(subir, "error") and subir.error is not None:
-                print("❌ Error al subir imagen:", subir.error)
-                raise HTTPException(status_code=500, detail="Error al subir imagen a Supabase.")
-
-            # ✅ Obtener URL pública
-            public_url_response = supabase.storage.from_("rostros").get_public_url(nombre_archivo)
-            nueva_url = public_url_response.get("publicUrl") if isinstance(public_url_response, dict) else public_url_response
-            print(f"✅ Imagen subida correctamente. URL: {nueva_url}")
+            # La URL ya es la definitiva; la subida se encola después de actualizar la fila
+            foto, nueva_url = subidor_fotos.reservar()
         else:
-            print("ℹ️ No se envió una nueva imagen. Se mantiene la foto anterior.")
+            logger.debug("ℹ️ No se envió una nueva imagen. Se mantiene la foto anterior.")
 
         # Datos a actualizar
         datos_actualizados = {
@@ -441,12 +750,17 @@ async def actualizar_persona(
         if nueva_url:
             datos_actualizados["foto"] = nueva_url
 
-        actualizacion = supabase.table("personas").update(datos_actualizados).eq("id", persona_id).execute()
+        actualizacion = await datos.actualizar_persona(persona_id, datos_actualizados)
+        if nueva_url:
+            # ✅ Se encola la subida (comprimida y con miniatura)
+            await subidor_fotos.encolar(contenido, foto)
+            logger.info("✅ Imagen encolada para subir. URL: %s", nueva_url)
+        await cambiar_galeria(galeria.actualizar_datos, persona_id, datos_actualizados)
 
-        return {"mensaje": "✅ Persona actualizada correctamente", "persona": actualizacion.data}
+        return {"mensaje": "✅ Persona actualizada correctamente", "persona": actualizacion}
 
     except Exception as e:
-        print("❌ [ERROR] Error al actualizar persona:", e)
+        logger.exception("❌ Error al actualizar persona")
         raise HTTPException(status_code=500, detail=f"Error al actualizar persona: {e}")
 
 
@@ -460,19 +774,20 @@ async def actualizar_persona(
 
 @app.put("/perfil/editar")
 async def editar_mi_perfil(
-    datos: dict = Body(...),
+    cambios: dict = Body(...),
     user_id: str = Depends(verificar_token_general)
 ):
     try:
         campos = {}
         for campo in ['nombre', 'apellidos', 'correo']:
-            if campo in datos and datos[campo]:
-                campos[campo] = datos[campo]
+            if campo in cambios and cambios[campo]:
+                campos[campo] = cambios[campo]
 
         if not campos:
             return JSONResponse(status_code=400, content={"error": "⚠️ No se enviaron campos para actualizar."})
 
-        supabase.table("personas").update(campos).eq("id", user_id).execute()
+        await datos.actualizar_persona(user_id, campos)
+        await cambiar_galeria(galeria.actualizar_datos, user_id, campos)
         return {"message": "✅ Perfil actualizado correctamente."}
 
     except Exception as e:
@@ -483,8 +798,7 @@ async def editar_mi_perfil(
 @app.get("/perfil")
 async def obtener_mi_perfil(user_id: str = Depends(verificar_token_general)):
     try:
-        datos = supabase.table("personas").select("nombre, apellidos, correo, requisitoriado, foto").eq("id", user_id).single().execute()
-        return datos.data
+        return await datos.persona(user_id, "nombre, apellidos, correo, requisitoriado, foto")
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -501,7 +815,10 @@ async def eliminar_persona(
         if user_id != ADMIN_ID:
             raise HTTPException(status_code=403, detail="❌ Acceso denegado. Solo el administrador puede eliminar personas.")
 
-        supabase.table("personas").delete().eq("id", persona_id).execute()
+        await datos.eliminar_persona(persona_id)
+        await cambiar_galeria(galeria.eliminar, persona_id)
+        entrenador.olvidar(persona_id)
+        estadisticas.registrar_persona(-1)
         return {"message": "✅ Persona eliminada correctamente."}
 
     except Exception as e:
@@ -511,16 +828,9 @@ async def eliminar_persona(
 
 
 @app.get("/alertas")
-def ver_alertas(user_id: str = Depends(verificar_token)):  # 🔒 Protegido con JWT solo para admin
+async def ver_alertas(user_id: str = Depends(verificar_token)):  # 🔒 Protegido con JWT solo para admin
     try:
-        alertas = supabase.table("alertas") \
-            .select("fecha, hora, nombre, apellidos, score, metodo_envio") \
-            .order("fecha", desc=True) \
-            .order("hora", desc=True) \
-            .limit(20) \
-            .execute()
-
-        return alertas.data
+        return await datos.recientes("alertas", "fecha, hora, nombre, apellidos, score, metodo_envio", 20)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
@@ -534,88 +844,48 @@ async def exportar_pdf(
         raise HTTPException(status_code=403, detail="❌ Solo el administrador puede exportar reportes.")
 
     try:
-        hoy = date.today().isoformat()
-
-        if modo == "top10":
-            alertas_query = supabase.table("alertas") \
-                .select("fecha,hora,nombre,apellidos,score,metodo_envio") \
-                .order("fecha", desc=True).order("hora", desc=True).limit(10)
-
-            reconocimientos_query = supabase.table("reconocimientos") \
-                .select("fecha,hora,personas(nombre,apellidos,requisitoriado)") \
-                .order("fecha", desc=True).order("hora", desc=True).limit(10)
-
-        elif modo == "hoy":
-            alertas_query = supabase.table("alertas") \
-                .select("fecha,hora,nombre,apellidos,score,metodo_envio") \
-                .eq("fecha", hoy)
-
-            reconocimientos_query = supabase.table("reconocimientos") \
-                .select("fecha,hora,personas(nombre,apellidos,requisitoriado)") \
-                .eq("fecha", hoy)
-
-        else:  # modo == "todos"
-            alertas_query = supabase.table("alertas") \
-                .select("fecha,hora,nombre,apellidos,score,metodo_envio") \
-                .order("fecha", desc=True).order("hora", desc=True)
-
-            reconocimientos_query = supabase.table("reconocimientos") \
-                .select("fecha,hora,personas(nombre,apellidos,requisitoriado)") \
-                .order("fecha", desc=True).order("hora", desc=True)
-
-        alertas = alertas_query.execute().data
-        reconocimientos = reconocimientos_query.execute().data
-
-        # Generar PDF
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(0, 10, "Reporte General FACEAPP", ln=True, align="C")
-
-        def agregar_tabla(titulo, data, columnas):
-            pdf.set_font("Arial", "B", 14)
-            pdf.set_fill_color(240, 240, 240)
-            pdf.cell(0, 10, f"\n{titulo}", ln=True, fill=True)
-            pdf.set_font("Arial", "B", 10)
-            for col in columnas:
-                pdf.cell(32, 8, col, border=1)
-            pdf.ln()
-            pdf.set_font("Arial", "", 10)
-            for row in data:
-                for col in columnas:
-                    valor = str(row.get(col)) if col in row else str((row.get("personas") or {}).get(col, ""))
-                    pdf.cell(32, 8, valor, border=1)
-                pdf.ln()
-
-        columnas_alertas = ["fecha", "hora", "nombre", "apellidos", "score", "metodo_envio"]
-        columnas_reconocimientos = ["fecha", "hora", "nombre", "apellidos", "requisitoriado"]
-
-        agregar_tabla("1. ALERTAS", alertas, columnas_alertas)
-        agregar_tabla("2. RECONOCIMIENTOS", reconocimientos, columnas_reconocimientos)
-
-        # Descargar e insertar el logo de UPAO en la esquina inferior derecha
-        logo_url = "https://descubre.upao.edu.pe/img/upao_logo.png"
-        logo_response = requests.get(logo_url)
-
-        if logo_response.status_code == 200:
-            with open("logo_upao.png", "wb") as f:
-                f.write(logo_response.content)
-
-            page_width = pdf.w
-            page_height = pdf.h
-            pdf.image("logo_upao.png", x=page_width - 45, y=page_height - 30, w=35)
-
-        # Generar PDF en memoria
-        pdf_output = pdf.output(dest='S').encode('latin-1')
-        buffer = BytesIO(pdf_output)
-
-        return StreamingResponse(buffer, media_type="application/pdf", headers={
+        archivo = await generador_reportes.abrir_async(modo)
+
+        return StreamingResponse(bloques(archivo), media_type="application/pdf", headers={
             "Content-Disposition": f"attachment; filename=faceapp_reporte_{modo}.pdf"
         })
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+
+@app.post("/exportar-pdf/trabajos")
+async def crear_trabajo_pdf(
+    modo: str = Form(...),  # "todos", "top10", "hoy"
+    user_id: str = Depends(verificar_token)
+):
+    if modo not in MODOS_REPORTE:
+        return JSONResponse(status_code=400, content={"error": f"⚠️ Modo inválido: use {', '.join(MODOS_REPORTE)}."})
+
+    trabajo_id = generador_reportes.crear_trabajo(modo)
+    return {"message": "⏳ Reporte en generación", "trabajo_id": trabajo_id}
+
+
+@app.get("/exportar-pdf/trabajos/{trabajo_id}")
+def estado_trabajo_pdf(trabajo_id: str, user_id: str = Depends(verificar_token)):
+    trabajo = generador_reportes.trabajo(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="❌ Trabajo no encontrado.")
+    return {"trabajo_id": trabajo_id, "modo": trabajo["modo"], "estado": trabajo["estado"], "error": trabajo["error"]}
+
+
+@app.get("/exportar-pdf/trabajos/{trabajo_id}/descarga")
+def descargar_trabajo_pdf(trabajo_id: str, user_id: str = Depends(verificar_token)):
+    trabajo = generador_reportes.trabajo(trabajo_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="❌ Trabajo no encontrado.")
+    if trabajo["estado"] != "listo":
+        return JSONResponse(status_code=409, content={"error": f"El reporte está en estado '{trabajo['estado']}'."})
+
+    return StreamingResponse(bloques(generador_reportes.abrir_trabajo(trabajo)), media_type="application/pdf", headers={
+        "Content-Disposition": f"attachment; filename=faceapp_reporte_{trabajo['modo']}.pdf"
+    })
+
 @app.post("/entrenar/nuevo")
 async def entrenamiento_manual(
     persona_id: str = Form(...),
@@ -627,19 +897,24 @@ async def entrenamiento_manual(
 
     try:
         contents = await file.read()
-        encoding = extraer_embedding(contents)
+        encoding = await ejecutor_embeddings.extraer(contents, casi_duplicados=True)
         ahora = datetime.now()
 
-        # Insertar en la tabla de entrenamientos
-        supabase.table("entrenamientos").insert({
+        if not entrenador.agregar_muestra(persona_id, encoding, forzar=True):
+            return JSONResponse(status_code=404, content={"error": "❌ La persona no existe o no tiene kp registrado."})
+
+        # La tabla de entrenamientos queda como historial de las muestras manuales
+        sumidero.agregar("entrenamientos", {
             "persona_id": persona_id,
-            "kp": json.loads(json.dumps(encoding)),  # asegurar compatibilidad con JSONB
+            "kp": codificar_kp(encoding),
             "fecha": ahora.date().isoformat(),
             "hora": ahora.time().strftime("%H:%M:%S")
-        }).execute()
+        })
 
         return {"message": "✅ Imagen registrada para entrenamiento manual"}
 
+    except ColaSaturada as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
     
@@ -650,51 +925,14 @@ async def obtener_estadisticas(user_id: str = Depends(verificar_token)):
         raise HTTPException(status_code=403, detail="Solo el administrador puede acceder a las estadísticas.")
 
     try:
-        # Total de personas
-        total_personas = supabase.table("personas").select("id").execute().data
-        total_personas_count = len(total_personas)
-
-        # Total de reconocimientos
-        total_reconocimientos = supabase.table("reconocimientos").select("id").execute().data
-        total_reconocimientos_count = len(total_reconocimientos)
-
-        # Top 3 más reconocidos
-        top3_query = supabase.rpc("top_personas_reconocidas").execute().data  # Asegúrate de tener esa función en Supabase
-
-        # Requisitoriados reconocidos (mínimo 1 vez)
-        requisitoriados = supabase.table("reconocimientos") \
-            .select("personas(requisitoriado)") \
-            .neq("personas.requisitoriado", False) \
-            .execute().data
-        requisitoriados_detectados = len(requisitoriados)
-
-        # Porcentaje requisitoriados
-        porcentaje_requisitoriados = (
-            f"{requisitoriados_detectados} de {total_personas_count} personas están requisitoriadas "
-            f"({round((requisitoriados_detectados / total_personas_count) * 100, 2)}%)"
-        ) if total_personas_count > 0 else "No hay personas registradas."
-
-        # Persona más recientemente reconocida
-        reciente = supabase.table("reconocimientos") \
-            .select("fecha,hora,personas(nombre,apellidos)") \
-            .order("fecha", desc=True).order("hora", desc=True) \
-            .limit(1).execute().data
-        persona_reciente = reciente[0] if reciente else {}
-
-        return {
-            "total_personas": total_personas_count,
-            "total_reconocimientos": total_reconocimientos_count,
-            "top_3": top3_query,
-            "requisitoriados_reconocidos": requisitoriados_detectados,
-            "porcentaje_requisitoriados": porcentaje_requisitoriados,
-            "persona_mas_reciente": persona_reciente
-        }
-
+        return estadisticas.resumen()
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
     
     
 
+arranque.marcar_importado()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
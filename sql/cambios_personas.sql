@@ -0,0 +1,32 @@
+-- Registro de cambios de `personas` para propagar altas, modificaciones y bajas a la
+-- galería residente (utils/cambios.py) sin volver a leer la tabla completa.
+-- Ejecutar una vez en el editor SQL de Supabase.
+
+create table if not exists cambios_personas (
+    seq bigserial primary key,
+    persona_id text not null,
+    operacion text not null check (operacion in ('upsert', 'delete')),
+    fecha timestamptz not null default now()
+);
+
+create or replace function registrar_cambio_persona() returns trigger
+language plpgsql as $$
+begin
+    if tg_op = 'DELETE' then
+        insert into cambios_personas (persona_id, operacion) values (old.id::text, 'delete');
+    else
+        insert into cambios_personas (persona_id, operacion) values (new.id::text, 'upsert');
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists personas_cambios on personas;
+create trigger personas_cambios
+    after insert or update or delete on personas
+    for each row execute function registrar_cambio_persona();
+
+-- El registro solo se lee hacia adelante desde la última secuencia aplicada; las filas
+-- viejas pueden borrarse periódicamente (un worker que quede muy atrás hace una
+-- resincronización completa):
+--   delete from cambios_personas where fecha < now() - interval '7 days';
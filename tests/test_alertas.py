@@ -0,0 +1,127 @@
+import asyncio
+import socketserver
+import threading
+import time
+
+from utils.alertas import DespachadorAlertas, TransporteCorreo, TransporteSMS
+
+
+def persona(i):
+    return {"id": f"p{i}", "nombre": f"N{i}", "apellidos": "A", "score": 0.9}
+
+
+class TransporteFalso:
+    def __init__(self):
+        self.enviadas = []
+
+    def enviar(self, persona, file_bytes):
+        self.enviadas.append(persona["id"])
+
+    def cerrar(self):
+        pass
+
+
+class ClienteSMSInestable:
+    # Imita twilio.rest.Client: los primeros `fallos` envíos fallan
+    def __init__(self, fallos):
+        self.fallos = fallos
+        self.intentos = 0
+        self.messages = self
+
+    def create(self, body, from_, to):
+        self.intentos += 1
+        if self.intentos <= self.fallos:
+            raise ConnectionError("twilio no responde")
+
+
+class ManejadorSMTP(socketserver.StreamRequestHandler):
+    # Lo justo de SMTP para smtplib; corta la conexión tras cada mensaje, como un servidor
+    # que cierra las conexiones inactivas
+    def responder(self, linea):
+        self.wfile.write(linea.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.conexiones += 1
+        self.responder("220 prueba")
+        while linea := self.rfile.readline():
+            comando = linea.decode().strip().upper()
+            if comando == "DATA":
+                self.responder("354 fin con .")
+                cuerpo = []
+                while (linea := self.rfile.readline()) not in (b".\r\n", b""):
+                    cuerpo.append(linea)
+                self.server.mensajes.append(b"".join(cuerpo))
+                self.responder("250 OK")
+                return
+            if comando == "QUIT":
+                self.responder("221 adios")
+                return
+            self.responder("250 OK")
+
+
+def servidor_smtp():
+    servidor = socketserver.ThreadingTCPServer(("127.0.0.1", 0), ManejadorSMTP)
+    servidor.daemon_threads = True
+    servidor.conexiones, servidor.mensajes = 0, []
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def test_alertas_de_la_misma_persona_se_agrupan_dentro_de_la_ventana():
+    despachador = DespachadorAlertas({"falso": TransporteFalso()}, ventana_s=0.05)
+
+    assert despachador.encolar(persona(1)) == "encolada"
+    assert despachador.encolar(persona(1)) == "agrupada"
+    assert despachador.encolar(persona(2)) == "encolada"
+    time.sleep(0.06)
+    assert despachador.encolar(persona(1)) == "encolada"
+    # Al pasar la ventana se olvidan las personas que no volvieron a alertar
+    assert set(despachador._ultimas) == {"p1"}
+    assert despachador.estado()["agrupadas"] == 1
+
+
+def test_cola_llena_descarta_sin_marcar_a_la_persona():
+    despachador = DespachadorAlertas({"falso": TransporteFalso()}, cola_max=2)
+
+    assert [despachador.encolar(persona(i)) for i in range(3)] == ["encolada", "encolada", "descartada"]
+    assert despachador.estado()["descartadas"] == 1
+    assert "p2" not in despachador._ultimas
+
+
+def test_sms_se_reintenta_con_espera_creciente():
+    async def probar(fallos, reintentos):
+        cliente = ClienteSMSInestable(fallos)
+        despachador = DespachadorAlertas({"sms": TransporteSMS(cliente=cliente)}, trabajadores=1,
+                                         reintentos=reintentos, espera_s=0.01)
+        despachador.iniciar()
+        despachador.encolar(persona(1))
+        inicio = time.perf_counter()
+        await despachador.cerrar()
+        return cliente.intentos, time.perf_counter() - inicio, despachador.estado()
+
+    intentos, duracion, estado = asyncio.run(probar(fallos=2, reintentos=3))
+    assert intentos == 3
+    assert duracion >= 0.01 + 0.02
+    assert (estado["enviadas"], estado["fallidas"]) == (1, 0)
+
+    intentos, _, estado = asyncio.run(probar(fallos=10, reintentos=2))
+    assert intentos == 3
+    assert (estado["enviadas"], estado["fallidas"]) == (0, 1)
+
+
+def test_correo_reconecta_si_el_servidor_corto_la_conexion():
+    servidor = servidor_smtp()
+    try:
+        correo = TransporteCorreo(host="127.0.0.1", puerto=servidor.server_address[1], usuario="", clave="",
+                                  destino="alertas@prueba", starttls=False, remitente="api@prueba")
+        correo.enviar(persona(1), b"\xff\xd8jpeg")
+        correo.enviar(persona(2), None)
+        correo.cerrar()
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+    assert len(servidor.mensajes) == 2
+    # La segunda alerta encontró la conexión cerrada y abrió otra
+    assert servidor.conexiones == 2
+    assert b"rostro_detectado.jpg" in servidor.mensajes[0]
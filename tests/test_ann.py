@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+
+from utils.ann import EmparejadorGaleria, IVF_MINIMO
+from utils.galeria import GaleriaResidente
+
+
+def galeria_ivf(rng, n=IVF_MINIMO + 500):
+    galeria = GaleriaResidente(cuantizada=False, directorio_compartido="")
+    galeria.cargar([{"id": f"p{i}", "nombre": f"N{i}", "apellidos": "A", "requisitoriado": False,
+                     "kp": kp.tolist()} for i, kp in enumerate(rng.normal(0, 0.09, (n, 128)).astype(np.float32))])
+    return galeria
+
+
+def esperar_indice(emparejador, instantanea, limite_s=30):
+    inicio = time.perf_counter()
+    while emparejador._listo[0] is not instantanea:
+        assert time.perf_counter() - inicio < limite_s
+        time.sleep(0.01)
+
+
+def test_busqueda_sin_indice_es_exacta_y_el_entrenamiento_va_en_un_hilo():
+    rng = np.random.default_rng(0)
+    galeria = galeria_ivf(rng)
+    instantanea = galeria.instantanea
+    emparejador = EmparejadorGaleria(modo="ivf", ruta="")
+
+    # La primera búsqueda no entrena: responde con la búsqueda exacta
+    indices, _ = emparejador.buscar(instantanea.matriz[7], instantanea, umbral=-1, k=1)
+    assert indices[0] == 7
+    esperar_indice(emparejador, instantanea)
+    assert emparejador.preparaciones_en_hilo == 1
+
+    # Con el índice publicado la búsqueda pasa por las listas del IVF
+    indices, _ = emparejador.buscar(instantanea.matriz[7], instantanea, umbral=-1, k=1)
+    assert indices[0] == 7
+
+
+def test_alta_se_extiende_sin_reentrenar():
+    rng = np.random.default_rng(1)
+    galeria = galeria_ivf(rng)
+    emparejador = EmparejadorGaleria(modo="ivf", ruta="")
+    indice = emparejador.preparar(galeria.instantanea)
+
+    kp = rng.normal(0, 0.09, 128).astype(np.float32)
+    galeria.agregar({"id": "nueva", "nombre": "N", "apellidos": "A", "requisitoriado": False, "kp": kp.tolist()})
+    instantanea = galeria.instantanea
+    indices, _ = emparejador.buscar(kp, instantanea, umbral=-1, k=1)
+
+    assert instantanea.persona(indices[0])["id"] == "nueva"
+    assert emparejador._listo[0] is instantanea
+    assert emparejador._listo[1].centroides is indice.centroides
+    assert emparejador.preparaciones_en_hilo == 0
+
+
+def test_plantilla_reescrita_cambia_de_lista():
+    rng = np.random.default_rng(2)
+    galeria = galeria_ivf(rng)
+    emparejador = EmparejadorGaleria(modo="ivf", ruta="", n_sondeos=1)
+    emparejador.preparar(galeria.instantanea)
+
+    # La plantilla entrenada queda en la otra punta de la esfera: con un solo sondeo solo
+    # se encuentra si la fila pasó a la lista de su nuevo centroide
+    nuevo = -galeria.instantanea.matriz[3]
+    galeria.actualizar_kp("p3", nuevo.tolist())
+    instantanea = galeria.instantanea
+    indices, _ = emparejador.buscar(nuevo, instantanea, umbral=-1, k=1)
+
+    assert instantanea.persona(indices[0])["id"] == "p3"
+    assert emparejador._listo[0] is instantanea
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import sqlite3
+
+import numpy as np
+from PIL import Image
+
+from utils.cache_embeddings import CacheEmbeddings
+from utils.rostros import EjecutorEmbeddings
+
+
+class EjecutorContado(EjecutorEmbeddings):
+    # Sin pool de procesos: cada extracción devuelve un embedding distinto y se cuenta
+    def __init__(self, cache):
+        super().__init__(cache=cache)
+        self.extracciones = 0
+
+    async def ejecutar(self, funcion, *args):
+        self.extracciones += 1
+        return [float(self.extracciones)] * 128
+
+
+def jpeg(img, calidad):
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=calidad)
+    return buffer.getvalue()
+
+
+def imagen():
+    rng = np.random.default_rng(0)
+    degradado = np.linspace(0, 255, 128, dtype=np.uint8)[None, :, None].repeat(128, 0).repeat(3, 2)
+    ruido = rng.integers(0, 8, (128, 128, 3), dtype=np.uint8)
+    return Image.fromarray(degradado + ruido)
+
+
+def test_casi_duplicado_solo_si_se_pide():
+    async def probar():
+        ejecutor = EjecutorContado(CacheEmbeddings(usar_phash=True))
+        original, recomprimida = jpeg(imagen(), 95), jpeg(imagen(), 60)
+        await ejecutor.extraer(original, casi_duplicados=True)
+
+        # /reconocer: una imagen parecida no reutiliza el embedding de otra
+        await ejecutor.extraer(recomprimida)
+        assert ejecutor.extracciones == 2
+
+        ejecutor = EjecutorContado(CacheEmbeddings(usar_phash=True))
+        await ejecutor.extraer(original)
+        assert await ejecutor.extraer(recomprimida, casi_duplicados=True) == [1.0] * 128
+        assert ejecutor.extracciones == 1
+        assert ejecutor.cache.estado()["aciertos"]["phash"] == 1
+
+    asyncio.run(probar())
+
+
+def test_escrituras_a_disco_por_lotes(tmp_path):
+    async def probar():
+        ruta = str(tmp_path / "cache.db")
+        cache = CacheEmbeddings(ruta_disco=ruta, intervalo_disco_s=60)
+        ejecutor = EjecutorContado(cache)
+        for i in range(5):
+            await ejecutor.extraer(jpeg(imagen().rotate(i * 10), 90))
+        assert cache.estado()["disco_pendientes"] == 5
+        assert sqlite3.connect(ruta).execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 0
+
+        ejecutor.cerrar()
+        assert cache.estado()["lotes_disco"] == 1
+        # Otro proceso (reinicio) lo encuentra en disco
+        otro = EjecutorContado(CacheEmbeddings(ruta_disco=ruta))
+        assert await otro.extraer(jpeg(imagen().rotate(20), 90)) == [3.0] * 128
+        assert otro.extracciones == 0 and otro.cache.estado()["aciertos"]["disco"] == 1
+
+    asyncio.run(probar())
@@ -0,0 +1,64 @@
+import numpy as np
+
+from utils.codec_kp import codificar_kp
+from utils.galeria import GaleriaResidente
+
+
+def persona(persona_id, kp, nombre="Ana"):
+    return {"id": persona_id, "nombre": nombre, "apellidos": "Paz", "requisitoriado": False, "kp": kp}
+
+
+def galeria_en_memoria(rng, n=3):
+    galeria = GaleriaResidente(cuantizada=False, directorio_compartido="")
+    kps = rng.normal(0, 0.09, (n, 128)).astype(np.float32)
+    galeria.cargar([persona(f"p{i}", codificar_kp(kps[i])) for i in range(n)])
+    return galeria, kps
+
+
+def aplicar_del_registro(galeria, filas, eliminados=()):
+    return galeria.confirmar_cambios(galeria.preparar_cambios(filas, eliminados))
+
+
+def test_preparar_no_toca_la_instantanea_vigente():
+    rng = np.random.default_rng(0)
+    galeria, kps = galeria_en_memoria(rng)
+    actual = galeria.instantanea
+    nueva = rng.normal(0, 0.09, 128).astype(np.float32)
+
+    preparado = galeria.preparar_cambios(
+        [persona("p1", codificar_kp(kps[1]), nombre="Eva"), persona("p9", codificar_kp(nueva))], {"p0"}
+    )
+    assert galeria.instantanea is actual
+    assert len(actual.ids) == 3 and actual.nombres[1] == "Ana" and "p0" in actual.posiciones
+
+    assert galeria.confirmar_cambios(preparado) == 3
+    actual = galeria.instantanea
+    assert actual.nombres[actual.posiciones["p1"]] == "Eva"
+    assert "p9" in actual.posiciones and "p0" not in actual.posiciones
+
+
+def test_preparado_sobre_una_galeria_que_cambio_se_descarta():
+    rng = np.random.default_rng(1)
+    galeria, kps = galeria_en_memoria(rng)
+    preparado = galeria.preparar_cambios([persona("p1", codificar_kp(kps[1]), nombre="Eva")])
+    galeria.actualizar_kp("p2", kps[2] + 0.01)
+    assert galeria.confirmar_cambios(preparado) is None
+
+
+def test_el_registro_no_pisa_la_plantilla_entrenada():
+    rng = np.random.default_rng(2)
+    galeria, kps = galeria_en_memoria(rng)
+    entrenada = kps[1] + rng.normal(0, 0.01, 128).astype(np.float32)
+    galeria.actualizar_kp("p1", entrenada)
+
+    # Otro worker cambia el nombre: la fila trae el kp viejo de la base
+    aplicar_del_registro(galeria, [persona("p1", codificar_kp(kps[1]), nombre="Eva")])
+    actual = galeria.instantanea
+    assert actual.nombres[actual.posiciones["p1"]] == "Eva"
+    assert np.allclose(galeria.kp("p1"), entrenada)
+
+    # Vuelve la plantilla guardada (en f16): desde aquí la base manda otra vez
+    aplicar_del_registro(galeria, [persona("p1", codificar_kp(entrenada), nombre="Eva")])
+    otra = kps[1] + rng.normal(0, 0.01, 128).astype(np.float32)
+    aplicar_del_registro(galeria, [persona("p1", codificar_kp(otra), nombre="Eva")])
+    assert np.allclose(galeria.kp("p1"), otra, atol=2e-3)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from utils.codec_kp import FORMATOS, MatrizCuantizada, codificar_kp, decodificar_kp, formato_kp
+
+
+def kp_aleatorio(rng):
+    return rng.normal(0, 0.09, 128).astype(np.float32)
+
+
+@pytest.mark.parametrize("formato", FORMATOS)
+def test_ida_y_vuelta_por_formato(formato):
+    rng = np.random.default_rng(0)
+    kp = kp_aleatorio(rng)
+    codificado = codificar_kp(kp, formato)
+
+    assert formato_kp(codificado) == formato
+    vector = decodificar_kp(codificado)
+    assert vector.dtype == np.float32 and vector.shape == (128,)
+    error = np.abs(vector - kp)
+    if formato in ("json", "f32"):
+        assert np.array_equal(vector, kp)
+    elif formato == "f16":
+        # 11 bits de mantisa: error relativo de media unidad en la última posición
+        assert np.all(error <= np.abs(kp) * 2 ** -11 + 1e-7)
+    else:
+        # Redondeo al entero más cercano: como mucho media escala por componente
+        assert error.max() <= np.abs(kp).max() / 127 / 2 + 1e-7
+
+
+def test_texto_json_y_valores_invalidos():
+    kp = kp_aleatorio(np.random.default_rng(1))
+    assert np.array_equal(decodificar_kp(str(kp.tolist())), kp)
+    assert decodificar_kp(None) is None
+    assert decodificar_kp("f16:no es base64") is None
+    assert decodificar_kp(kp[:64].tolist()) is None
+
+
+def test_matriz_cuantizada_acota_el_error_por_fila():
+    rng = np.random.default_rng(2)
+    matriz = rng.normal(0, 0.09, (500, 128)).astype(np.float32)
+    matriz[7] = 0  # una fila nula no debe dividir por cero
+    cuantizada = MatrizCuantizada.desde(matriz)
+
+    reconstruida = cuantizada[:]
+    cota = np.abs(matriz).max(axis=1, keepdims=True) / 127 / 2 + 1e-7
+    assert np.all(np.abs(reconstruida - matriz) <= cota)
+    assert np.array_equal(cuantizada[7], np.zeros(128, dtype=np.float32))
+    assert np.allclose(cuantizada.normas(), np.linalg.norm(reconstruida, axis=1), rtol=1e-5)
+    assert cuantizada.nbytes < matriz.nbytes / 3
+
+    # Las escrituras se cuantizan igual que la construcción
+    nueva = kp_aleatorio(rng)
+    cuantizada[3] = nueva
+    assert np.abs(cuantizada[3] - nueva).max() <= np.abs(nueva).max() / 127 / 2 + 1e-7
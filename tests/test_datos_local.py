@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+
+from utils import datos_local
+from utils.datos_local import DatosLocales, parsear_columnas
+
+
+def con_base(tmp_path, prueba):
+    async def ejecutar():
+        datos = DatosLocales(str(tmp_path / "prueba.db"), str(tmp_path / "fotos"), "/fotos/")
+        await datos.iniciar()
+        try:
+            return await prueba(datos)
+        finally:
+            await datos.cerrar()
+
+    return asyncio.run(ejecutar())
+
+
+def test_parsear_columnas():
+    assert parsear_columnas("*") == (["*"], {})
+    assert parsear_columnas("id, fecha, personas(nombre, apellidos), hora") == (
+        ["id", "fecha", "hora"], {"personas": ["nombre", "apellidos"]})
+
+
+def test_select_con_relacion_embebida():
+    sql = DatosLocales._select("reconocimientos", "id, personas(nombre)")
+    assert sql == ('SELECT t.id AS "id", p.nombre AS "personas.nombre" FROM reconocimientos AS t '
+                   "LEFT JOIN personas AS p ON p.id = t.persona_id")
+    assert DatosLocales._select("alertas", "*").startswith("SELECT t.* FROM alertas AS t")
+    with pytest.raises(ValueError):
+        DatosLocales._select("reconocimientos", "id, camaras(nombre)")
+
+
+def test_filas_con_tipos_de_postgrest_y_relaciones(tmp_path):
+    async def prueba(datos):
+        ana = await datos.insertar_persona({"nombre": "Ana", "apellidos": "Díaz", "kp": [0.5, -0.25],
+                                            "requisitoriado": True})
+        luis = await datos.insertar_persona({"nombre": "Luis", "apellidos": "Paz", "kp": "f16:AAAA",
+                                             "requisitoriado": False})
+        assert ana["kp"] == [0.5, -0.25] and ana["requisitoriado"] is True
+        assert luis["kp"] == "f16:AAAA" and luis["requisitoriado"] is False
+        assert await datos.persona(ana["id"], "nombre, apellidos") == {"nombre": "Ana", "apellidos": "Díaz"}
+        assert await datos.persona("no-existe") is None
+
+        await datos.insertar_lote("reconocimientos", [
+            {"persona_id": ana["id"], "fecha": "2026-10-01", "hora": "08:00:00"},
+            {"persona_id": ana["id"], "fecha": "2026-10-02", "hora": "09:00:00", "latitud": -12.0, "longitud": -77.0},
+            {"persona_id": luis["id"], "fecha": "2026-10-02", "hora": "10:00:00"},
+        ])
+        recientes = await datos.recientes("reconocimientos", "id, fecha, hora, personas(nombre, requisitoriado)", 2)
+        assert [(r["hora"], r["personas"]) for r in recientes] == [
+            ("10:00:00", {"nombre": "Luis", "requisitoriado": False}),
+            ("09:00:00", {"nombre": "Ana", "requisitoriado": True}),
+        ]
+        pagina = await datos.pagina_reciente("reconocimientos", "id, hora", (
+            "2026-10-02", "09:00:00", recientes[1]["id"]), 10)
+        assert [f["hora"] for f in pagina] == ["08:00:00"]
+        assert len(await datos.pagina_reciente("reconocimientos", "id", None, 10, fecha="2026-10-02")) == 2
+        assert [f["persona_id"] for f in await datos.reconocimientos_desde("2026-10-02")] == [ana["id"], luis["id"]]
+        assert [f["id"] for f in await datos.reconocimientos_posteriores(1, 1)] == [2]
+        assert {p["nombre"] for p in await datos.personas_por_ids([luis["id"], "otra"])} == {"Luis"}
+        assert await datos.contar_requisitoriados_reconocidos() == 1
+        assert [(f["nombre"], f["total"]) for f in await datos.top_personas_reconocidas()] == [("Ana", 2), ("Luis", 1)]
+
+        # El borrado de una persona se lleva sus reconocimientos (ON DELETE CASCADE)
+        await datos.eliminar_persona(ana["id"])
+        assert await datos.contar("reconocimientos") == 1
+
+    con_base(tmp_path, prueba)
+
+
+def test_recorrer_pagina_por_keyset(tmp_path, monkeypatch):
+    monkeypatch.setattr(datos_local, "DATOS_PAGINA", 3)
+
+    async def prueba(datos):
+        persona = await datos.insertar_persona({"nombre": "Ana"})
+        await datos.insertar_lote("entrenamientos", [
+            {"persona_id": persona["id"], "fecha": "2026-10-01", "hora": f"08:00:{i:02d}"} for i in range(7)])
+        consultas = datos.consultas
+        filas = [f async for f in datos.recorrer("entrenamientos", "hora")]
+        assert [f["id"] for f in filas] == list(range(1, 8))
+        assert datos.consultas - consultas == 3
+
+    con_base(tmp_path, prueba)
+
+
+def test_triggers_registran_los_cambios_de_personas(tmp_path):
+    async def prueba(datos):
+        assert await datos.ultimo_cambio() == 0
+        ana = await datos.insertar_persona({"nombre": "Ana"})
+        luis = await datos.insertar_persona({"nombre": "Luis"})
+        assert await datos.actualizar_persona(ana["id"], {"apellidos": "Díaz"}) == [{**ana, "apellidos": "Díaz"}]
+        await datos.actualizar_lote("personas", {luis["id"]: {"kp": [1.0]}})
+        await datos.eliminar_persona(luis["id"])
+
+        cambios = await datos.cambios_desde(0, 100)
+        assert [(c["seq"], c["persona_id"], c["operacion"]) for c in cambios] == [
+            (1, ana["id"], "upsert"), (2, luis["id"], "upsert"), (3, ana["id"], "upsert"),
+            (4, luis["id"], "upsert"), (5, luis["id"], "delete"),
+        ]
+        assert [c["seq"] for c in await datos.cambios_desde(3, 1)] == [4]
+        assert await datos.ultimo_cambio() == 5
+
+    con_base(tmp_path, prueba)
+
+
+def test_esquema_persiste_al_reabrir(tmp_path):
+    async def crear(datos):
+        return (await datos.insertar_persona({"nombre": "Ana"}))["id"]
+
+    persona_id = con_base(tmp_path, crear)
+
+    async def leer(datos):
+        assert (await datos.persona(persona_id))["nombre"] == "Ana"
+        assert await datos.ultimo_cambio() == 1
+        url = await datos.subir_foto("../x/foto.jpg", b"jpeg", "image/jpeg")
+        assert url == "/fotos/foto.jpg"
+        assert (tmp_path / "fotos" / "foto.jpg").read_bytes() == b"jpeg"
+
+    con_base(tmp_path, leer)
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from utils.dedupe import CacheReconocidos
+
+
+def test_ttl_vence_y_la_persona_vuelve_a_registrarse():
+    cache = CacheReconocidos(ttl_s=3600)
+    inicio = datetime(2026, 3, 1, 10, 0, 0)
+
+    assert cache.marcar_si_nuevo("p1", inicio)
+    assert not cache.marcar_si_nuevo("p1", inicio + timedelta(minutes=30))
+    # Un acierto no renueva la ventana: cuenta desde el último registro
+    assert cache.marcar_si_nuevo("p1", inicio + timedelta(minutes=61))
+    assert cache.estado()["aciertos"] == 1 and cache.estado()["fallos"] == 2
+
+
+def test_se_descarta_lo_mas_antiguo_al_llegar_al_maximo():
+    cache = CacheReconocidos(ttl_s=3600, maximo=3)
+    inicio = datetime(2026, 3, 1, 10, 0, 0)
+    for i, persona_id in enumerate("abcd"):
+        assert cache.marcar_si_nuevo(persona_id, inicio + timedelta(seconds=i))
+
+    assert cache.estado()["entradas"] == 3
+    # "a" salió por tamaño aunque seguía dentro del TTL; "d" sigue marcada
+    assert cache.marcar_si_nuevo("a", inicio + timedelta(seconds=10))
+    assert not cache.marcar_si_nuevo("d", inicio + timedelta(seconds=11))
+
+
+def test_calentar_cruzando_la_medianoche():
+    cache = CacheReconocidos(ttl_s=3600)
+    ahora = datetime(2026, 3, 2, 0, 20, 0)
+    # reconocimientos_desde trae desde la fecha de ahora - TTL, es decir desde el día anterior
+    cache.calentar([
+        {"persona_id": "ayer_tarde", "fecha": "2026-03-01", "hora": "22:00:00"},
+        {"persona_id": "antes_de_medianoche", "fecha": "2026-03-01", "hora": "23:40:00"},
+        {"persona_id": "hoy", "fecha": "2026-03-02", "hora": "00:05:00"},
+        {"persona_id": "hoy", "fecha": "2026-03-01", "hora": "23:00:00"},
+    ], ahora)
+
+    assert cache.estado()["entradas"] == 2
+    assert cache.marcar_si_nuevo("ayer_tarde", ahora)
+    assert not cache.marcar_si_nuevo("antes_de_medianoche", ahora)
+    # Vale el más reciente de cada persona: 00:05 vence a la 01:05, no a la medianoche
+    assert not cache.marcar_si_nuevo("hoy", datetime(2026, 3, 2, 1, 0, 0))
+    assert cache.marcar_si_nuevo("hoy", datetime(2026, 3, 2, 1, 6, 0))
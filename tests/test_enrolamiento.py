@@ -0,0 +1,146 @@
+import asyncio
+import io
+import zipfile
+
+import numpy as np
+import pytest
+
+from utils.codec_kp import decodificar_kp
+from utils.enrolamiento import EnroladorMasivo, leer_manifiesto
+from utils.rostros import ColaSaturada
+
+
+MANIFIESTO = "\ufeffArchivo, Nombre ,apellidos,requisitoriado\nfotos/a.jpg,Ana,Díaz,sí\nb.jpg,Luis,Paz,\n"
+
+
+def zip_con(archivos):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        for nombre, contenido in archivos.items():
+            z.writestr(nombre, contenido)
+    buffer.seek(0)
+    return buffer
+
+
+class Destino:
+    # Extractor, subidor y base falsos: el embedding es el primer byte de la foto
+    def __init__(self, fallar_lote=None, saturar=0):
+        self.fallar_lote = fallar_lote
+        self.saturar = saturar
+        self.lotes = []
+        self.encoladas = []
+        self.insertadas = []
+        self.reservadas = 0
+
+    async def extraer(self, contenido):
+        if self.saturar:
+            self.saturar -= 1
+            raise ColaSaturada()
+        if contenido.startswith(b"sin rostro"):
+            raise ValueError("No se detectó rostro.")
+        return np.full(128, contenido[0] / 255, dtype=np.float32)
+
+    def reservar_foto(self):
+        self.reservadas += 1
+        return f"foto{self.reservadas}", f"/fotos/foto{self.reservadas}.jpg"
+
+    async def encolar_foto(self, contenido, foto):
+        self.encoladas.append((foto, contenido))
+
+    async def insertar_lote(self, tabla, filas):
+        if len(self.lotes) == self.fallar_lote:
+            self.lotes.append(None)
+            raise ConnectionError("sin conexión")
+        self.lotes.append([f["nombre"] for f in filas])
+
+    async def al_insertar(self, filas):
+        self.insertadas += filas
+
+    def enrolador(self, lote=2):
+        return EnroladorMasivo(self.extraer, self.reservar_foto, self.encolar_foto, self.insertar_lote,
+                               self.al_insertar, concurrencia=2, lote=lote)
+
+
+def eventos(enrolador, archivo_zip, manifiesto=None):
+    async def recoger():
+        return [e async for e in enrolador.procesar(*EnroladorMasivo.abrir(archivo_zip, manifiesto))]
+
+    return asyncio.run(recoger())
+
+
+def test_leer_manifiesto_normaliza_cabeceras_y_valores():
+    filas = leer_manifiesto(MANIFIESTO)
+    assert filas == [
+        {"archivo": "fotos/a.jpg", "nombre": "Ana", "apellidos": "Díaz", "correo": "", "requisitoriado": "sí"},
+        {"archivo": "b.jpg", "nombre": "Luis", "apellidos": "Paz", "correo": "", "requisitoriado": ""},
+    ]
+    with pytest.raises(ValueError, match="apellidos"):
+        leer_manifiesto("archivo,nombre\na.jpg,Ana\n")
+
+
+def test_manifiesto_demasiado_largo(monkeypatch):
+    monkeypatch.setattr("utils.enrolamiento.ENROLAMIENTO_MAX_FILAS", 2)
+    with pytest.raises(ValueError, match="máximo"):
+        leer_manifiesto("archivo,nombre,apellidos\n" + "a.jpg,Ana,Díaz\n" * 3)
+
+
+def test_abrir_valida_zip_y_busca_el_manifiesto():
+    with pytest.raises(ValueError, match="ZIP"):
+        EnroladorMasivo.abrir(io.BytesIO(b"no es un zip"))
+    with pytest.raises(ValueError, match="manifiesto"):
+        EnroladorMasivo.abrir(zip_con({"a.jpg": b"a"}))
+
+    contenedor, nombres, filas = EnroladorMasivo.abrir(zip_con({
+        "lote/manifiesto.csv": "archivo,nombre,apellidos\na.jpg,Ana,Díaz\n", "lote/a.jpg": b"a", "lote/": b""}))
+    assert nombres == {"lote/manifiesto.csv": "lote/manifiesto.csv", "lote/a.jpg": "lote/a.jpg"}
+    assert [f["nombre"] for f in filas] == ["Ana"]
+    contenedor.close()
+
+    # Un manifiesto enviado aparte tiene prioridad sobre el del ZIP
+    contenedor, _, filas = EnroladorMasivo.abrir(zip_con({"a.jpg": b"a"}), MANIFIESTO.encode())
+    assert len(filas) == 2
+    contenedor.close()
+
+
+def test_procesar_inserta_por_lotes_y_reporta_cada_fila():
+    destino = Destino(saturar=3)
+    manifiesto = ("archivo,nombre,apellidos,requisitoriado\n" + "".join(f"{i}.jpg,P{i},X,{i % 2}\n" for i in range(5))
+                  + "falta.jpg,Nadie,X,\nsin.jpg,Sin,X,\n,Vacio,X,\n")
+    archivos = {f"{i}.jpg": bytes([i + 10]) * 4 for i in range(5)}
+    archivos["sin.jpg"] = b"sin rostro"
+    resultado = eventos(destino.enrolador(lote=2), zip_con(archivos), manifiesto)
+
+    filas = {e["fila"]: e for e in resultado if e["evento"] == "fila"}
+    assert sorted(filas) == list(range(1, 9))
+    assert {n for n, e in filas.items() if e["estado"] == "ok"} == {1, 2, 3, 4, 5}
+    assert filas[6]["error"] == "La foto no está en el ZIP."
+    assert filas[7]["error"] == "No se detectó rostro."
+    assert filas[8]["error"] == "Faltan archivo o nombre."
+
+    # Lotes de 2 más el resto al final; progreso tras cada lote y el resumen al cierre
+    assert sorted(len(lote) for lote in destino.lotes) == [1, 2, 2]
+    assert sum(e["evento"] == "progreso" for e in resultado) == 3
+    resumen = resultado[-1]
+    assert resumen["evento"] == "resumen"
+    assert (resumen["registradas"], resumen["errores"], resumen["total"]) == (5, 3, 8)
+
+    # Cada persona guardada lleva su embedding, su foto reservada y la foto encolada desde el ZIP
+    personas = {p["nombre"]: p for p in destino.insertadas}
+    assert personas["P3"]["requisitoriado"] is True and personas["P2"]["requisitoriado"] is False
+    assert decodificar_kp(personas["P3"]["kp"])[0] == pytest.approx(13 / 255, abs=1e-2)
+    fotos = dict(destino.encoladas)
+    assert len(fotos) == 5
+    for persona in destino.insertadas:
+        foto = persona["foto"].rsplit("/", 1)[1].removesuffix(".jpg")
+        assert fotos[foto] == bytes([int(persona["nombre"][1:]) + 10]) * 4
+
+
+def test_lote_fallido_no_encola_sus_fotos():
+    destino = Destino(fallar_lote=0)
+    manifiesto = "archivo,nombre,apellidos\n" + "".join(f"{i}.jpg,P{i},X\n" for i in range(3))
+    resultado = eventos(destino.enrolador(lote=2), zip_con({f"{i}.jpg": b"x" for i in range(3)}), manifiesto)
+
+    errores = [e for e in resultado if e["evento"] == "fila" and e["estado"] == "error"]
+    assert len(errores) == 2 and all(e["error"].startswith("Error al guardar") for e in errores)
+    assert len(destino.encoladas) == len(destino.insertadas) == 1
+    assert (resultado[-1]["registradas"], resultado[-1]["errores"]) == (1, 2)
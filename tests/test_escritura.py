@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+
+from utils.escritura import SumideroEventos
+
+
+class BaseFalsa:
+    # insertar_lote que rechaza las filas de personas borradas (FK) o toda la tabla si está caída
+    def __init__(self, borradas=()):
+        self.borradas = set(borradas)
+        self.caida = False
+        self.filas = []
+        self.llamadas = 0
+
+    async def insertar_lote(self, tabla, filas):
+        self.llamadas += 1
+        if self.caida:
+            raise ConnectionError("sin conexión")
+        if any(fila["persona_id"] in self.borradas for fila in filas):
+            raise ValueError("violates foreign key constraint")
+        self.filas += filas
+
+
+def fila(i, persona_id=None):
+    return {"persona_id": persona_id or f"p{i}", "n": i}
+
+
+def sumidero(base, tmp_path, **opciones):
+    return SumideroEventos(base.insertar_lote, reintentos=0, respaldo=str(tmp_path / "pendientes.jsonl"),
+                           rechazadas=str(tmp_path / "rechazadas.jsonl"), **opciones)
+
+
+def leer(ruta):
+    with open(ruta) as f:
+        return [json.loads(linea) for linea in f]
+
+
+def test_fila_rechazada_se_aparta_y_no_bloquea_la_tabla(tmp_path):
+    base = BaseFalsa(borradas={"borrada"})
+    s = sumidero(base, tmp_path)
+    for i in range(50):
+        s.agregar("reconocimientos", fila(i, "borrada" if i == 17 else None))
+
+    asyncio.run(s.vaciar())
+
+    assert sorted(f["n"] for f in base.filas) == [i for i in range(50) if i != 17]
+    assert s.estado()["pendientes"] == {}
+    assert s.estado()["descartadas"] == 1
+    rechazadas = leer(tmp_path / "rechazadas.jsonl")
+    assert [(r["tabla"], r["fila"]["n"]) for r in rechazadas] == [("reconocimientos", 17)]
+    assert "foreign key" in rechazadas[0]["error"]
+    # Bisección: unas pocas inserciones, no una por fila
+    assert base.llamadas < 20
+
+
+def test_base_caida_conserva_el_lote_sin_descartar(tmp_path):
+    base = BaseFalsa()
+    base.caida = True
+    s = sumidero(base, tmp_path)
+    for i in range(10):
+        s.agregar("alertas", fila(i))
+
+    asyncio.run(s.vaciar())
+    assert s.estado()["pendientes"] == {"alertas": 10}
+    assert s.estado()["descartadas"] == 0
+    assert base.llamadas == 1
+
+    base.caida = False
+    asyncio.run(s.vaciar())
+    assert len(base.filas) == 10
+    assert s.estado()["pendientes"] == {}
+
+
+def test_cola_llena_se_vuelca_a_disco_y_se_recupera(tmp_path):
+    base = BaseFalsa()
+    s = sumidero(base, tmp_path, max_pendientes=5)
+    for i in range(12):
+        s.agregar("reconocimientos", fila(i))
+    assert s.estado()["pendientes"] == {"reconocimientos": 5}
+    assert s.estado()["volcadas"] == 7
+
+    async def vaciar_todo():
+        while True:
+            await s.vaciar()
+            if not s._recuperar_respaldo() and not s.estado()["pendientes"]:
+                return
+
+    asyncio.run(vaciar_todo())
+    assert sorted(f["n"] for f in base.filas) == list(range(12))
+    assert not os.path.exists(tmp_path / "pendientes.jsonl")
+
+
+def test_apagar_con_respaldo_a_medio_leer_no_duplica_filas(tmp_path):
+    base = BaseFalsa()
+    base.caida = True
+    s = sumidero(base, tmp_path, max_pendientes=5)
+    for i in range(12):
+        s.agregar("reconocimientos", fila(i))
+
+    async def apagar():
+        await s.vaciar()
+        s._tomar()  # simula que se insertaron las 5 de memoria
+        assert s._recuperar_respaldo() == 5
+        await s.cerrar()
+
+    asyncio.run(apagar())
+    # Quedan las 5 recuperadas (sin insertar) y las 2 que nunca salieron del archivo
+    assert sorted(e["fila"]["n"] for e in leer(tmp_path / "pendientes.jsonl")) == list(range(5, 12))
+
+    base.caida = False
+    s = sumidero(base, tmp_path)
+
+    async def reiniciar():
+        await s.iniciar()
+        await s.cerrar()
+
+    asyncio.run(reiniciar())
+    assert sorted(f["n"] for f in base.filas) == list(range(5, 12))
+    assert not os.path.exists(tmp_path / "pendientes.jsonl")
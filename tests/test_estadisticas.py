@@ -0,0 +1,88 @@
+import asyncio
+
+from utils.estadisticas import EstadisticasDashboard
+
+
+def agregados(personas=0, reconocimientos=0, alertas=0):
+    return {
+        "total_personas": personas,
+        "total_reconocimientos": reconocimientos,
+        "total_alertas": alertas,
+        "top": [{"persona_id": "p1", "nombre": "Ana", "apellidos": "Paz", "total": reconocimientos}],
+        "requisitoriados_reconocidos": 1,
+        "persona_mas_reciente": {"fecha": "2026-01-01", "hora": "10:00:00",
+                                 "personas": {"nombre": "Ana", "apellidos": "Paz"}},
+    }
+
+
+def test_reconciliar_conserva_lo_insertado_durante_la_consulta():
+    async def probar():
+        base = {"reconocimientos": 100}
+        estadisticas = None
+
+        async def obtener():
+            # La base ya vio las 5 filas de antes; estas 3 llegan mientras se consulta
+            valores = agregados(10, base["reconocimientos"])
+            estadisticas.registrar_insertadas("reconocimientos", 3)
+            return valores
+
+        estadisticas = EstadisticasDashboard(obtener, ttl_s=0)
+        estadisticas.registrar_insertadas("reconocimientos", 5)
+        await estadisticas.reconciliar()
+        assert estadisticas.resumen()["total_reconocimientos"] == 103
+
+    asyncio.run(probar())
+
+
+def test_resumen_mantiene_la_forma_original():
+    async def probar():
+        async def obtener():
+            return agregados(4, 7, 2)
+
+        estadisticas = EstadisticasDashboard(obtener, ttl_s=0)
+        await estadisticas.reconciliar()
+        estadisticas.registrar_persona()
+        resumen = estadisticas.resumen()
+        assert resumen["top_3"] == agregados(reconocimientos=7)["top"]
+        assert resumen["total_personas"] == 5
+        assert resumen["porcentaje_requisitoriados"] == "1 de 5 personas están requisitoriadas (20.0%)"
+        assert resumen["persona_mas_reciente"]["personas"]["nombre"] == "Ana"
+
+    asyncio.run(probar())
+
+
+def test_top_suma_los_reconocimientos_insertados_desde_el_refresco():
+    async def probar():
+        base = {"top": [{"persona_id": "a", "nombre": "Ana", "apellidos": "Paz", "total": 10},
+                        {"persona_id": "b", "nombre": "Beto", "apellidos": "Rey", "total": 8},
+                        {"persona_id": "c", "nombre": "Cira", "apellidos": "Sol", "total": 5}]}
+
+        async def obtener():
+            return {**agregados(3, 23), "top": base["top"]}
+
+        estadisticas = EstadisticasDashboard(obtener, ttl_s=0)
+        await estadisticas.reconciliar()
+        for persona_id, nombre in (("c", "Cira"), ("d", "Dora")):
+            estadisticas.registrar_reconocimiento({"id": persona_id, "nombre": nombre, "apellidos": "X"},
+                                                  "2026-01-02", "09:00:00")
+        estadisticas.registrar_insertadas("reconocimientos", 8, ["c"] * 6 + ["d"] * 2)
+
+        top = estadisticas.resumen()["top_3"]
+        assert [(fila["persona_id"], fila["total"]) for fila in top] == [("c", 11), ("a", 10), ("b", 8)]
+        assert estadisticas.resumen()["total_reconocimientos"] == 31
+
+        # Quien supera al último de la base entra con sus reconocimientos locales
+        estadisticas.registrar_insertadas("reconocimientos", 7, ["d"] * 7)
+        top = estadisticas.resumen()["top_3"]
+        assert [(fila["persona_id"], fila["total"]) for fila in top] == [("c", 11), ("a", 10), ("d", 9)]
+        assert top[2]["nombre"] == "Dora"
+
+        # Tras refrescar, la base ya los incluye y no se cuentan dos veces
+        base["top"] = [{"persona_id": "c", "nombre": "Cira", "apellidos": "Sol", "total": 11},
+                       {"persona_id": "a", "nombre": "Ana", "apellidos": "Paz", "total": 10},
+                       {"persona_id": "d", "nombre": "Dora", "apellidos": "X", "total": 9}]
+        await estadisticas.reconciliar()
+        top = estadisticas.resumen()["top_3"]
+        assert [(fila["persona_id"], fila["total"]) for fila in top] == [("c", 11), ("a", 10), ("d", 9)]
+
+    asyncio.run(probar())
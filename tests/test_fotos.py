@@ -0,0 +1,102 @@
+import asyncio
+import io
+import os
+
+from PIL import Image
+
+from utils.fotos import SubidorFotos
+
+
+def jpeg(lado=64):
+    buffer = io.BytesIO()
+    Image.new("RGB", (lado, lado), (120, 80, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_foto_sin_subir_queda_en_disco_y_se_sube_al_reiniciar(tmp_path):
+    async def probar():
+        subidas = {}
+
+        async def falla(nombre, contenido, content_type):
+            raise ConnectionError("bucket caído")
+
+        async def sube(nombre, contenido, content_type):
+            subidas[nombre] = contenido
+
+        subidor = SubidorFotos(falla, lambda nombre: nombre, reintentos=0, respaldo=str(tmp_path))
+        subidor.iniciar()
+        foto = await subidor.encolar(jpeg())
+        await subidor.esperar()
+        await subidor.cerrar()
+        assert os.listdir(tmp_path) == [foto]
+
+        subidor = SubidorFotos(sube, lambda nombre: nombre, respaldo=str(tmp_path))
+        subidor.iniciar()
+        while subidor.estado()["subidas"] < 1:
+            await asyncio.sleep(0.01)
+        await subidor.cerrar()
+        assert foto in subidas
+        assert os.listdir(tmp_path) == []
+
+    asyncio.run(probar())
+
+
+def test_apagar_con_la_cola_llena_guarda_las_fotos(tmp_path):
+    async def probar():
+        async def lenta(nombre, contenido, content_type):
+            await asyncio.sleep(10)
+
+        subidor = SubidorFotos(lenta, lambda nombre: nombre, trabajadores=1, respaldo=str(tmp_path))
+        subidor.iniciar()
+        fotos = [await subidor.encolar(jpeg()) for _ in range(3)]
+        await asyncio.sleep(0.1)
+        await subidor.cerrar(espera_s=0.1)
+        assert sorted(os.listdir(tmp_path)) == sorted(fotos)
+        assert subidor.estado()["bytes_pendientes"] == 0
+
+    asyncio.run(probar())
+
+
+def test_la_cola_se_acota_por_bytes(tmp_path):
+    async def probar():
+        liberar = asyncio.Event()
+
+        async def retenida(nombre, contenido, content_type):
+            await liberar.wait()
+
+        contenido = jpeg()
+        subidor = SubidorFotos(retenida, lambda nombre: nombre, trabajadores=1,
+                               cola_max_bytes=2 * len(contenido), respaldo=str(tmp_path))
+        subidor.iniciar()
+        await subidor.encolar(contenido)
+        await subidor.encolar(contenido)
+        tercera = asyncio.create_task(subidor.encolar(contenido))
+        await asyncio.sleep(0.1)
+        assert not tercera.done()
+        liberar.set()
+        await asyncio.wait_for(tercera, 5)
+        await subidor.esperar()
+        await subidor.cerrar()
+        assert subidor.estado()["subidas"] == 3
+
+    asyncio.run(probar())
+
+
+def test_foto_reservada_se_sube_con_el_nombre_de_su_url(tmp_path):
+    async def probar():
+        subidas = {}
+
+        async def sube(nombre, contenido, content_type):
+            subidas[nombre] = contenido
+
+        subidor = SubidorFotos(sube, lambda nombre: f"https://bucket/{nombre}", respaldo=str(tmp_path))
+        subidor.iniciar()
+        foto, url = subidor.reservar()
+        # Entre la reserva y la subida se guarda la fila; si falla no se encola nada
+        assert url == f"https://bucket/{foto}" and subidas == {}
+        assert await subidor.encolar(jpeg(), foto) == url
+        await subidor.esperar()
+        await subidor.cerrar()
+        assert foto in subidas
+
+    asyncio.run(probar())
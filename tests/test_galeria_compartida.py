@@ -0,0 +1,64 @@
+import fcntl
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.galeria import GaleriaResidente
+from utils.galeria_compartida import CANDADO
+
+
+def persona(i, rng):
+    return {"id": f"p{i}", "nombre": f"N{i}", "apellidos": "A", "requisitoriado": False,
+            "kp": rng.normal(0, 0.09, 128).astype(np.float32).tolist()}
+
+
+def candado_de_otro_escritor(directorio):
+    candado = open(os.path.join(directorio, CANDADO), "a")
+    fcntl.flock(candado, fcntl.LOCK_EX)
+    return candado
+
+
+def test_plantilla_no_espera_al_flock_y_se_escribe_despues(tmp_path):
+    rng = np.random.default_rng(0)
+    galeria = GaleriaResidente(cuantizada=False, directorio_compartido=str(tmp_path))
+    galeria.cargar([persona(i, rng) for i in range(3)])
+    nuevo = rng.normal(0, 0.09, 128).astype(np.float32)
+
+    candado = candado_de_otro_escritor(tmp_path)
+    inicio = time.perf_counter()
+    galeria.actualizar_kp("p1", nuevo)
+    assert time.perf_counter() - inicio < 0.5
+    assert np.allclose(galeria.kp("p1"), nuevo)
+    assert not np.allclose(galeria.instantanea.matriz[galeria.instantanea.posiciones["p1"]], nuevo)
+    assert not galeria.escribir_kp_pendientes(esperar=False)
+
+    candado.close()
+    assert galeria.escribir_kp_pendientes(esperar=False)
+    assert np.allclose(galeria.instantanea.matriz[galeria.instantanea.posiciones["p1"]], nuevo)
+
+
+def test_cambios_simultaneos_se_publican_juntos(tmp_path):
+    rng = np.random.default_rng(1)
+    galeria = GaleriaResidente(cuantizada=False, directorio_compartido=str(tmp_path))
+    galeria.cargar([persona(i, rng) for i in range(3)])
+    version = galeria.version
+
+    candado = candado_de_otro_escritor(tmp_path)
+    hilos = [threading.Thread(target=galeria.agregar, args=(persona(i, rng),)) for i in range(3, 8)]
+    hilos.append(threading.Thread(target=galeria.eliminar, args=("p0",)))
+    hilos.append(threading.Thread(target=galeria.actualizar_datos, args=("p1", {"nombre": "Nuevo"})))
+    for hilo in hilos:
+        hilo.start()
+    while len(galeria._cambios_pendientes) < len(hilos):
+        time.sleep(0.01)
+    candado.close()
+    for hilo in hilos:
+        hilo.join()
+
+    assert galeria.lotes_publicados == 1
+    assert galeria.version == version + 1
+    actual = galeria.instantanea
+    assert sorted(actual.posiciones.get(f"p{i}") is not None for i in range(8)) == [False] + [True] * 7
+    assert actual.nombres[actual.posiciones["p1"]] == "Nuevo"
@@ -0,0 +1,125 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.mapa import BITS_CELDA, NIVEL, IndiceMapa, codigo_morton, proyectar
+
+
+class DatosFalsos:
+    def __init__(self, filas):
+        self.filas = filas
+
+    async def reconocimientos_posteriores(self, desde, lote):
+        return [f for f in self.filas if f["id"] > desde][:lote]
+
+
+class GaleriaFalsa:
+    def __init__(self, personas):
+        self.instantanea = None
+        self.publicar(personas)
+
+    def publicar(self, personas):
+        version = self.instantanea.version + 1 if self.instantanea else 1
+        self.instantanea = SimpleNamespace(
+            version=version, posiciones={p: i for i, p in enumerate(personas)},
+            nombres=[f"Nombre {p}" for p in personas], apellidos=[f"Apellido {p}" for p in personas])
+
+
+def fila(i, persona_id, latitud, longitud, fecha="2026-10-01", hora="12:00:00"):
+    return {"id": i, "persona_id": persona_id, "latitud": latitud, "longitud": longitud, "fecha": fecha, "hora": hora}
+
+
+def indice(filas, personas):
+    return IndiceMapa(DatosFalsos(filas), GaleriaFalsa(personas), intervalo_s=0, reconstruir_s=0, lote=3)
+
+
+def cargar(mapa):
+    async def cargar():
+        mapa.iniciar()
+        await mapa.esperar()
+        await mapa.cerrar()
+
+    asyncio.run(cargar())
+
+
+def test_morton_intercala_bits():
+    assert int(codigo_morton(0b11, 0)) == 0b0101
+    assert int(codigo_morton(0, 0b11)) == 0b1010
+    rng = np.random.default_rng(0)
+    x, y = rng.integers(0, 1 << NIVEL, 1000), rng.integers(0, 1 << NIVEL, 1000)
+    codigos = codigo_morton(x, y)
+    # Se recuperan x e y tomando los bits pares e impares
+    bits = np.arange(NIVEL, dtype=np.uint64)
+    assert np.array_equal(((codigos[:, None] >> (2 * bits)) & np.uint64(1)) @ (np.uint64(1) << bits), x)
+    assert np.array_equal(((codigos[:, None] >> (2 * bits + 1)) & np.uint64(1)) @ (np.uint64(1) << bits), y)
+
+
+def test_prefijo_del_codigo_es_la_tesela():
+    rng = np.random.default_rng(1)
+    latitudes, longitudes = rng.uniform(-80, 80, 500), rng.uniform(-180, 180, 500)
+    codigos = codigo_morton(*proyectar(latitudes, longitudes))
+    for z in (0, 3, 10, 21):
+        x, y = proyectar(latitudes, longitudes, nivel=z)
+        assert np.array_equal(codigos >> np.uint64(2 * (NIVEL - z)), codigo_morton(x, y))
+
+
+def test_tesela_agrupa_por_celda_y_omite_personas_borradas():
+    # Dos grupos separados dentro de la misma tesela de zoom 10 y un punto aislado de "c"
+    filas = [fila(i, "a", -12.0460 + i * 1e-5, -77.0430) for i in range(1, 5)]
+    filas += [fila(10, "b", -12.0460, -77.0430, hora="13:30:00")]
+    filas += [fila(20, "c", -12.1, -77.0)]
+    mapa = indice(filas, ["a", "b", "c"])
+    cargar(mapa)
+    assert len(mapa.instantanea) == 6
+
+    x, y = proyectar([-12.0460], [-77.0430], nivel=10)
+    z, x, y = 10, int(x[0]), int(y[0])
+    respuesta = asyncio.run(mapa.tesela(z, x, y))
+    assert respuesta["total"] == 6
+    grupos = sorted(respuesta["clusters"], key=lambda c: c["total"])
+    assert [c["total"] for c in grupos] == [1, 5]
+    assert grupos[0]["persona_id"] == "c" and grupos[0]["nombre"] == "Nombre c"
+    assert grupos[1]["ultimo"] == "2026-10-01 13:30:00" and "persona_id" not in grupos[1]
+    assert abs(grupos[1]["latitud"] - np.mean([f["latitud"] for f in filas[:5]])) < 1e-5
+    # Celdas de 8x8 por tesela: los centroides caen en celdas distintas
+    celdas = codigo_morton(*proyectar([c["latitud"] for c in grupos], [c["longitud"] for c in grupos],
+                                      nivel=z + BITS_CELDA))
+    assert celdas[0] != celdas[1]
+
+    # Al borrar a "b" la caché de la tesela queda vieja y sus puntos dejan de contar
+    mapa.galeria.publicar(["a", "c"])
+    respuesta = asyncio.run(mapa.tesela(z, x, y))
+    assert respuesta["total"] == 5
+    assert mapa.estado()["cache"]["fallos"] == 2
+
+
+def test_puntos_nuevos_invalidan_solo_su_tesela():
+    filas = [fila(1, "a", 40.4168, -3.7038), fila(2, "a", -34.6037, -58.3816)]
+    mapa = indice(filas, ["a"])
+    cargar(mapa)
+
+    madrid = [int(v[0]) for v in proyectar([40.4168], [-3.7038], nivel=8)]
+    baires = [int(v[0]) for v in proyectar([-34.6037], [-58.3816], nivel=8)]
+    assert asyncio.run(mapa.tesela(8, *madrid))["total"] == 1
+    assert asyncio.run(mapa.tesela(8, *baires))["total"] == 1
+
+    mapa.datos.filas.append(fila(3, "a", 40.4169, -3.7039))
+    assert asyncio.run(mapa.actualizar()) == 1
+    assert asyncio.run(mapa.tesela(8, *baires))["total"] == 1
+    assert mapa.estado()["cache"] == {"teselas": 1, "aciertos": 1, "fallos": 2}
+    assert asyncio.run(mapa.tesela(8, *madrid))["total"] == 2
+
+
+def test_agrupar_y_puntos_respetan_caja_y_fechas():
+    filas = [fila(1, "a", 10, 10, fecha="2026-09-30"), fila(2, "a", 10.5, 10.5, fecha="2026-10-01"),
+             fila(3, "b", 50, 50, fecha="2026-10-02")]
+    mapa = indice(filas, ["a", "b"])
+    cargar(mapa)
+
+    respuesta = asyncio.run(mapa.agrupar(4, caja=(0, 0, 20, 20)))
+    assert respuesta["total"] == 2
+    assert asyncio.run(mapa.agrupar(4, caja=(0, 0, 20, 20), desde="2026-10-01"))["total"] == 1
+    puntos = asyncio.run(mapa.puntos(hasta="2026-10-01", limite=10))
+    assert [p["timestamp"] for p in puntos] == ["2026-10-01 12:00:00", "2026-09-30 12:00:00"]
+    assert asyncio.run(mapa.puntos(limite=1))[0]["nombre"] == "Nombre b"
@@ -0,0 +1,51 @@
+import numpy as np
+
+from utils.galeria import GaleriaResidente
+from utils.plantillas import EntrenadorPlantillas
+from utils.similitud import scores_hibridos, UMBRAL_COINCIDENCIA
+
+
+async def no_guardar(kps):
+    pass
+
+
+def galeria_con_persona(rng):
+    galeria = GaleriaResidente(cuantizada=False, directorio_compartido="")
+    kp = rng.normal(0, 0.09, 128).astype(np.float32)
+    galeria.cargar([{"id": "p1", "nombre": "Ana", "apellidos": "Paz", "kp": kp.tolist(), "requisitoriado": False}])
+    return galeria, kp
+
+
+def muestra_con_score(kp, rng, minimo, maximo):
+    # Misma persona con ruido de captura, hasta caer en la banda de score pedida
+    while True:
+        muestra = kp + rng.normal(0, 0.028, 128).astype(np.float32)
+        score = scores_hibridos(muestra, kp[None, :])[0]
+        if minimo < score < maximo:
+            return muestra, score
+
+
+def test_coincidencia_entre_075_y_08_actualiza_la_plantilla():
+    rng = np.random.default_rng(0)
+    galeria, kp = galeria_con_persona(rng)
+    entrenador = EntrenadorPlantillas(galeria, no_guardar)
+    muestra, score = muestra_con_score(kp, rng, UMBRAL_COINCIDENCIA, 0.8)
+
+    assert entrenador.agregar_muestra("p1", muestra)
+    nueva = galeria.instantanea.matriz[0]
+    assert not np.allclose(nueva, kp)
+    # La plantilla se acerca a la muestra
+    assert np.linalg.norm(nueva - muestra) < np.linalg.norm(kp - muestra)
+    assert entrenador.estado()["aceptadas"] == 1
+    assert entrenador.estado()["atipicas"] == 0
+
+
+def test_muestra_de_otra_persona_se_descarta():
+    rng = np.random.default_rng(1)
+    galeria, kp = galeria_con_persona(rng)
+    entrenador = EntrenadorPlantillas(galeria, no_guardar)
+    otra = rng.normal(0, 0.09, 128).astype(np.float32)
+
+    assert not entrenador.agregar_muestra("p1", otra)
+    assert np.allclose(galeria.instantanea.matriz[0], kp)
+    assert entrenador.estado()["atipicas"] == 1
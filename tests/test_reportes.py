@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+from utils.reportes import GeneradorReportes, bloques
+
+
+def generador_con_filas(directorio, n=30):
+    filas = {
+        "alertas": [{"id": i, "fecha": "2026-01-01", "hora": f"10:00:{i % 60:02d}", "nombre": f"N{i}",
+                     "apellidos": "A", "score": 0.9, "metodo_envio": "ambos"} for i in range(n)],
+        "reconocimientos": [{"id": i, "fecha": "2026-01-01", "hora": f"10:00:{i % 60:02d}",
+                             "personas": {"nombre": f"N{i}", "apellidos": "A", "requisitoriado": False}}
+                            for i in range(n)],
+    }
+
+    async def obtener_pagina(tabla, columnas, cursor, limite, fecha):
+        inicio = 0 if cursor is None else cursor[2] + 1
+        return filas[tabla][inicio:inicio + limite]
+
+    return GeneradorReportes(obtener_pagina, tamano_pagina=10, directorio=str(directorio))
+
+
+def test_el_pdf_se_guarda_en_disco_y_se_envia_por_bloques(tmp_path):
+    async def probar():
+        generador = generador_con_filas(tmp_path)
+        contenido = b"".join(bloques(await generador.abrir_async("todos"), tamano=1024))
+        assert contenido.startswith(b"%PDF") and contenido.rstrip().endswith(b"%%EOF")
+        assert [nombre for nombre in os.listdir(tmp_path) if nombre.endswith(".pdf")]
+
+        # Sin cambios se reutiliza el mismo archivo; con cambios se reemplaza y el viejo se borra
+        antes = set(os.listdir(tmp_path))
+        bloques(await generador.abrir_async("todos"))
+        assert set(os.listdir(tmp_path)) == antes
+        generador.marcar_cambio("alertas")
+        b"".join(bloques(await generador.abrir_async("todos")))
+        assert len(os.listdir(tmp_path)) == 1 and set(os.listdir(tmp_path)) != antes
+
+    asyncio.run(probar())
+
+
+def test_trabajo_listo_se_descarga_desde_el_archivo(tmp_path):
+    async def probar():
+        generador = generador_con_filas(tmp_path)
+        trabajo = generador.trabajo(generador.crear_trabajo("top10"))
+        await trabajo["tarea"]
+        assert trabajo["estado"] == "listo" and "pdf" not in trabajo
+        assert b"".join(bloques(generador.abrir_trabajo(trabajo))).startswith(b"%PDF")
+
+    asyncio.run(probar())
@@ -0,0 +1,93 @@
+import pytest
+
+from utils.seguimiento import Pista, SeguidorRostros, caja_conocida, iou
+
+
+def caja(top, left, lado=100):
+    # (top, right, bottom, left), como face_recognition
+    return (top, left + lado, top + lado, left)
+
+
+def test_iou():
+    assert iou(caja(0, 0), caja(0, 0)) == 1.0
+    assert iou(caja(0, 0), caja(0, 100)) == 0.0  # solo se tocan
+    assert iou(caja(0, 0), caja(0, 500)) == 0.0
+    # Mitad superpuesta: 5000 / (10000 + 10000 - 5000)
+    assert iou(caja(0, 0), caja(0, 50)) == pytest.approx(1 / 3)
+
+
+def test_caja_conocida():
+    conocidas = [caja(0, 0), caja(300, 300)]
+    assert caja_conocida(caja(5, 5), conocidas)
+    assert caja_conocida(caja(300, 340), conocidas, umbral=0.4)
+    assert not caja_conocida(caja(300, 340), conocidas, umbral=0.5)
+    assert not caja_conocida(caja(150, 150), conocidas)
+    assert not caja_conocida(caja(0, 0), [])
+
+
+def test_asociacion_por_iou_conserva_las_pistas():
+    seguidor = SeguidorRostros(umbral_iou=0.3)
+    (a, b), perdidas = seguidor.actualizar([caja(0, 0), caja(0, 400)])
+    assert (a.id, b.id) == (1, 2) and perdidas == []
+
+    # Se mueven un poco y llegan en otro orden: cada caja sigue con su pista
+    (b2, a2), _ = seguidor.actualizar([caja(5, 410), caja(10, 10)])
+    assert (a2, b2) == (a, b)
+    assert a.caja == caja(10, 10) and a.ultimo_visto == 2
+
+    # Una caja que solapa poco con ambas abre una pista nueva
+    (c,), _ = seguidor.actualizar([caja(0, 200)])
+    assert c.id == 3 and len(seguidor.pistas) == 3
+
+
+def test_cada_pista_se_asigna_a_una_sola_caja():
+    seguidor = SeguidorRostros(umbral_iou=0.3)
+    (a,), _ = seguidor.actualizar([caja(0, 0)])
+    # Dos cajas solapan con la pista: se queda la de mayor IoU y la otra es una pista nueva
+    (lejana, cercana), _ = seguidor.actualizar([caja(0, 40), caja(0, 10)])
+    assert cercana is a and lejana is not a
+
+
+def test_pistas_perdidas_tras_max_perdidos():
+    seguidor = SeguidorRostros(max_perdidos=2)
+    (a, b), _ = seguidor.actualizar([caja(0, 0), caja(0, 400)])
+    for _ in range(2):
+        _, perdidas = seguidor.actualizar([caja(0, 0)])
+        assert perdidas == []
+    _, perdidas = seguidor.actualizar([caja(0, 0)])
+    assert perdidas == [b]
+    assert seguidor.pistas == [a]
+
+
+def test_cajas_omitibles_hasta_el_reintento():
+    seguidor = SeguidorRostros(reintento=3)
+    (dudosa, confiable, nueva), _ = seguidor.actualizar([caja(0, 0), caja(0, 400), caja(400, 0)])
+    dudosa.ultimo_intento = seguidor.fotograma
+    dudosa.identificar({"id": "p1"}, 0.5)
+    confiable.ultimo_intento = seguidor.fotograma
+    confiable.identificar({"id": "p2"}, 0.95)
+
+    # La nueva nunca se codificó: no se omite. La dudosa se omite hasta cumplir el reintento.
+    assert seguidor.cajas_omitibles() == [dudosa.caja, confiable.caja]
+    seguidor.actualizar([dudosa.caja, confiable.caja, nueva.caja])
+    assert seguidor.cajas_omitibles() == [dudosa.caja, confiable.caja]
+    seguidor.actualizar([dudosa.caja, confiable.caja, nueva.caja])
+    assert seguidor.cajas_omitibles() == [confiable.caja]
+
+
+def test_reidentifica_solo_si_mejora_el_score():
+    pista = Pista(1, caja(0, 0), 1)
+    assert pista.identificar({"id": "p1"}, 0.6)
+    assert not pista.confiable
+
+    # Peor o igual: no cambia nada
+    assert not pista.identificar({"id": "p2"}, 0.6)
+    assert pista.persona["id"] == "p1"
+
+    # Mejor score de la misma persona: se actualiza sin emitir otro evento
+    assert not pista.identificar({"id": "p1"}, 0.7)
+    assert pista.score == 0.7
+
+    # Mejor score de otra persona: la pista cambia de identidad
+    assert pista.identificar({"id": "p2"}, 0.9)
+    assert pista.persona["id"] == "p2" and pista.confiable
@@ -0,0 +1,42 @@
+import numpy as np
+
+from utils.similitud import FILAS_POR_BLOQUE, score_similitud_hibrida, scores_hibridos, scores_hibridos_lote
+
+# La versión vectorizada calcula en float32; contra la referencia en float64 la diferencia
+# observada es del orden de 1e-7
+TOLERANCIA = 1e-6
+
+
+def embeddings(rng, n):
+    return rng.normal(0, 0.09, (n, 128)).astype(np.float32)
+
+
+def test_scores_hibridos_coincide_con_la_referencia():
+    rng = np.random.default_rng(0)
+    matriz = embeddings(rng, 200)
+    for probe in embeddings(rng, 5):
+        esperados = [score_similitud_hibrida(probe, fila) for fila in matriz]
+        np.testing.assert_allclose(scores_hibridos(probe, matriz), esperados, rtol=0, atol=TOLERANCIA)
+
+
+def test_parecidos_e_identicos_coinciden_con_la_referencia():
+    # La zona que decide el umbral: la misma persona con ruido de captura y el mismo vector
+    rng = np.random.default_rng(1)
+    base = embeddings(rng, 50)
+    matriz = np.concatenate([base + rng.normal(0, 0.02, base.shape).astype(np.float32), base])
+    for probe in base[:5]:
+        esperados = [score_similitud_hibrida(probe, fila) for fila in matriz]
+        np.testing.assert_allclose(scores_hibridos(probe, matriz), esperados, rtol=0, atol=TOLERANCIA)
+
+
+def test_lote_y_bloques_coinciden_con_la_referencia():
+    # Más filas que un bloque para pasar por el recorrido por bloques
+    rng = np.random.default_rng(2)
+    matriz = embeddings(rng, FILAS_POR_BLOQUE + 37)
+    probes = embeddings(rng, 3)
+    scores = scores_hibridos_lote(probes, matriz)
+    filas = rng.choice(len(matriz), 64, replace=False)
+    filas[-1] = len(matriz) - 1
+    for j, probe in enumerate(probes):
+        esperados = [score_similitud_hibrida(probe, matriz[i]) for i in filas]
+        np.testing.assert_allclose(scores[j, filas], esperados, rtol=0, atol=TOLERANCIA)
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from utils.metricas import ALERTAS, ALERTAS_TOTAL, cronometro
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+
+ALERTAS_COLA_MAX = int(os.getenv("ALERTAS_COLA_MAX", "100"))
+ALERTAS_TRABAJADORES = int(os.getenv("ALERTAS_TRABAJADORES", "2"))
+# Alertas repetidas de la misma persona dentro de esta ventana se agrupan en una sola
+ALERTAS_VENTANA_S = float(os.getenv("ALERTAS_VENTANA_S", "300"))
+ALERTAS_REINTENTOS = int(os.getenv("ALERTAS_REINTENTOS", "3"))
+ALERTAS_ESPERA_S = float(os.getenv("ALERTAS_ESPERA_S", "1"))  # espera antes del primer reintento, se duplica
+
+
+class TransporteCorreo:
+    # Conexión SMTP persistente; se reabre si el servidor la cerró
+    def __init__(self, host=SMTP_HOST, puerto=SMTP_PORT, usuario=None, clave=None,
+                 destino=None, starttls=SMTP_STARTTLS, remitente=None):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario if usuario is not None else os.getenv("SMTP_USER")
+        self.clave = clave if clave is not None else os.getenv("SMTP_PASS")
+        self.destino = destino if destino is not None else os.getenv("ALERTA_DESTINO_MAIL")
+        self.remitente = remitente or os.getenv("SMTP_FROM") or self.usuario
+        self.starttls = starttls
+        self._conexion = None
+        self._lock = threading.Lock()
+
+    def _conectar(self):
+        import smtplib
+
+        conexion = smtplib.SMTP(self.host, self.puerto, timeout=30)
+        if self.starttls:
+            conexion.starttls()
+        if self.usuario:
+            conexion.login(self.usuario, self.clave)
+        return conexion
+
+    def _mensaje(self, persona, file_bytes):
+        # smtplib y email se importan con la primera alerta, no al arrancar la API
+        from email import encoders
+        from email.mime.base import MIMEBase
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
+        cuerpo = (
+            f"🚨 ALERTA: Persona requisitoriada detectada\n\n"
+            f"Nombre: {persona['nombre']} {persona['apellidos']}\n"
+            f"ID: {persona['id']}\n"
+            f"Score: {persona['score']}"
+        )
+
+        # Construcción del correo
+        msg = MIMEMultipart()
+        msg['Subject'] = '🚨 ALERTA DE SEGURIDAD'
+        msg['From'] = self.remitente
+        msg['To'] = self.destino
+
+        # Cuerpo del mensaje
+        msg.attach(MIMEText(cuerpo, 'plain'))
+
+        # Adjuntar la imagen como .jpg
+        if file_bytes:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(file_bytes)
+            encoders.encode_base64(part)
+            part.add_header('Content-Disposition', 'attachment; filename="rostro_detectado.jpg"')
+            msg.attach(part)
+        return msg
+
+    def enviar(self, persona, file_bytes):
+        import smtplib
+
+        msg = self._mensaje(persona, file_bytes)
+        with self._lock:
+            if self._conexion is None:
+                self._conexion = self._conectar()
+            try:
+                self._conexion.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # Conexión inactiva cerrada por el servidor: un reintento con conexión nueva
+                self._conexion = self._conectar()
+                self._conexion.send_message(msg)
+
+    def cerrar(self):
+        with self._lock:
+            if self._conexion is not None:
+                import smtplib
+
+                try:
+                    self._conexion.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._conexion = None
+
+
+class TransporteSMS:
+    # Cliente de Twilio creado una sola vez y reutilizado
+    def __init__(self, sid=None, token=None, origen=None, destino=None, cliente=None):
+        self.sid = sid if sid is not None else os.getenv("TWILIO_SID")
+        self.token = token if token is not None else os.getenv("TWILIO_AUTH")
+        self.origen = origen if origen is not None else os.getenv("TWILIO_PHONE")
+        self.destino = destino if destino is not None else os.getenv("ALERTA_DESTINO_SMS")
+        self._cliente = cliente
+
+    @property
+    def cliente(self):
+        if self._cliente is None:
+            from twilio.rest import Client
+            self._cliente = Client(self.sid, self.token)
+        return self._cliente
+
+    def enviar(self, persona, file_bytes):
+        mensaje = (
+            f"🚨 ALERTA: {persona['nombre']} {persona['apellidos']} fue detectado como REQUISITORIADO."
+        )
+        self.cliente.messages.create(body=mensaje, from_=self.origen, to=self.destino)
+
+    def cerrar(self):
+        pass
+
+
+class DespachadorAlertas:
+    # Cola acotada con trabajadores que envían cada alerta por todos los transportes
+    def __init__(self, transportes, cola_max=ALERTAS_COLA_MAX, trabajadores=ALERTAS_TRABAJADORES,
+                 ventana_s=ALERTAS_VENTANA_S, reintentos=ALERTAS_REINTENTOS, espera_s=ALERTAS_ESPERA_S):
+        self.transportes = transportes  # {"correo": TransporteCorreo(), "sms": TransporteSMS()}
+        self.cola_max = cola_max
+        self.trabajadores = trabajadores
+        self.ventana_s = ventana_s
+        self.reintentos = reintentos
+        self.espera_s = espera_s
+        self._cola = asyncio.Queue(maxsize=cola_max)
+        self._tareas = []
+        self._ultimas = {}  # persona_id -> última alerta encolada, solo dentro de la ventana
+        self._podado = time.monotonic()
+        self.contadores = {"encoladas": 0, "agrupadas": 0, "descartadas": 0, "enviadas": 0, "fallidas": 0}
+
+    def _podar(self, ahora):
+        # Una pasada por ventana: solo quedan las personas alertadas hace menos de ventana_s
+        if ahora - self._podado >= self.ventana_s:
+            self._ultimas = {persona_id: t for persona_id, t in self._ultimas.items() if ahora - t < self.ventana_s}
+            self._podado = ahora
+
+    def encolar(self, persona, file_bytes=None):
+        # "encolada", "agrupada" (ya se alertó dentro de la ventana) o "descartada" (cola llena)
+        ahora = time.monotonic()
+        self._podar(ahora)
+        ultima = self._ultimas.get(persona["id"])
+        if ultima is not None and ahora - ultima < self.ventana_s:
+            self.contadores["agrupadas"] += 1
+            return "agrupada"
+        try:
+            self._cola.put_nowait((persona, file_bytes))
+        except asyncio.QueueFull:
+            self.contadores["descartadas"] += 1
+            logger.error("❌ Cola de alertas llena, se descarta la alerta de %s", persona["id"])
+            return "descartada"
+        self._ultimas[persona["id"]] = ahora
+        self.contadores["encoladas"] += 1
+        return "encolada"
+
+    async def _enviar(self, nombre, transporte, persona, file_bytes):
+        for intento in range(self.reintentos + 1):
+            try:
+                with cronometro(ALERTAS, nombre):
+                    await asyncio.to_thread(transporte.enviar, persona, file_bytes)
+                self.contadores["enviadas"] += 1
+                ALERTAS_TOTAL.incrementar(nombre, "enviada")
+                logger.info("✅ Alerta enviada por %s", nombre)
+                return
+            except Exception as e:
+                logger.warning("❌ Error al enviar alerta por %s (intento %d): %s", nombre, intento + 1, e)
+                if intento < self.reintentos:
+                    await asyncio.sleep(min(60, self.espera_s * 2 ** intento))
+        self.contadores["fallidas"] += 1
+        ALERTAS_TOTAL.incrementar(nombre, "fallida")
+
+    async def _trabajador(self):
+        while True:
+            persona, file_bytes = await self._cola.get()
+            try:
+                await asyncio.gather(*(
+                    self._enviar(nombre, transporte, persona, file_bytes)
+                    for nombre, transporte in self.transportes.items()
+                ))
+            finally:
+                self._cola.task_done()
+
+    def iniciar(self):
+        self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+
+    async def cerrar(self, espera_s=10):
+        try:
+            await asyncio.wait_for(self._cola.join(), espera_s)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ %d alertas sin enviar al apagar", self._cola.qsize())
+        for tarea in self._tareas:
+            tarea.cancel()
+        self._tareas = []
+        for transporte in self.transportes.values():
+            await asyncio.to_thread(transporte.cerrar)
+
+    def estado(self):
+        return {
+            "pendientes": self._cola.qsize(),
+            **self.contadores,
+        }
@@ -0,0 +1,236 @@
+import logging
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.similitud import scores_hibridos, scores_hibridos_lote, mejores_coincidencias, UMBRAL_COINCIDENCIA
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "exacto" recorre toda la galería; "ivf" usa el índice aproximado + re-ranking exacto
+MODO_EMPAREJAMIENTO = os.getenv("MODO_EMPAREJAMIENTO", "exacto")
+IVF_LISTAS = int(os.getenv("IVF_LISTAS", "0"))  # 0 = automático (~4·√N)
+IVF_SONDEOS = int(os.getenv("IVF_SONDEOS", "8"))
+IVF_MINIMO = int(os.getenv("IVF_MINIMO", "5000"))  # por debajo, la búsqueda exacta es más rápida
+IVF_RUTA = os.getenv("IVF_RUTA", "indice_ivf.npz")
+
+ITERACIONES_KMEANS = 12
+MUESTRA_KMEANS = 65536
+
+
+def normalizar(matriz):
+    normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+    normas[normas == 0] = 1
+    return (matriz / normas).astype(np.float32)
+
+
+class IndiceIVF:
+    # Índice de archivo invertido sobre embeddings normalizados (k-means esférico)
+    def __init__(self, centroides):
+        self.centroides = centroides
+        self.orden = np.empty(0, dtype=np.int64)
+        self.inicios = np.zeros(len(centroides) + 1, dtype=np.int64)
+        self.etiquetas = np.empty(0, dtype=np.int64)
+
+    @property
+    def n_listas(self):
+        return len(self.centroides)
+
+    @classmethod
+    def entrenar(cls, matriz, n_listas, semilla=0):
+        rng = np.random.default_rng(semilla)
+        # Se muestrea antes de normalizar: con una galería int8 solo se reconstruye la muestra
+        if len(matriz) > MUESTRA_KMEANS:
+            datos = normalizar(matriz[rng.choice(len(matriz), MUESTRA_KMEANS, replace=False)])
+        else:
+            datos = normalizar(matriz[:])
+
+        centroides = datos[rng.choice(len(datos), n_listas, replace=False)].copy()
+        for _ in range(ITERACIONES_KMEANS):
+            etiquetas = np.argmax(datos @ centroides.T, axis=1)
+            sumas = np.zeros_like(centroides)
+            np.add.at(sumas, etiquetas, datos)
+            vacias = np.bincount(etiquetas, minlength=n_listas) == 0
+            # Las listas que quedan vacías se reinician con puntos al azar
+            sumas[vacias] = datos[rng.choice(len(datos), int(vacias.sum()))]
+            centroides = normalizar(sumas)
+        return cls(centroides)
+
+    def _etiquetar(self, matriz, desde=0):
+        etiquetas = np.empty(len(matriz) - desde, dtype=np.int64)
+        for inicio in range(desde, len(matriz), MUESTRA_KMEANS):
+            bloque = normalizar(matriz[inicio:inicio + MUESTRA_KMEANS])
+            etiquetas[inicio - desde:inicio - desde + MUESTRA_KMEANS] = np.argmax(bloque @ self.centroides.T, axis=1)
+        return etiquetas
+
+    def _ordenar(self, etiquetas):
+        self.etiquetas = etiquetas
+        self.orden = np.argsort(etiquetas, kind="stable")
+        self.inicios = np.searchsorted(etiquetas[self.orden], np.arange(self.n_listas + 1))
+
+    def asignar(self, matriz):
+        self._ordenar(self._etiquetar(matriz))
+
+    def extender(self, matriz, reasignar=()):
+        # Índice nuevo con las filas agregadas al final de la galería y las reescritas
+        # (`reasignar`): solo se asignan esas, las demás conservan su lista
+        etiquetas = np.concatenate([self.etiquetas, self._etiquetar(matriz, len(self.etiquetas))])
+        if len(reasignar):
+            reasignar = np.unique(reasignar)
+            etiquetas[reasignar] = np.argmax(normalizar(matriz[reasignar]) @ self.centroides.T, axis=1)
+        extendido = IndiceIVF(self.centroides)
+        extendido._ordenar(etiquetas)
+        return extendido
+
+    def candidatos(self, probe, n_sondeos):
+        cercanos = np.argsort(self.centroides @ normalizar(probe))[::-1][:n_sondeos]
+        return np.concatenate([self.orden[self.inicios[c]:self.inicios[c + 1]] for c in cercanos])
+
+    def guardar(self, ruta):
+        # Escritura atómica: con varios workers, otro puede estar leyendo el archivo
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, "wb") as f:
+            np.savez(f, centroides=self.centroides)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with np.load(ruta) as datos:
+            return cls(datos["centroides"])
+
+
+class EmparejadorGaleria:
+    # Punto único de búsqueda de /reconocer; en modo "ivf" mantiene el índice
+    # sincronizado con la instantánea de la galería. Entrenar k-means o reasignar toda la
+    # galería se hace en un hilo: mientras tanto las búsquedas de esa instantánea son exactas.
+    def __init__(self, modo=MODO_EMPAREJAMIENTO, n_listas=IVF_LISTAS, n_sondeos=IVF_SONDEOS, ruta=IVF_RUTA):
+        self.modo = modo
+        self.n_listas = n_listas
+        self.n_sondeos = n_sondeos
+        self.ruta = ruta
+        self._lock = threading.Lock()  # una preparación a la vez
+        self._listo = (None, None)  # (instantánea, índice), se publican juntos
+        self._lock_pendiente = threading.Lock()
+        self._pendiente = None  # última instantánea pedida al hilo de preparación
+        self._fallida = None
+        self.preparaciones_en_hilo = 0
+
+    def _requiere_entrenamiento(self, indice, total):
+        if indice is None:
+            return True
+        if self.n_listas:
+            return indice.n_listas != self.n_listas
+        # En modo automático solo se re-entrena si la galería cambió mucho de tamaño
+        ideal = 4 * np.sqrt(total)
+        return not ideal / 2 <= indice.n_listas <= ideal * 2
+
+    def _extender(self, anterior, indice, instantanea):
+        # Los centroides se reutilizan; si la instantánea comparte la reserva con la anterior
+        # solo se asignan las filas agregadas o reescritas (None si no se puede).
+        # Se publica un índice nuevo para no alterar el que usan las búsquedas en curso.
+        if (indice is None or anterior is None or instantanea.reserva is None
+                or instantanea.reserva is not anterior.reserva or len(instantanea) < len(anterior)
+                or self._requiere_entrenamiento(indice, len(instantanea))):
+            return None
+        reescritas = instantanea.reserva[3][anterior.kp_cambiados:instantanea.kp_cambiados]
+        return indice.extender(instantanea.matriz, reescritas)
+
+    def preparar(self, instantanea):
+        # Bloqueante (k-means sobre la galería): fuera del loop, con asyncio.to_thread
+        if self.modo != "ivf" or len(instantanea) < IVF_MINIMO:
+            return None
+        with self._lock:
+            anterior, indice = self._listo
+            if anterior is instantanea:
+                return indice
+
+            asignado = self._extender(anterior, indice, instantanea)
+            if asignado is None:
+                if indice is None and self.ruta and os.path.exists(self.ruta):
+                    indice = IndiceIVF.cargar(self.ruta)
+                if self._requiere_entrenamiento(indice, len(instantanea)):
+                    n_listas = self.n_listas or max(1, int(4 * np.sqrt(len(instantanea))))
+                    indice = IndiceIVF.entrenar(instantanea.matriz, n_listas)
+                    if self.ruta:
+                        indice.guardar(self.ruta)
+                asignado = IndiceIVF(indice.centroides)
+                asignado.asignar(instantanea.matriz)
+            self._listo = (instantanea, asignado)
+            return asignado
+
+    def _vigente(self, instantanea):
+        # Índice de `instantanea` sin bloquear la búsqueda: la extensión incremental se hace
+        # aquí si nadie está preparando; lo demás queda para el hilo
+        if self.modo != "ivf" or len(instantanea) < IVF_MINIMO:
+            return None
+        anterior, indice = self._listo
+        if anterior is instantanea:
+            return indice
+        if self._lock.acquire(blocking=False):
+            try:
+                anterior, indice = self._listo
+                extendido = self._extender(anterior, indice, instantanea)
+                if extendido is not None:
+                    self._listo = (instantanea, extendido)
+                    return extendido
+            finally:
+                self._lock.release()
+        if instantanea is not self._fallida:
+            self._preparar_en_hilo(instantanea)
+        return None
+
+    def _preparar_en_hilo(self, instantanea):
+        with self._lock_pendiente:
+            lanzar = self._pendiente is None
+            self._pendiente = instantanea
+        if lanzar:
+            threading.Thread(target=self._preparar_pendientes, name="preparar-ivf", daemon=True).start()
+
+    def _preparar_pendientes(self):
+        # Prepara la última instantánea pedida; si llega otra mientras tanto, sigue con esa
+        while True:
+            with self._lock_pendiente:
+                instantanea = self._pendiente
+            try:
+                self.preparar(instantanea)
+                self.preparaciones_en_hilo += 1
+            except Exception:
+                # No se reintenta con la misma instantánea: las búsquedas siguen siendo exactas
+                self._fallida = instantanea
+                logger.exception("❌ Error al preparar el índice IVF")
+            with self._lock_pendiente:
+                if self._pendiente is instantanea:
+                    self._pendiente = None
+                    return
+
+    def buscar(self, probe, instantanea, umbral=UMBRAL_COINCIDENCIA, k=None):
+        indice = self._vigente(instantanea)
+        if indice is None:
+            scores = scores_hibridos(probe, instantanea.matriz, instantanea.normas)
+            if instantanea.activos is not None:
+                scores[~instantanea.activos] = -np.inf
+            return mejores_coincidencias(scores, umbral, k)
+
+        candidatos = indice.candidatos(np.asarray(probe, dtype=np.float32), self.n_sondeos)
+        scores = scores_hibridos(probe, instantanea.matriz[candidatos], instantanea.normas[candidatos])
+        if instantanea.activos is not None:
+            # Las bajas siguen en la matriz hasta la próxima compactación
+            scores[~instantanea.activos[candidatos]] = -np.inf
+        posiciones, scores = mejores_coincidencias(scores, umbral, k)
+        return candidatos[posiciones], scores
+
+    def buscar_lote(self, probes, instantanea, umbral=UMBRAL_COINCIDENCIA, k=None):
+        if self._vigente(instantanea) is not None:
+            return [self.buscar(probe, instantanea, umbral, k) for probe in probes]
+        scores = scores_hibridos_lote(probes, instantanea.matriz, instantanea.normas)
+        if instantanea.activos is not None:
+            scores[:, ~instantanea.activos] = -np.inf
+        return [mejores_coincidencias(fila, umbral, k) for fila in scores]
+
+
+emparejador = EmparejadorGaleria()
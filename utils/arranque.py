@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo que una petición espera a que termine el arranque antes de responder 503
+ARRANQUE_ESPERA_S = float(os.getenv("ARRANQUE_ESPERA_S", "120"))
+# Reintentos de la preparación tras un error (p. ej. Supabase caído un momento): espera
+# inicial que se duplica en cada intento hasta el máximo
+ARRANQUE_REINTENTO_S = float(os.getenv("ARRANQUE_REINTENTO_S", "2"))
+ARRANQUE_REINTENTO_MAX_S = float(os.getenv("ARRANQUE_REINTENTO_MAX_S", "60"))
+
+
+class ArranqueFallido(Exception):
+    pass
+
+
+class EstadoArranque:
+    # Cronología del arranque en frío: importación de main, cada etapa de preparación
+    # (galería, modelos, ...) y el primer reconocimiento servido. Todos los tiempos
+    # se miden desde `inicio` (el principio de la importación de main).
+    def __init__(self, inicio=None):
+        self.inicio = inicio if inicio is not None else time.perf_counter()
+        self.importacion_s = None
+        self.etapas = {}
+        self.listo_s = None
+        self.primer_reconocimiento_s = None
+        self.error = None
+        self.intentos = 0
+        self.proximo_intento_s = None
+        self._evento = asyncio.Event()
+
+    def _transcurrido(self):
+        return round(time.perf_counter() - self.inicio, 3)
+
+    @property
+    def listo(self):
+        return self._evento.is_set()
+
+    def marcar_importado(self):
+        self.importacion_s = self._transcurrido()
+
+    @contextmanager
+    def etapa(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = round(time.perf_counter() - inicio, 3)
+
+    def marcar_listo(self):
+        self.listo_s = self._transcurrido()
+        self.error = None
+        self.proximo_intento_s = None
+        self._evento.set()
+        logger.info("✅ API lista en %.2f s (importación %.2f s, etapas %s)",
+                    self.listo_s, self.importacion_s or 0, self.etapas)
+
+    def marcar_error(self, error, reintento_s):
+        # No libera a los que esperan: /ready sigue en 503 hasta que un reintento salga bien
+        self.error = str(error)
+        self.intentos += 1
+        self.proximo_intento_s = reintento_s
+        logger.error("❌ Falló el arranque (intento %d): %s; se reintenta en %.1f s", self.intentos, error, reintento_s)
+
+    def registrar_reconocimiento(self):
+        if self.primer_reconocimiento_s is None:
+            self.primer_reconocimiento_s = self._transcurrido()
+            logger.info("✅ Primer reconocimiento a los %.2f s del arranque", self.primer_reconocimiento_s)
+
+    async def esperar(self, timeout_s=ARRANQUE_ESPERA_S):
+        if self.error is not None and not self._evento.is_set():
+            # Mientras se reintenta se responde enseguida en lugar de retener la petición
+            raise ArranqueFallido(f"❌ La API no pudo iniciarse, se está reintentando: {self.error}")
+        try:
+            await asyncio.wait_for(self._evento.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            raise ArranqueFallido("⏳ La API se está iniciando, intente de nuevo en unos segundos.")
+
+    def tiempos(self):
+        # Para /metrics: [(fase, segundos)] de las fases ya completadas
+        fases = [("importacion", self.importacion_s), ("listo", self.listo_s),
+                 ("primer_reconocimiento", self.primer_reconocimiento_s)]
+        fases += [(f"etapa_{nombre}", segundos) for nombre, segundos in self.etapas.items()]
+        return [(fase, segundos) for fase, segundos in fases if segundos is not None]
+
+    def estado(self):
+        return {
+            "listo": self.listo,
+            "error": self.error,
+            "intentos_fallidos": self.intentos,
+            "proximo_intento_s": self.proximo_intento_s,
+            "importacion_s": self.importacion_s,
+            "etapas_s": dict(self.etapas),
+            "listo_s": self.listo_s,
+            "primer_reconocimiento_s": self.primer_reconocimiento_s,
+        }
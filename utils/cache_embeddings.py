@@ -0,0 +1,177 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+EMBEDDINGS_CACHE_MAX = int(os.getenv("EMBEDDINGS_CACHE_MAX", "2048"))
+# Ruta de un archivo SQLite para que la caché sobreviva reinicios; vacío = solo memoria
+EMBEDDINGS_CACHE_DISCO = os.getenv("EMBEDDINGS_CACHE_DISCO", "")
+EMBEDDINGS_CACHE_DISCO_MAX = int(os.getenv("EMBEDDINGS_CACHE_DISCO_MAX", "100000"))
+# Las escrituras al disco se agrupan y las hace un hilo aparte, fuera de la petición
+EMBEDDINGS_CACHE_DISCO_LOTE_S = float(os.getenv("EMBEDDINGS_CACHE_DISCO_LOTE_S", "1.0"))
+# Hash perceptual para reconocer casi-duplicados (recompresiones, reescalados). Un acierto
+# devuelve el embedding de otra imagen: solo lo usan las llamadas que lo piden (nunca /reconocer)
+EMBEDDINGS_CACHE_PHASH = os.getenv("EMBEDDINGS_CACHE_PHASH", "0") == "1"
+EMBEDDINGS_CACHE_PHASH_DISTANCIA = int(os.getenv("EMBEDDINGS_CACHE_PHASH_DISTANCIA", "4"))
+
+
+def hash_perceptual(file_bytes):
+    # dHash de 64 bits sobre una versión 9×8 en escala de grises
+    img = Image.open(io.BytesIO(file_bytes))
+    if img.format == "JPEG":
+        img.draft("L", (64, 64))
+    pixeles = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR))
+    # Un bit por par de columnas vecinas, fila a fila y el primero como el más significativo
+    return int.from_bytes(np.packbits(pixeles[:, :-1] > pixeles[:, 1:]).tobytes(), "big")
+
+
+class CacheEmbeddings:
+    # LRU en memoria indexada por SHA-256 de la imagen, con segundo nivel opcional en disco.
+    # obtener() y obtener_parecido() solo miran la memoria; obtener_disco() lee SQLite y se
+    # llama desde un hilo. guardar() deja la fila para el escritor, que confirma por lotes.
+    def __init__(self, maximo=EMBEDDINGS_CACHE_MAX, ruta_disco=EMBEDDINGS_CACHE_DISCO,
+                 maximo_disco=EMBEDDINGS_CACHE_DISCO_MAX, usar_phash=EMBEDDINGS_CACHE_PHASH,
+                 distancia_phash=EMBEDDINGS_CACHE_PHASH_DISTANCIA, intervalo_disco_s=EMBEDDINGS_CACHE_DISCO_LOTE_S):
+        self.maximo = maximo
+        self.maximo_disco = maximo_disco
+        self.usar_phash = usar_phash
+        self.distancia_phash = distancia_phash
+        self.intervalo_disco_s = intervalo_disco_s
+        self._memoria = OrderedDict()  # clave -> (resultado, phash)
+        self._lock = threading.Lock()
+        self._disco = None
+        self._lock_disco = threading.Lock()  # la conexión se usa desde el escritor y los lectores
+        self._por_escribir = []
+        self._hay_escrituras = threading.Event()
+        self._escritor = None
+        self._escrituras_disco = 0
+        self.lotes_disco = 0
+        self.aciertos = {"memoria": 0, "disco": 0, "phash": 0}
+        self.fallos = 0
+
+        if ruta_disco:
+            self._disco = sqlite3.connect(ruta_disco, check_same_thread=False)
+            self._disco.execute("PRAGMA journal_mode=WAL")
+            self._disco.execute("PRAGMA synchronous=NORMAL")
+            self._disco.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (clave TEXT PRIMARY KEY, resultado TEXT, creado REAL)"
+            )
+
+    @property
+    def con_disco(self):
+        return self._disco is not None
+
+    @staticmethod
+    def clave(file_bytes, modo):
+        return f"{modo}:{hashlib.sha256(file_bytes).hexdigest()}"
+
+    def _recordar(self, clave, resultado, phash):
+        self._memoria[clave] = (resultado, phash)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.maximo:
+            self._memoria.popitem(last=False)
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave in self._memoria:
+                self._memoria.move_to_end(clave)
+                self.aciertos["memoria"] += 1
+                return self._memoria[clave][0]
+            return None
+
+    def obtener_disco(self, clave):
+        # Bloquea en SQLite: llamar con asyncio.to_thread
+        if self._disco is None:
+            return None
+        with self._lock_disco:
+            fila = self._disco.execute("SELECT resultado FROM embeddings WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            return None
+        resultado = json.loads(fila[0])
+        with self._lock:
+            if clave not in self._memoria:
+                self._recordar(clave, resultado, None)
+            self.aciertos["disco"] += 1
+        return resultado
+
+    def obtener_parecido(self, clave, phash):
+        # Casi-duplicado por distancia de Hamming entre hashes perceptuales (mismo modo)
+        modo = clave.split(":", 1)[0]
+        with self._lock:
+            for otra, (resultado, otro_phash) in self._memoria.items():
+                if (otro_phash is not None and otra.startswith(modo + ":")
+                        and (phash ^ otro_phash).bit_count() <= self.distancia_phash):
+                    self._memoria.move_to_end(otra)
+                    self.aciertos["phash"] += 1
+                    return resultado
+            return None
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos += 1
+
+    def guardar(self, clave, resultado, phash=None):
+        with self._lock:
+            self._recordar(clave, resultado, phash)
+            if self._disco is None:
+                return
+            self._por_escribir.append((clave, json.dumps(resultado), time.time()))
+            if self._escritor is None:
+                self._escritor = threading.Thread(target=self._escribir_en_bucle, daemon=True,
+                                                  name="cache-embeddings-disco")
+                self._escritor.start()
+        self._hay_escrituras.set()
+
+    def _escribir_en_bucle(self):
+        while True:
+            self._hay_escrituras.wait()
+            # Se espera un poco para juntar las escrituras que lleguen seguidas
+            time.sleep(self.intervalo_disco_s)
+            self._hay_escrituras.clear()
+            self.vaciar()
+
+    def vaciar(self):
+        # Confirma de una vez las filas pendientes (y recorta la tabla de vez en cuando)
+        with self._lock:
+            filas, self._por_escribir = self._por_escribir, []
+        if not filas or self._disco is None:
+            return
+        with self._lock_disco:
+            self._disco.executemany(
+                "INSERT OR REPLACE INTO embeddings (clave, resultado, creado) VALUES (?, ?, ?)", filas
+            )
+            antes = self._escrituras_disco
+            self._escrituras_disco += len(filas)
+            if self._escrituras_disco // 1000 != antes // 1000:
+                self._disco.execute(
+                    "DELETE FROM embeddings WHERE clave NOT IN "
+                    "(SELECT clave FROM embeddings ORDER BY creado DESC LIMIT ?)",
+                    (self.maximo_disco,),
+                )
+            self._disco.commit()
+            self.lotes_disco += 1
+
+    def estado(self):
+        with self._lock:
+            aciertos = sum(self.aciertos.values())
+            consultas = aciertos + self.fallos
+            return {
+                "entradas": len(self._memoria),
+                "disco": self._disco is not None,
+                "disco_pendientes": len(self._por_escribir),
+                "lotes_disco": self.lotes_disco,
+                "aciertos": dict(self.aciertos),
+                "fallos": self.fallos,
+                "tasa_aciertos": round(aciertos / consultas, 4) if consultas else None,
+            }
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se consulta el registro de cambios (0 = desactivado)
+CAMBIOS_INTERVALO_S = float(os.getenv("CAMBIOS_INTERVALO_S", "2"))
+CAMBIOS_LOTE = int(os.getenv("CAMBIOS_LOTE", "1000"))
+# Con más cambios pendientes que esto sale más barato recargar la galería completa
+CAMBIOS_MAX_DELTA = int(os.getenv("CAMBIOS_MAX_DELTA", "20000"))
+# Secuencias anteriores a la última aplicada que se vuelven a leer: en Postgres un seq
+# menor puede confirmarse después de uno mayor y aparecer tarde
+CAMBIOS_SOLAPE = int(os.getenv("CAMBIOS_SOLAPE", "100"))
+# Recarga completa periódica por si algún cambio no pasó por el registro (0 = nunca)
+CAMBIOS_RESINCRONIZAR_S = float(os.getenv("CAMBIOS_RESINCRONIZAR_S", "3600"))
+
+# Intentos de preparar los cambios fuera del loop si la galería cambia mientras tanto
+CAMBIOS_REINTENTOS = 3
+
+COLUMNAS_GALERIA = "id, nombre, apellidos, kp, requisitoriado"
+CANDADO_LIDER = "sincronizador.lock"
+
+
+class SincronizadorGaleria:
+    # Propaga a la galería residente las altas, modificaciones y bajas de `personas`
+    # hechas desde cualquier worker o instancia. Lee el registro cambios_personas (lo llenan
+    # triggers) desde la última secuencia aplicada, trae solo esas personas y las aplica a
+    # la galería: cada ronda cuesta O(filas cambiadas). Se aplica el estado actual de la fila
+    # y no la operación registrada, así que repetir o desordenar cambios no altera el
+    # resultado. Con galería compartida solo un worker (el que toma el candado) lee el
+    # registro y publica para los demás.
+    def __init__(self, galeria, datos, recargar, intervalo_s=CAMBIOS_INTERVALO_S, lote=CAMBIOS_LOTE,
+                 max_delta=CAMBIOS_MAX_DELTA, solape=CAMBIOS_SOLAPE, resincronizar_s=CAMBIOS_RESINCRONIZAR_S):
+        self.galeria = galeria
+        self.datos = datos
+        self.recargar = recargar  # async () -> None: lectura completa de personas
+        self.intervalo_s = intervalo_s
+        self.lote = lote
+        self.max_delta = max_delta
+        self.solape = solape
+        self.resincronizar_s = resincronizar_s
+        self.seq = None
+        self._vistos = set()  # seqs de la ventana de solape ya aplicados
+        self._ultima_resincronizacion = time.monotonic()
+        self._candado = None
+        self._tarea = None
+        self._detener = None
+        self.rondas = 0
+        self.aplicados = 0
+        self.resincronizaciones = 0
+        self.ultimo_error = None
+
+    async def marcar_inicio(self):
+        # Se llama antes de la carga completa: lo que cambie durante la carga llega como delta
+        try:
+            self.seq = await self.datos.ultimo_cambio()
+        except Exception as e:
+            self.ultimo_error = str(e)
+            logger.warning("⚠️ No se pudo leer cambios_personas, se usará recarga completa: %s", e)
+        self._vistos = set()
+        self._ultima_resincronizacion = time.monotonic()
+
+    def _es_lider(self):
+        if self.galeria.compartida is None:
+            return True
+        if self._candado is None:
+            import fcntl
+
+            candado = open(os.path.join(self.galeria.compartida.directorio, CANDADO_LIDER), "a")
+            try:
+                fcntl.flock(candado, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                candado.close()
+                return False
+            # Se mantiene abierto mientras viva el proceso; si muere, otro worker toma el relevo
+            self._candado = candado
+            logger.info("✅ Este worker sincroniza la galería compartida")
+        return True
+
+    async def resincronizar(self):
+        seq = await self.datos.ultimo_cambio()
+        await self.recargar()
+        self.seq = seq
+        self._vistos = set()
+        self._ultima_resincronizacion = time.monotonic()
+        self.resincronizaciones += 1
+        logger.info("✅ Galería resincronizada por completo (seq %d)", seq)
+
+    async def sincronizar(self):
+        # Una ronda: devuelve cuántas filas de la galería cambiaron
+        if self.seq is None:
+            await self.resincronizar()
+            return 0
+
+        pendientes = {}
+        desde = max(0, self.seq - self.solape)
+        while True:
+            pagina = await self.datos.cambios_desde(desde, self.lote)
+            for cambio in pagina:
+                if cambio["seq"] not in self._vistos:
+                    pendientes[cambio["seq"]] = cambio["persona_id"]
+            if len(pendientes) > self.max_delta:
+                await self.resincronizar()
+                return 0
+            if len(pagina) < self.lote:
+                break
+            desde = pagina[-1]["seq"]
+        if not pendientes:
+            return 0
+
+        ids = set(pendientes.values())
+        filas = await self.datos.personas_por_ids(ids, COLUMNAS_GALERIA)
+        # Lo que ya no está en la tabla se dio de baja
+        eliminados = ids - {str(fila["id"]) for fila in filas}
+        aplicados = await self._aplicar(filas, eliminados)
+
+        self.seq = max(self.seq, max(pendientes))
+        self._vistos = {seq for seq in self._vistos.union(pendientes) if seq > self.seq - self.solape}
+        self.aplicados += aplicados
+        if aplicados:
+            logger.debug("Galería sincronizada: %d cambios registrados, %d filas aplicadas", len(pendientes), aplicados)
+        return aplicados
+
+    async def _aplicar(self, filas, eliminados):
+        if self.galeria.compartida is not None:
+            # La instantánea nueva se publica entera y el loop la toma de una vez
+            return await asyncio.to_thread(self.galeria.aplicar_cambios, filas, eliminados, True)
+        # En memoria: la comparación y la reconstrucción van en un hilo y el cambio se hace
+        # en el loop, así las búsquedas nunca ven la galería a medio modificar
+        for _ in range(CAMBIOS_REINTENTOS):
+            preparado = await asyncio.to_thread(self.galeria.preparar_cambios, filas, eliminados)
+            aplicados = self.galeria.confirmar_cambios(preparado)
+            if aplicados is not None:
+                return aplicados
+        # La galería no dejó de cambiar mientras se preparaba: se aplica en el loop
+        return self.galeria.aplicar_cambios(filas, eliminados, del_registro=True)
+
+    async def _ronda(self):
+        if not self._es_lider():
+            return
+        if self.resincronizar_s and time.monotonic() - self._ultima_resincronizacion >= self.resincronizar_s:
+            await self.resincronizar()
+        else:
+            await self.sincronizar()
+        self.rondas += 1
+
+    async def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                await asyncio.wait_for(self._detener.wait(), self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                break
+            try:
+                await self._ronda()
+                self.ultimo_error = None
+            except Exception as e:
+                # Solo se registra el primer error de una racha (p. ej. si falta la tabla)
+                if self.ultimo_error is None:
+                    logger.exception("❌ Error al sincronizar la galería")
+                self.ultimo_error = str(e)
+
+    def iniciar(self):
+        if self.intervalo_s <= 0:
+            return
+        self._detener = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._detener.set()
+            await self._tarea
+            self._tarea = None
+        if self._candado is not None:
+            self._candado.close()
+            self._candado = None
+
+    def estado(self):
+        return {
+            "activo": self._tarea is not None,
+            "lider": self.galeria.compartida is None or self._candado is not None,
+            "seq": self.seq,
+            "rondas": self.rondas,
+            "filas_aplicadas": self.aplicados,
+            "resincronizaciones": self.resincronizaciones,
+            "ultimo_error": self.ultimo_error,
+        }
@@ -0,0 +1,175 @@
+"""Codificación compacta de los kp (embeddings de 128 dimensiones).
+
+Formatos del valor guardado en la columna `kp` (jsonb, así que también admite texto):
+    lista JSON          formato original, ~2.5 KB por vector
+    "f32:<base64>"      128 float32, 684 caracteres
+    "f16:<base64>"      128 float16, 344 caracteres
+    "i8:<base64>"       escala float32 + 128 int8 (cuantización simétrica por vector), 176 caracteres
+
+Migración de la columna existente:
+    python -m utils.codec_kp --formato f16
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.registro import configurar_registro
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Formato con el que se escriben los kp nuevos: json, f32, f16 o i8
+KP_FORMATO = os.getenv("KP_FORMATO", "json")
+
+DIMENSION_KP = 128
+FORMATOS = ("json", "f32", "f16", "i8")
+
+
+def cuantizar(matriz):
+    # Escala simétrica por fila: fila ≈ escala * codigos, con codigos en [-127, 127]
+    matriz = np.atleast_2d(np.asarray(matriz, dtype=np.float32))
+    escalas = np.abs(matriz).max(axis=1) / 127
+    escalas[escalas == 0] = 1
+    codigos = np.clip(np.rint(matriz / escalas[:, None]), -127, 127).astype(np.int8)
+    return codigos, escalas.astype(np.float32)
+
+
+def codificar_kp(vector, formato=KP_FORMATO):
+    vector = np.asarray(vector, dtype=np.float32)
+    if formato == "json":
+        return vector.tolist()
+    if formato == "f32":
+        crudo = vector.tobytes()
+    elif formato == "f16":
+        crudo = vector.astype(np.float16).tobytes()
+    elif formato == "i8":
+        codigos, escalas = cuantizar(vector)
+        crudo = escalas.tobytes() + codigos.tobytes()
+    else:
+        raise ValueError(f"Formato de kp desconocido: {formato}")
+    return f"{formato}:{base64.b64encode(crudo).decode('ascii')}"
+
+
+def decodificar_kp(kp):
+    # Acepta cualquiera de los formatos; devuelve un vector float32 (128,) o None si no es válido
+    if kp is None:
+        return None
+    try:
+        if isinstance(kp, str):
+            formato, _, cuerpo = kp.partition(":")
+            if formato == "f32":
+                vector = np.frombuffer(base64.b64decode(cuerpo), dtype=np.float32)
+            elif formato == "f16":
+                vector = np.frombuffer(base64.b64decode(cuerpo), dtype=np.float16).astype(np.float32)
+            elif formato == "i8":
+                crudo = base64.b64decode(cuerpo)
+                escala = np.frombuffer(crudo[:4], dtype=np.float32)[0]
+                vector = np.frombuffer(crudo[4:], dtype=np.int8).astype(np.float32) * escala
+            else:
+                vector = np.asarray(json.loads(kp), dtype=np.float32)
+        else:
+            vector = np.asarray(kp, dtype=np.float32)
+    except (ValueError, TypeError):
+        return None
+    if vector.shape != (DIMENSION_KP,):
+        return None
+    return vector
+
+
+def formato_kp(kp):
+    if isinstance(kp, str):
+        formato = kp.partition(":")[0]
+        if formato in FORMATOS:
+            return formato
+    return "json"
+
+
+class MatrizCuantizada:
+    # Galería en int8 + una escala por fila (≈4 veces menos memoria que float32).
+    # La indexación devuelve filas float32 reconstruidas; las escrituras se cuantizan.
+    def __init__(self, codigos, escalas):
+        self.codigos = codigos
+        self.escalas = escalas
+
+    @classmethod
+    def vacia(cls, n, dimension=DIMENSION_KP):
+        return cls(np.zeros((n, dimension), dtype=np.int8), np.ones(n, dtype=np.float32))
+
+    @classmethod
+    def desde(cls, matriz):
+        return cls(*cuantizar(matriz))
+
+    @property
+    def shape(self):
+        return self.codigos.shape
+
+    @property
+    def nbytes(self):
+        return self.codigos.nbytes + self.escalas.nbytes
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, (int, np.integer)):
+            return self.codigos[indice].astype(np.float32) * self.escalas[indice]
+        return self.codigos[indice].astype(np.float32) * self.escalas[indice][:, None]
+
+    def __setitem__(self, indice, filas):
+        codigos, escalas = cuantizar(filas)
+        if isinstance(indice, (int, np.integer)):
+            codigos, escalas = codigos[0], escalas[0]
+        self.codigos[indice] = codigos
+        self.escalas[indice] = escalas
+
+    def normas(self):
+        codigos = self.codigos.astype(np.float32)
+        return np.sqrt(np.einsum("ij,ij->i", codigos, codigos)) * self.escalas
+
+
+async def migrar(formato, tablas, lote=500):
+    # Reescribe en `formato` los kp que estén en otro; idempotente
+    from utils.datos import datos
+
+    await datos.iniciar()
+    try:
+        for tabla in tablas:
+            cambios, total = {}, 0
+            async for fila in datos.recorrer(tabla, "id, kp"):
+                if fila.get("kp") is None or formato_kp(fila["kp"]) == formato:
+                    continue
+                vector = decodificar_kp(fila["kp"])
+                if vector is None:
+                    continue
+                cambios[fila["id"]] = {"kp": codificar_kp(vector, formato)}
+                if len(cambios) >= lote:
+                    await datos.actualizar_lote(tabla, cambios)
+                    total += len(cambios)
+                    cambios = {}
+            if cambios:
+                await datos.actualizar_lote(tabla, cambios)
+                total += len(cambios)
+            logger.info("✅ %s: %d kp migrados a %s", tabla, total, formato)
+    finally:
+        await datos.cerrar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formato", choices=FORMATOS, default=KP_FORMATO)
+    parser.add_argument("--tablas", default="personas", help="Separadas por coma, p. ej. personas,entrenamientos")
+    args = parser.parse_args()
+    configurar_registro()
+    asyncio.run(migrar(args.formato, args.tablas.split(",")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+import httpx
+from dotenv import load_dotenv
+
+from utils.metricas import DATOS, cronometro
+
+
+load_dotenv()
+
+# "supabase" (por defecto) o "local" (SQLite + carpeta de fotos, sin servicios externos)
+ALMACENAMIENTO = os.getenv("ALMACENAMIENTO", "supabase")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+BUCKET_NAME = os.getenv("BUCKET_NAME", "rostros")
+# Cache-Control (segundos) de las fotos subidas: cada nombre es único, no se invalidan
+FOTOS_CACHE_S = os.getenv("FOTOS_CACHE_S", "31536000")
+
+# Consultas simultáneas como máximo contra Supabase (el resto espera su turno)
+DATOS_CONCURRENCIA = int(os.getenv("DATOS_CONCURRENCIA", "20"))
+DATOS_CONEXIONES = int(os.getenv("DATOS_CONEXIONES", "20"))
+DATOS_CONEXIONES_INACTIVAS = int(os.getenv("DATOS_CONEXIONES_INACTIVAS", "10"))
+DATOS_TIMEOUT_S = float(os.getenv("DATOS_TIMEOUT_S", "15"))
+DATOS_TIMEOUT_CONEXION_S = float(os.getenv("DATOS_TIMEOUT_CONEXION_S", "5"))
+# Filas por página al recorrer tablas completas (PostgREST limita cada respuesta)
+DATOS_PAGINA = int(os.getenv("DATOS_PAGINA", "1000"))
+DATOS_LOTE_INSERT = int(os.getenv("DATOS_LOTE_INSERT", "500"))
+# Ids por consulta en los filtros "id in (...)" (la URL de PostgREST tiene un largo máximo)
+DATOS_LOTE_IDS = int(os.getenv("DATOS_LOTE_IDS", "200"))
+
+
+class AlmacenDatos(ABC):
+    # Interfaz común de persistencia: personas, reconocimientos, entrenamientos, alertas y fotos.
+    # Las filas se devuelven con la misma forma que PostgREST (relaciones anidadas como dict).
+
+    async def iniciar(self):
+        pass
+
+    async def cerrar(self):
+        pass
+
+    # Lecturas
+
+    @abstractmethod
+    async def recorrer(self, tabla, columnas, orden="id"):
+        # Generador asíncrono (async for) de todas las filas de `tabla`
+        ...
+
+    async def listar_todo(self, tabla, columnas, orden="id"):
+        return [fila async for fila in self.recorrer(tabla, columnas, orden)]
+
+    @abstractmethod
+    async def contar(self, tabla):
+        ...
+
+    @abstractmethod
+    async def top_personas_reconocidas(self):
+        # Resultado de la función top_personas_reconocidas (agregada en la base)
+        ...
+
+    @abstractmethod
+    async def contar_requisitoriados_reconocidos(self):
+        # Personas requisitoriadas con al menos un reconocimiento
+        ...
+
+    @abstractmethod
+    async def persona(self, persona_id, columnas="*"):
+        ...
+
+    @abstractmethod
+    async def listar_personas(self, columnas="*"):
+        ...
+
+    @abstractmethod
+    async def recientes(self, tabla, columnas, limite):
+        ...
+
+    @abstractmethod
+    async def reconocimientos_desde(self, fecha, columnas="persona_id, fecha, hora"):
+        ...
+
+    @abstractmethod
+    async def pagina_reciente(self, tabla, columnas, cursor, limite, fecha=None):
+        ...
+
+    @abstractmethod
+    async def personas_por_ids(self, ids, columnas="*"):
+        ...
+
+    @abstractmethod
+    async def reconocimientos_posteriores(self, id_desde, limite,
+                                          columnas="id, persona_id, fecha, hora, latitud, longitud"):
+        # Reconocimientos con id > `id_desde`, en orden ascendente (para el índice del mapa)
+        ...
+
+    # Registro de cambios de personas (tabla cambios_personas, llenada por triggers)
+
+    @abstractmethod
+    async def cambios_desde(self, seq, limite):
+        # [{seq, persona_id, operacion}] con seq > `seq`, en orden ascendente
+        ...
+
+    @abstractmethod
+    async def ultimo_cambio(self):
+        ...
+
+    # Escrituras
+
+    @abstractmethod
+    async def insertar_persona(self, fila):
+        ...
+
+    @abstractmethod
+    async def actualizar_persona(self, persona_id, campos):
+        ...
+
+    @abstractmethod
+    async def eliminar_persona(self, persona_id):
+        ...
+
+    @abstractmethod
+    async def insertar_lote(self, tabla, filas):
+        ...
+
+    @abstractmethod
+    async def actualizar_lote(self, tabla, cambios):
+        ...
+
+    # Almacenamiento
+
+    @abstractmethod
+    async def subir_foto(self, nombre_archivo, contenido, content_type):
+        ...
+
+    @abstractmethod
+    def url_publica(self, nombre_archivo):
+        # URL que tendrá la foto una vez subida (se conoce antes de subirla)
+        ...
+
+    def estado(self):
+        return {}
+
+
+class DatosSupabase(AlmacenDatos):
+    # Cliente asíncrono de Supabase sobre un pool httpx compartido con keep-alive
+    # y un semáforo de concurrencia.
+    def __init__(self, url=SUPABASE_URL, clave=SUPABASE_KEY, bucket=BUCKET_NAME,
+                 concurrencia=DATOS_CONCURRENCIA, conexiones=DATOS_CONEXIONES,
+                 conexiones_inactivas=DATOS_CONEXIONES_INACTIVAS, timeout_s=DATOS_TIMEOUT_S,
+                 timeout_conexion_s=DATOS_TIMEOUT_CONEXION_S, pagina=DATOS_PAGINA,
+                 lote_insert=DATOS_LOTE_INSERT):
+        self.url = url
+        self.clave = clave
+        self.bucket = bucket
+        self.conexiones = conexiones
+        self.conexiones_inactivas = conexiones_inactivas
+        self.timeout_s = timeout_s
+        self.timeout_conexion_s = timeout_conexion_s
+        self.pagina = pagina
+        self.lote_insert = lote_insert
+        self._semaforo = asyncio.Semaphore(concurrencia)
+        self._http = None
+        self._cliente = None
+        self.consultas = 0
+        self.errores = 0
+
+    async def iniciar(self):
+        from supabase import AsyncClientOptions, acreate_client
+
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.conexiones,
+                max_keepalive_connections=self.conexiones_inactivas,
+            ),
+            timeout=httpx.Timeout(self.timeout_s, connect=self.timeout_conexion_s),
+        )
+        self._cliente = await acreate_client(self.url, self.clave, AsyncClientOptions(httpx_client=self._http))
+
+    async def cerrar(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._cliente = None
+
+    def tabla(self, nombre):
+        return self._cliente.table(nombre)
+
+    async def ejecutar(self, consulta, operacion, tabla):
+        async with self._semaforo:
+            self.consultas += 1
+            try:
+                with cronometro(DATOS, operacion, tabla):
+                    return await consulta.execute()
+            except Exception:
+                self.errores += 1
+                raise
+
+    # Lecturas
+
+    async def recorrer(self, tabla, columnas, orden="id"):
+        # Generador asíncrono de todas las filas, paginando por rango
+        inicio = 0
+        while True:
+            respuesta = await self.ejecutar(
+                self.tabla(tabla).select(columnas).order(orden).range(inicio, inicio + self.pagina - 1), "recorrer", tabla
+            )
+            for fila in respuesta.data:
+                yield fila
+            if len(respuesta.data) < self.pagina:
+                return
+            inicio += self.pagina
+
+    async def contar(self, tabla):
+        # count="exact" devuelve el total en la cabecera sin transferir la tabla
+        respuesta = await self.ejecutar(self.tabla(tabla).select("id", count="exact").limit(1), "contar", tabla)
+        return respuesta.count or 0
+
+    async def top_personas_reconocidas(self):
+        respuesta = await self.ejecutar(self._cliente.rpc("top_personas_reconocidas"),
+                                         "top_personas_reconocidas", "reconocimientos")
+        return respuesta.data
+
+    async def contar_requisitoriados_reconocidos(self):
+        # El join !inner deja solo personas con reconocimientos; count="exact" cuenta personas, no filas
+        respuesta = await self.ejecutar(
+            self.tabla("personas").select("id, reconocimientos!inner(id)", count="exact")
+            .eq("requisitoriado", True).limit(1),
+            "contar_requisitoriados_reconocidos", "personas",
+        )
+        return respuesta.count or 0
+
+    async def persona(self, persona_id, columnas="*"):
+        respuesta = await self.ejecutar(self.tabla("personas").select(columnas).eq("id", persona_id).limit(1),
+                                         "persona", "personas")
+        return respuesta.data[0] if respuesta.data else None
+
+    async def listar_personas(self, columnas="*"):
+        respuesta = await self.ejecutar(self.tabla("personas").select(columnas).order("nombre", desc=True),
+                                         "listar_personas", "personas")
+        return respuesta.data
+
+    async def recientes(self, tabla, columnas, limite):
+        respuesta = await self.ejecutar(
+            self.tabla(tabla).select(columnas).order("fecha", desc=True).order("hora", desc=True).limit(limite),
+            "recientes", tabla,
+        )
+        return respuesta.data
+
+    async def reconocimientos_desde(self, fecha, columnas="persona_id, fecha, hora"):
+        # PostgREST corta cada respuesta en max-rows: keyset sobre id, de a una página
+        if "id" not in [columna.strip() for columna in columnas.split(",")]:
+            columnas = f"id, {columnas}"
+        filas, ultimo = [], None
+        while True:
+            consulta = self.tabla("reconocimientos").select(columnas).gte("fecha", fecha)
+            if ultimo is not None:
+                consulta = consulta.gt("id", ultimo)
+            respuesta = await self.ejecutar(consulta.order("id").limit(self.pagina),
+                                             "reconocimientos_desde", "reconocimientos")
+            filas += respuesta.data
+            if len(respuesta.data) < self.pagina:
+                return filas
+            ultimo = respuesta.data[-1]["id"]
+
+    async def pagina_reciente(self, tabla, columnas, cursor, limite, fecha=None):
+        consulta = self.tabla(tabla).select(columnas)
+        if fecha:
+            consulta = consulta.eq("fecha", fecha)
+        if cursor:
+            # Keyset: filas estrictamente anteriores a (fecha, hora, id) de la última fila leída
+            f, h, i = cursor
+            consulta = consulta.or_(f"fecha.lt.{f},and(fecha.eq.{f},hora.lt.{h}),and(fecha.eq.{f},hora.eq.{h},id.lt.{i})")
+        consulta = consulta.order("fecha", desc=True).order("hora", desc=True).order("id", desc=True).limit(limite)
+        return (await self.ejecutar(consulta, "pagina_reciente", tabla)).data
+
+    async def personas_por_ids(self, ids, columnas="*"):
+        ids = list(ids)
+        respuestas = await asyncio.gather(*(
+            self.ejecutar(self.tabla("personas").select(columnas).in_("id", ids[inicio:inicio + DATOS_LOTE_IDS]),
+                          "personas_por_ids", "personas")
+            for inicio in range(0, len(ids), DATOS_LOTE_IDS)
+        ))
+        return [fila for respuesta in respuestas for fila in respuesta.data]
+
+    async def reconocimientos_posteriores(self, id_desde, limite,
+                                          columnas="id, persona_id, fecha, hora, latitud, longitud"):
+        respuesta = await self.ejecutar(
+            self.tabla("reconocimientos").select(columnas).gt("id", id_desde).order("id").limit(limite),
+            "reconocimientos_posteriores", "reconocimientos",
+        )
+        return respuesta.data
+
+    async def cambios_desde(self, seq, limite):
+        respuesta = await self.ejecutar(
+            self.tabla("cambios_personas").select("seq, persona_id, operacion").gt("seq", seq).order("seq").limit(limite),
+            "cambios_desde", "cambios_personas",
+        )
+        return respuesta.data
+
+    async def ultimo_cambio(self):
+        respuesta = await self.ejecutar(
+            self.tabla("cambios_personas").select("seq").order("seq", desc=True).limit(1),
+            "ultimo_cambio", "cambios_personas",
+        )
+        return respuesta.data[0]["seq"] if respuesta.data else 0
+
+    # Escrituras
+
+    async def insertar_persona(self, fila):
+        respuesta = await self.ejecutar(self.tabla("personas").insert(fila), "insertar_persona", "personas")
+        return respuesta.data[0]
+
+    async def actualizar_persona(self, persona_id, campos):
+        respuesta = await self.ejecutar(self.tabla("personas").update(campos).eq("id", persona_id),
+                                         "actualizar_persona", "personas")
+        return respuesta.data
+
+    async def eliminar_persona(self, persona_id):
+        await self.ejecutar(self.tabla("personas").delete().eq("id", persona_id), "eliminar_persona", "personas")
+
+    async def insertar_lote(self, tabla, filas):
+        # Un POST por bloque de filas en lugar de uno por fila
+        for inicio in range(0, len(filas), self.lote_insert):
+            await self.ejecutar(self.tabla(tabla).insert(filas[inicio:inicio + self.lote_insert]), "insertar_lote", tabla)
+
+    async def actualizar_lote(self, tabla, cambios):
+        # cambios: {id: campos}. PostgREST no admite UPDATE con valores distintos por fila,
+        # así que se lanzan en paralelo (acotados por el semáforo) sobre el mismo pool.
+        await asyncio.gather(*(
+            self.ejecutar(self.tabla(tabla).update(campos).eq("id", fila_id), "actualizar_lote", tabla)
+            for fila_id, campos in cambios.items()
+        ))
+
+    # Almacenamiento
+
+    async def subir_foto(self, nombre_archivo, contenido, content_type):
+        bucket = self._cliente.storage.from_(self.bucket)
+        async with self._semaforo:
+            with cronometro(DATOS, "subir_foto", self.bucket):
+                # Los nombres son únicos y nunca se reescriben: caché larga en la CDN y upsert
+                # para que un reintento tras un timeout no falle con "already exists"
+                await bucket.upload(nombre_archivo, contenido, {
+                    "content-type": content_type,
+                    "cache-control": FOTOS_CACHE_S,
+                    "upsert": "true",
+                })
+        return self.url_publica(nombre_archivo)
+
+    def url_publica(self, nombre_archivo):
+        return f"{self.url.rstrip('/')}/storage/v1/object/public/{self.bucket}/{quote(nombre_archivo)}"
+
+    def estado(self):
+        return {"backend": "supabase", "consultas": self.consultas, "errores": self.errores}
+
+
+def crear_datos(tipo=ALMACENAMIENTO):
+    if tipo == "local":
+        from utils.datos_local import DatosLocales
+        return DatosLocales()
+    if tipo != "supabase":
+        raise ValueError(f"ALMACENAMIENTO desconocido: {tipo}")
+    return DatosSupabase()
+
+
+datos = crear_datos()
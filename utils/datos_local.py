@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from utils.datos import AlmacenDatos, DATOS_PAGINA
+from utils.metricas import DATOS, cronometro
+
+
+load_dotenv()
+
+ALMACENAMIENTO_SQLITE = os.getenv("ALMACENAMIENTO_SQLITE", "facecontrol.db")
+ALMACENAMIENTO_FOTOS = os.getenv("ALMACENAMIENTO_FOTOS", "fotos")
+# Prefijo de las URLs públicas de las fotos (main.py sirve la carpeta en /fotos)
+ALMACENAMIENTO_URL_FOTOS = os.getenv("ALMACENAMIENTO_URL_FOTOS", "/fotos")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS personas (
+    id TEXT PRIMARY KEY,
+    nombre TEXT,
+    apellidos TEXT,
+    correo TEXT,
+    kp TEXT,
+    foto TEXT,
+    requisitoriado INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS reconocimientos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    persona_id TEXT REFERENCES personas(id) ON DELETE CASCADE,
+    fecha TEXT,
+    hora TEXT,
+    latitud REAL,
+    longitud REAL
+);
+CREATE INDEX IF NOT EXISTS reconocimientos_persona_fecha_hora ON reconocimientos (persona_id, fecha, hora);
+CREATE INDEX IF NOT EXISTS reconocimientos_fecha_hora ON reconocimientos (fecha, hora, id);
+CREATE TABLE IF NOT EXISTS entrenamientos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    persona_id TEXT REFERENCES personas(id) ON DELETE CASCADE,
+    kp TEXT,
+    fecha TEXT,
+    hora TEXT
+);
+CREATE INDEX IF NOT EXISTS entrenamientos_persona_fecha_hora ON entrenamientos (persona_id, fecha, hora);
+CREATE TABLE IF NOT EXISTS alertas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    persona_id TEXT REFERENCES personas(id) ON DELETE CASCADE,
+    nombre TEXT,
+    apellidos TEXT,
+    score REAL,
+    fecha TEXT,
+    hora TEXT,
+    metodo_envio TEXT
+);
+CREATE INDEX IF NOT EXISTS alertas_persona_fecha_hora ON alertas (persona_id, fecha, hora);
+CREATE INDEX IF NOT EXISTS alertas_fecha_hora ON alertas (fecha, hora, id);
+CREATE TABLE IF NOT EXISTS cambios_personas (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    persona_id TEXT NOT NULL,
+    operacion TEXT NOT NULL,
+    fecha TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TRIGGER IF NOT EXISTS personas_cambios_insert AFTER INSERT ON personas BEGIN
+    INSERT INTO cambios_personas (persona_id, operacion) VALUES (NEW.id, 'upsert');
+END;
+CREATE TRIGGER IF NOT EXISTS personas_cambios_update AFTER UPDATE ON personas BEGIN
+    INSERT INTO cambios_personas (persona_id, operacion) VALUES (NEW.id, 'upsert');
+END;
+CREATE TRIGGER IF NOT EXISTS personas_cambios_delete AFTER DELETE ON personas BEGIN
+    INSERT INTO cambios_personas (persona_id, operacion) VALUES (OLD.id, 'delete');
+END;
+"""
+
+TABLA_SQL = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)")
+
+# Columnas que PostgREST devuelve como JSON o booleano
+COLUMNAS_JSON = {"kp"}
+COLUMNAS_BOOL = {"requisitoriado"}
+
+
+def parsear_columnas(columnas):
+    # "a, b, personas(c, d)" -> (["a", "b"], {"personas": ["c", "d"]})
+    simples, anidadas = [], {}
+    nivel, actual = 0, ""
+    for caracter in columnas + ",":
+        if caracter == "," and nivel == 0:
+            actual = actual.strip()
+            if "(" in actual:
+                relacion, internas = actual.split("(", 1)
+                anidadas[relacion.strip()] = [c.strip() for c in internas.rstrip(")").split(",") if c.strip()]
+            elif actual:
+                simples.append(actual)
+            actual = ""
+            continue
+        nivel += caracter == "("
+        nivel -= caracter == ")"
+        actual += caracter
+    return simples, anidadas
+
+
+def _valor_sql(columna, valor):
+    # También los kp codificados como texto ("f16:..."), igual que un string en jsonb
+    if columna in COLUMNAS_JSON and valor is not None:
+        return json.dumps(valor)
+    if columna in COLUMNAS_BOOL and valor is not None:
+        return int(bool(valor))
+    return valor
+
+
+def _valor_api(columna, valor):
+    if columna in COLUMNAS_JSON and isinstance(valor, str):
+        return json.loads(valor)
+    if columna in COLUMNAS_BOOL and valor is not None:
+        return bool(valor)
+    return valor
+
+
+class DatosLocales(AlmacenDatos):
+    # SQLite (WAL) + carpeta de fotos; las consultas corren en un hilo propio para no bloquear
+    # el event loop (no en el pool por defecto: los PDF que se dibujan ahí esperan páginas de esta base)
+    def __init__(self, ruta=ALMACENAMIENTO_SQLITE, directorio_fotos=ALMACENAMIENTO_FOTOS,
+                 url_fotos=ALMACENAMIENTO_URL_FOTOS):
+        self.ruta = ruta
+        self.directorio_fotos = directorio_fotos
+        self.url_fotos = url_fotos.rstrip("/")
+        self._conexion = None
+        self._ejecutor = None
+        self._lock = threading.Lock()
+        self.consultas = 0
+        os.makedirs(self.directorio_fotos, exist_ok=True)
+
+    async def iniciar(self):
+        def abrir():
+            conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            conexion.row_factory = sqlite3.Row
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            conexion.execute("PRAGMA foreign_keys=ON")
+            conexion.executescript(ESQUEMA)
+            return conexion
+
+        # Las consultas se serializan con el lock de todas formas: basta un hilo
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conexion = await asyncio.get_running_loop().run_in_executor(self._ejecutor, abrir)
+
+    async def cerrar(self):
+        if self._conexion is not None:
+            await asyncio.get_running_loop().run_in_executor(self._ejecutor, self._conexion.close)
+            self._conexion = None
+            self._ejecutor.shutdown()
+            self._ejecutor = None
+
+    def _ejecutar(self, sql, parametros=(), muchos=False):
+        tabla = TABLA_SQL.search(sql)
+        with self._lock, cronometro(DATOS, sql.split(None, 1)[0].lower(), tabla.group(1) if tabla else ""):
+            self.consultas += 1
+            if muchos:
+                cursor = self._conexion.executemany(sql, parametros)
+            else:
+                cursor = self._conexion.execute(sql, parametros)
+            filas = cursor.fetchall()
+            self._conexion.commit()
+            return filas
+
+    async def _sql(self, sql, parametros=(), muchos=False):
+        return await asyncio.get_running_loop().run_in_executor(self._ejecutor, self._ejecutar, sql, parametros, muchos)
+
+    @staticmethod
+    def _select(tabla, columnas):
+        # Traduce el select de PostgREST (con relaciones embebidas) a un SELECT con LEFT JOIN
+        simples, anidadas = parsear_columnas(columnas)
+        if not simples or "*" in simples:
+            partes = ["t.*"]
+        else:
+            partes = [f't.{c} AS "{c}"' for c in simples]
+        joins = []
+        for relacion, internas in anidadas.items():
+            if relacion != "personas":
+                raise ValueError(f"Relación no soportada en el backend local: {relacion}")
+            joins.append("LEFT JOIN personas AS p ON p.id = t.persona_id")
+            partes += [f'p.{c} AS "personas.{c}"' for c in internas]
+        return f"SELECT {', '.join(partes)} FROM {tabla} AS t {' '.join(joins)}"
+
+    @staticmethod
+    def _fila_api(fila):
+        resultado = {}
+        for clave in fila.keys():
+            if "." in clave:
+                relacion, columna = clave.split(".", 1)
+                resultado.setdefault(relacion, {})[columna] = _valor_api(columna, fila[clave])
+            else:
+                resultado[clave] = _valor_api(clave, fila[clave])
+        return resultado
+
+    async def _consultar(self, tabla, columnas, donde="", parametros=(), orden="", limite=None):
+        sql = self._select(tabla, columnas)
+        if donde:
+            sql += f" WHERE {donde}"
+        if orden:
+            sql += f" ORDER BY {orden}"
+        if limite is not None:
+            sql += f" LIMIT {int(limite)}"
+        return [self._fila_api(fila) for fila in await self._sql(sql, parametros)]
+
+    # Lecturas
+
+    async def recorrer(self, tabla, columnas, orden="id"):
+        # Keyset sobre la columna de orden: no se degrada con el tamaño de la tabla
+        ultimo = None
+        while True:
+            if ultimo is None:
+                filas = await self._consultar(tabla, f"{orden}, {columnas}", orden=f"t.{orden}", limite=DATOS_PAGINA)
+            else:
+                filas = await self._consultar(tabla, f"{orden}, {columnas}", f"t.{orden} > ?", (ultimo,),
+                                              orden=f"t.{orden}", limite=DATOS_PAGINA)
+            for fila in filas:
+                yield fila
+            if len(filas) < DATOS_PAGINA:
+                return
+            ultimo = filas[-1][orden]
+
+    async def contar(self, tabla):
+        return (await self._sql(f"SELECT COUNT(*) FROM {tabla}"))[0][0]
+
+    async def top_personas_reconocidas(self):
+        # Misma agregación que la función top_personas_reconocidas, resuelta con el índice de persona_id
+        filas = await self._sql(
+            "SELECT r.persona_id, p.nombre, p.apellidos, COUNT(*) AS total FROM reconocimientos r "
+            "LEFT JOIN personas p ON p.id = r.persona_id GROUP BY r.persona_id ORDER BY total DESC LIMIT 3"
+        )
+        return [dict(fila) for fila in filas]
+
+    async def contar_requisitoriados_reconocidos(self):
+        filas = await self._sql(
+            "SELECT COUNT(DISTINCT r.persona_id) FROM reconocimientos r "
+            "JOIN personas p ON p.id = r.persona_id WHERE p.requisitoriado"
+        )
+        return filas[0][0]
+
+    async def persona(self, persona_id, columnas="*"):
+        filas = await self._consultar("personas", columnas, "t.id = ?", (persona_id,), limite=1)
+        return filas[0] if filas else None
+
+    async def listar_personas(self, columnas="*"):
+        return await self._consultar("personas", columnas, orden="t.nombre DESC")
+
+    async def recientes(self, tabla, columnas, limite):
+        return await self._consultar(tabla, columnas, orden="t.fecha DESC, t.hora DESC", limite=limite)
+
+    async def reconocimientos_desde(self, fecha, columnas="persona_id, fecha, hora"):
+        return await self._consultar("reconocimientos", columnas, "t.fecha >= ?", (fecha,))
+
+    async def pagina_reciente(self, tabla, columnas, cursor, limite, fecha=None):
+        condiciones, parametros = [], []
+        if fecha:
+            condiciones.append("t.fecha = ?")
+            parametros.append(fecha)
+        if cursor:
+            condiciones.append("(t.fecha, t.hora, t.id) < (?, ?, ?)")
+            parametros += list(cursor)
+        return await self._consultar(tabla, columnas, " AND ".join(condiciones), parametros,
+                                     orden="t.fecha DESC, t.hora DESC, t.id DESC", limite=limite)
+
+    async def personas_por_ids(self, ids, columnas="*"):
+        ids = list(ids)
+        filas = []
+        # SQLite admite un número limitado de parámetros por consulta
+        for inicio in range(0, len(ids), 500):
+            bloque = ids[inicio:inicio + 500]
+            filas += await self._consultar("personas", columnas, f"t.id IN ({', '.join('?' for _ in bloque)})", bloque)
+        return filas
+
+    async def reconocimientos_posteriores(self, id_desde, limite,
+                                          columnas="id, persona_id, fecha, hora, latitud, longitud"):
+        return await self._consultar("reconocimientos", columnas, "t.id > ?", (id_desde,), orden="t.id", limite=limite)
+
+    async def cambios_desde(self, seq, limite):
+        return await self._consultar("cambios_personas", "seq, persona_id, operacion", "t.seq > ?", (seq,),
+                                     orden="t.seq", limite=limite)
+
+    async def ultimo_cambio(self):
+        return (await self._sql("SELECT COALESCE(MAX(seq), 0) FROM cambios_personas"))[0][0]
+
+    # Escrituras
+
+    async def insertar_persona(self, fila):
+        fila = {"id": str(uuid4()), **fila}
+        columnas = list(fila)
+        await self._sql(
+            f"INSERT INTO personas ({', '.join(columnas)}) VALUES ({', '.join('?' for _ in columnas)})",
+            [_valor_sql(c, fila[c]) for c in columnas],
+        )
+        return await self.persona(fila["id"])
+
+    async def actualizar_persona(self, persona_id, campos):
+        asignaciones = ", ".join(f"{c} = ?" for c in campos)
+        await self._sql(
+            f"UPDATE personas SET {asignaciones} WHERE id = ?",
+            [_valor_sql(c, v) for c, v in campos.items()] + [persona_id],
+        )
+        persona = await self.persona(persona_id)
+        return [persona] if persona else []
+
+    async def eliminar_persona(self, persona_id):
+        await self._sql("DELETE FROM personas WHERE id = ?", (persona_id,))
+
+    async def insertar_lote(self, tabla, filas):
+        # Agrupadas por conjunto de columnas para usar un único executemany por grupo
+        grupos = {}
+        for fila in filas:
+            grupos.setdefault(tuple(fila), []).append(fila)
+        for columnas, grupo in grupos.items():
+            await self._sql(
+                f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join('?' for _ in columnas)})",
+                [[_valor_sql(c, fila[c]) for c in columnas] for fila in grupo],
+                muchos=True,
+            )
+
+    async def actualizar_lote(self, tabla, cambios):
+        grupos = {}
+        for fila_id, campos in cambios.items():
+            grupos.setdefault(tuple(campos), []).append([_valor_sql(c, v) for c, v in campos.items()] + [fila_id])
+        for columnas, parametros in grupos.items():
+            asignaciones = ", ".join(f"{c} = ?" for c in columnas)
+            await self._sql(f"UPDATE {tabla} SET {asignaciones} WHERE id = ?", parametros, muchos=True)
+
+    # Almacenamiento
+
+    async def subir_foto(self, nombre_archivo, contenido, content_type):
+        nombre_archivo = os.path.basename(nombre_archivo)
+
+        def escribir():
+            with open(os.path.join(self.directorio_fotos, nombre_archivo), "wb") as f:
+                f.write(contenido)
+
+        with cronometro(DATOS, "subir_foto", "fotos"):
+            await asyncio.to_thread(escribir)
+        return self.url_publica(nombre_archivo)
+
+    def url_publica(self, nombre_archivo):
+        return f"{self.url_fotos}/{os.path.basename(nombre_archivo)}"
+
+    def estado(self):
+        return {"backend": "local", "ruta": self.ruta, "consultas": self.consultas}
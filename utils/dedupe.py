@@ -0,0 +1,76 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Una persona no se vuelve a registrar en `reconocimientos` dentro de esta ventana
+DEDUPE_TTL_S = int(os.getenv("DEDUPE_TTL_S", "3600"))
+DEDUPE_MAX = int(os.getenv("DEDUPE_MAX", "100000"))
+
+
+class CacheReconocidos:
+    # persona_id -> último reconocimiento registrado, en orden cronológico
+    def __init__(self, ttl_s=DEDUPE_TTL_S, maximo=DEDUPE_MAX):
+        self.ttl = timedelta(seconds=ttl_s)
+        self.maximo = maximo
+        self._ultimos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _purgar(self, ahora):
+        limite = ahora - self.ttl
+        while self._ultimos:
+            persona_id, visto = next(iter(self._ultimos.items()))
+            if visto > limite and len(self._ultimos) <= self.maximo:
+                break
+            self._ultimos.popitem(last=False)
+
+    def marcar_si_nuevo(self, persona_id, ahora=None):
+        # True si la persona no fue reconocida dentro del TTL; en ese caso queda marcada
+        ahora = ahora or datetime.now()
+        with self._lock:
+            visto = self._ultimos.get(persona_id)
+            if visto is not None and visto > ahora - self.ttl:
+                self.aciertos += 1
+                return False
+            self.fallos += 1
+            self._ultimos[persona_id] = ahora
+            self._ultimos.move_to_end(persona_id)
+            # Después de marcar, para no pasar nunca de `maximo` entradas
+            self._purgar(ahora)
+            return True
+
+    def calentar(self, filas, ahora=None):
+        # filas de `reconocimientos` con persona_id, fecha y hora
+        ahora = ahora or datetime.now()
+        vistos = {}
+        for fila in filas:
+            visto = datetime.fromisoformat(f'{fila["fecha"]}T{fila["hora"]}')
+            if visto > ahora - self.ttl and visto > vistos.get(fila["persona_id"], datetime.min):
+                vistos[fila["persona_id"]] = visto
+        with self._lock:
+            for persona_id, visto in sorted(vistos.items(), key=lambda par: par[1]):
+                if self._ultimos.get(persona_id, datetime.min) >= visto:
+                    continue
+                self._ultimos[persona_id] = visto
+                self._ultimos.move_to_end(persona_id)
+            self._purgar(ahora)
+
+    def estado(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._ultimos),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            }
+
+
+cache_reconocidos = CacheReconocidos()
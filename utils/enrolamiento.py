@@ -0,0 +1,209 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import posixpath
+import time
+import zipfile
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+from utils.codec_kp import codificar_kp
+from utils.rostros import ColaSaturada
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Fotos en extracción a la vez (0 = 2 por proceso del pool, deja lugar a /reconocer en la cola)
+ENROLAMIENTO_CONCURRENCIA = int(os.getenv("ENROLAMIENTO_CONCURRENCIA", "0"))
+ENROLAMIENTO_LOTE = int(os.getenv("ENROLAMIENTO_LOTE", "100"))
+ENROLAMIENTO_MAX_FILAS = int(os.getenv("ENROLAMIENTO_MAX_FILAS", "10000"))
+ENROLAMIENTO_REINTENTOS = 50  # con la cola del pool llena se espera y se reintenta
+
+MANIFIESTO = "manifiesto.csv"
+COLUMNAS_MANIFIESTO = ("archivo", "nombre", "apellidos", "correo", "requisitoriado")
+VERDADEROS = {"1", "true", "si", "sí", "x", "s", "yes"}
+
+
+def leer_manifiesto(texto):
+    # CSV con cabecera: archivo,nombre,apellidos,correo,requisitoriado (los dos últimos opcionales)
+    lector = csv.DictReader(io.StringIO(texto.lstrip("\ufeff")))
+    columnas = {(c or "").strip().lower() for c in lector.fieldnames or []}
+    faltantes = {"archivo", "nombre", "apellidos"} - columnas
+    if faltantes:
+        raise ValueError(f"⚠️ Faltan columnas en el manifiesto: {', '.join(sorted(faltantes))}")
+
+    filas = []
+    for fila in lector:
+        fila = {(c or "").strip().lower(): (v or "").strip() for c, v in fila.items() if c}
+        filas.append({c: fila.get(c, "") for c in COLUMNAS_MANIFIESTO})
+        if len(filas) > ENROLAMIENTO_MAX_FILAS:
+            raise ValueError(f"⚠️ El manifiesto supera el máximo de {ENROLAMIENTO_MAX_FILAS} filas.")
+    return filas
+
+
+class EnroladorMasivo:
+    # Alta de muchas personas a partir de un ZIP de fotos + manifiesto CSV. Las fotos se
+    # leen del ZIP a medida que se procesan, los embeddings se extraen en paralelo en el
+    # pool de procesos, las fotos se encolan en el subidor (se comprimen y suben en segundo
+    # plano) y las filas de personas se insertan por lotes. procesar() es un generador de
+    # eventos (uno por fila, más progreso y resumen) para devolverlos en streaming mientras avanza.
+    def __init__(self, extraer, reservar_foto, encolar_foto, insertar_lote, al_insertar, procesos=1,
+                 concurrencia=ENROLAMIENTO_CONCURRENCIA, lote=ENROLAMIENTO_LOTE):
+        self.extraer = extraer  # async (bytes) -> embedding
+        self.reservar_foto = reservar_foto  # () -> (nombre, url definitiva) de una foto nueva
+        self.encolar_foto = encolar_foto  # async (bytes, nombre): comprime y sube en segundo plano
+        self.insertar_lote = insertar_lote  # async (tabla, filas)
+        self.al_insertar = al_insertar  # async (filas) tras cada lote insertado: galería y estadísticas
+        self.concurrencia = concurrencia or 2 * procesos
+        self.lote = lote
+        self.lotes = 0
+        self.registradas = 0
+        self.errores = 0
+
+    async def _extraer(self, contenido):
+        for intento in range(ENROLAMIENTO_REINTENTOS):
+            try:
+                return await self.extraer(contenido)
+            except ColaSaturada:
+                if intento == ENROLAMIENTO_REINTENTOS - 1:
+                    raise
+                await asyncio.sleep(0.05 * (intento + 1))
+
+    @staticmethod
+    def abrir(archivo_zip, manifiesto=None):
+        # Valida el ZIP y el manifiesto antes de empezar (ValueError si no sirven).
+        # archivo_zip: ruta u objeto archivo; las fotos se leen del ZIP a medida que se procesan.
+        try:
+            contenedor = zipfile.ZipFile(archivo_zip)
+        except zipfile.BadZipFile:
+            raise ValueError("⚠️ El archivo enviado no es un ZIP válido.")
+        nombres = {posixpath.normpath(n): n for n in contenedor.namelist() if not n.endswith("/")}
+        try:
+            if manifiesto is None:
+                candidatos = [n for n in nombres if posixpath.basename(n).lower() == MANIFIESTO]
+                if not candidatos:
+                    raise ValueError(f"⚠️ No se envió manifiesto y el ZIP no contiene {MANIFIESTO}.")
+                manifiesto = contenedor.read(nombres[min(candidatos, key=len)])
+            if isinstance(manifiesto, bytes):
+                manifiesto = manifiesto.decode("utf-8")
+            filas = leer_manifiesto(manifiesto)
+        except (ValueError, UnicodeDecodeError) as e:
+            contenedor.close()
+            raise ValueError(str(e))
+        return contenedor, nombres, filas
+
+    async def procesar(self, contenedor, nombres, filas):
+        inicio = time.perf_counter()
+        eventos = asyncio.Queue()
+        pendientes = []  # (n, fila de personas, miembro del ZIP, foto) listas para el próximo lote
+        lock_lote = asyncio.Lock()
+        extraccion = asyncio.Semaphore(self.concurrencia)
+        # Filas en curso a la vez (acota los bytes de fotos en memoria)
+        en_curso = asyncio.Semaphore(2 * self.concurrencia)
+        contador = {"procesadas": 0, "registradas": 0, "errores": 0}
+
+        def evento_error(n, fila, error):
+            contador["procesadas"] += 1
+            contador["errores"] += 1
+            return {"evento": "fila", "fila": n, "archivo": fila["archivo"], "estado": "error", "error": error}
+
+        async def insertar(lote):
+            personas = [persona for _, persona, _, _ in lote]
+            try:
+                await self.insertar_lote("personas", personas)
+            except Exception as e:
+                logger.exception("❌ Error al insertar un lote de %d personas", len(lote))
+                for n, _, _, _ in lote:
+                    await eventos.put(evento_error(n, filas[n - 1], f"Error al guardar: {e}"))
+                return
+            # Las fotos se encolan solo con las filas ya guardadas (sin huérfanas en el bucket);
+            # se vuelven a leer del ZIP en vez de retenerlas en memoria mientras se llena el lote.
+            # Si la cola del subidor está llena espera aquí (contrapresión).
+            for _, _, miembro, foto in lote:
+                await self.encolar_foto(await asyncio.to_thread(contenedor.read, miembro), foto)
+            await self.al_insertar(personas)
+            self.lotes += 1
+            contador["procesadas"] += len(lote)
+            contador["registradas"] += len(lote)
+            for n, persona, _, _ in lote:
+                await eventos.put({"evento": "fila", "fila": n, "archivo": filas[n - 1]["archivo"],
+                                   "estado": "ok", "persona_id": persona["id"]})
+            transcurrido = time.perf_counter() - inicio
+            await eventos.put({"evento": "progreso", **contador, "total": len(filas),
+                               "transcurrido_s": round(transcurrido, 2),
+                               "personas_por_s": round(contador["registradas"] / transcurrido, 2)})
+
+        async def vaciar(todo=False):
+            async with lock_lote:
+                while len(pendientes) >= self.lote or (todo and pendientes):
+                    lote = pendientes[:self.lote]
+                    del pendientes[:self.lote]
+                    await insertar(lote)
+
+        async def procesar_fila(n, fila):
+            async with en_curso:
+                try:
+                    if not fila["archivo"] or not fila["nombre"]:
+                        raise ValueError("Faltan archivo o nombre.")
+                    miembro = nombres.get(posixpath.normpath(fila["archivo"]))
+                    if miembro is None:
+                        raise ValueError("La foto no está en el ZIP.")
+                    async with extraccion:
+                        contenido = await asyncio.to_thread(contenedor.read, miembro)
+                        embedding = await self._extraer(contenido)
+                except Exception as e:
+                    await eventos.put(evento_error(n, fila, str(e)))
+                    return
+
+            foto, foto_url = self.reservar_foto()
+            pendientes.append((n, {
+                "id": str(uuid4()),
+                "nombre": fila["nombre"],
+                "apellidos": fila["apellidos"],
+                "correo": fila["correo"],
+                "kp": codificar_kp(embedding),
+                "foto": foto_url,
+                "requisitoriado": fila["requisitoriado"].lower() in VERDADEROS,
+            }, miembro, foto))
+            await vaciar()
+
+        async def ejecutar():
+            try:
+                await asyncio.gather(*(procesar_fila(n, fila) for n, fila in enumerate(filas, start=1)))
+                await vaciar(todo=True)
+            finally:
+                await eventos.put(None)
+
+        tarea = asyncio.create_task(ejecutar())
+        try:
+            while (evento := await eventos.get()) is not None:
+                yield evento
+            await tarea
+        finally:
+            # Si el cliente se desconecta se cancela lo pendiente (lo ya insertado queda)
+            if not tarea.done():
+                tarea.cancel()
+            contenedor.close()
+
+        duracion = time.perf_counter() - inicio
+        self.registradas += contador["registradas"]
+        self.errores += contador["errores"]
+        logger.info("✅ Enrolamiento masivo: %d registradas, %d con error en %.1f s (%.1f personas/s)",
+                    contador["registradas"], contador["errores"], duracion, contador["registradas"] / duracion)
+        yield {"evento": "resumen", **contador, "total": len(filas), "duracion_s": round(duracion, 2),
+               "personas_por_s": round(contador["registradas"] / duracion, 2)}
+
+    async def ndjson(self, *args, **kwargs):
+        # Una línea JSON por evento (application/x-ndjson)
+        async for evento in self.procesar(*args, **kwargs):
+            yield json.dumps(evento, ensure_ascii=False) + "\n"
+
+    def estado(self):
+        return {"lotes": self.lotes, "registradas": self.registradas, "errores": self.errores,
+                "concurrencia": self.concurrencia, "lote": self.lote}
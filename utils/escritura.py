@@ -0,0 +1,258 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import httpx
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ESCRITURA_LOTE = int(os.getenv("ESCRITURA_LOTE", "200"))
+ESCRITURA_INTERVALO_S = float(os.getenv("ESCRITURA_INTERVALO_S", "1.0"))
+ESCRITURA_REINTENTOS = int(os.getenv("ESCRITURA_REINTENTOS", "5"))
+# Archivo donde se vuelcan las filas que no se pudieron escribir al apagar, y las que
+# no caben en memoria (se recuperan a medida que la cola se vacía)
+ESCRITURA_RESPALDO = os.getenv("ESCRITURA_RESPALDO", "eventos_pendientes.jsonl")
+ESCRITURA_MAX_PENDIENTES = int(os.getenv("ESCRITURA_MAX_PENDIENTES", "50000"))
+# Filas que la base rechaza de a una (p. ej. la FK de una persona ya borrada): no se reintentan
+ESCRITURA_RECHAZADAS = os.getenv("ESCRITURA_RECHAZADAS", "eventos_rechazados.jsonl")
+
+ERRORES_TRANSITORIOS = (OSError, asyncio.TimeoutError, httpx.TransportError, sqlite3.OperationalError)
+# SQLSTATE de conexión, recursos, intervención del operador y conflictos de transacción;
+# PGRST000-003: PostgREST no llega a Postgres
+CODIGOS_TRANSITORIOS = ("08", "40", "53", "57", "PGRST00")
+
+
+def error_transitorio(e):
+    # Caídas de red, timeouts o base ocupada: el lote entero se reintenta más tarde.
+    # Lo demás (restricciones, datos inválidos) depende de las filas y no se arregla reintentando.
+    if isinstance(e, ERRORES_TRANSITORIOS):
+        return True
+    codigo = getattr(e, "code", None)
+    return isinstance(codigo, str) and codigo.startswith(CODIGOS_TRANSITORIOS)
+
+
+class SumideroEventos:
+    # Cola en memoria de inserts; se vacía en lotes por tamaño o por tiempo
+    def __init__(self, insertar_lote, lote=ESCRITURA_LOTE, intervalo_s=ESCRITURA_INTERVALO_S,
+                 reintentos=ESCRITURA_REINTENTOS, respaldo=ESCRITURA_RESPALDO,
+                 max_pendientes=ESCRITURA_MAX_PENDIENTES, rechazadas=ESCRITURA_RECHAZADAS,
+                 transitorio=error_transitorio):
+        self.insertar_lote = insertar_lote  # async insertar_lote(tabla, filas)
+        self.lote = lote
+        self.intervalo_s = intervalo_s
+        self.reintentos = reintentos
+        self.respaldo = respaldo
+        self.max_pendientes = max_pendientes
+        self.rechazadas = rechazadas
+        self.transitorio = transitorio
+        self._pendientes = {}
+        self._cantidad = 0
+        self._leido = 0  # bytes del respaldo ya devueltos a la cola
+        self._lock = threading.Lock()
+        self._loop = None
+        self._despertar = None
+        self._tarea = None
+        self._activo = False
+        self.insertadas = 0
+        self.fallos = 0
+        self.descartadas = 0
+        self.volcadas = 0
+
+    def agregar(self, tabla, fila):
+        with self._lock:
+            if self._cantidad >= self.max_pendientes and self.respaldo:
+                # Cola llena (la base no da abasto o no responde): a disco, no a memoria
+                self._escribir(self.respaldo, [{"tabla": tabla, "fila": fila}])
+                self.volcadas += 1
+                return
+            self._pendientes.setdefault(tabla, []).append(fila)
+            self._cantidad += 1
+            lleno = self._cantidad >= self.lote
+        if lleno and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._despertar.set)
+
+    @staticmethod
+    def _escribir(ruta, eventos):
+        with open(ruta, "a") as f:
+            for evento in eventos:
+                f.write(json.dumps(evento) + "\n")
+
+    def _tomar(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+            self._cantidad = 0
+        return pendientes
+
+    def _devolver(self, tabla, filas):
+        with self._lock:
+            cola = self._pendientes[tabla] = filas + self._pendientes.get(tabla, [])
+            self._cantidad += len(filas)
+            # Lo que entró mientras se insertaba puede pasar del tope: lo más nuevo va a disco
+            exceso = min(self._cantidad - self.max_pendientes, len(cola))
+            if exceso > 0 and self.respaldo:
+                self._escribir(self.respaldo, [{"tabla": tabla, "fila": fila} for fila in cola[-exceso:]])
+                del cola[-exceso:]
+                self._cantidad -= exceso
+                self.volcadas += exceso
+
+    def _rechazar(self, tabla, rechazadas):
+        if not rechazadas:
+            return
+        self.descartadas += len(rechazadas)
+        for fila, error in rechazadas:
+            logger.error("❌ Fila descartada de %s, la base la rechaza: %s", tabla, error)
+        if self.rechazadas:
+            with self._lock:
+                self._escribir(self.rechazadas, [{"tabla": tabla, "fila": fila, "error": str(error)}
+                                                 for fila, error in rechazadas])
+
+    async def _insertar(self, tabla, filas, reintentos):
+        # None si se insertó; si no, el último error
+        for intento in range(reintentos + 1):
+            try:
+                await self.insertar_lote(tabla, filas)
+                self.insertadas += len(filas)
+                return None
+            except Exception as e:
+                error = e
+                self.fallos += 1
+                logger.warning("❌ Error al insertar %d filas en %s (intento %d): %s", len(filas), tabla, intento + 1, e)
+                if not self.transitorio(e):
+                    break
+                if intento < reintentos:
+                    await asyncio.sleep(min(30, 0.5 * 2 ** intento))
+        return error
+
+    async def _aislar(self, tabla, filas, error):
+        # Bisección del lote rechazado: se inserta lo que la base acepta y se devuelven
+        # ([(fila, error)] rechazadas de a una, filas que quedan para el siguiente ciclo)
+        if len(filas) == 1:
+            return ([], filas) if self.transitorio(error) else ([(filas[0], error)], [])
+        rechazadas, devueltas = [], []
+        mitad = len(filas) // 2
+        for parte in (filas[:mitad], filas[mitad:]):
+            error = await self._insertar(tabla, parte, 0)
+            if error is None:
+                continue
+            if self.transitorio(error):
+                # La base dejó de responder a mitad de la bisección
+                devueltas += parte
+            else:
+                r, d = await self._aislar(tabla, parte, error)
+                rechazadas += r
+                devueltas += d
+        return rechazadas, devueltas
+
+    async def vaciar(self, reintentos=None):
+        reintentos = self.reintentos if reintentos is None else reintentos
+        for tabla, filas in self._tomar().items():
+            for inicio in range(0, len(filas), self.lote):
+                bloque = filas[inicio:inicio + self.lote]
+                error = await self._insertar(tabla, bloque, reintentos)
+                if error is None:
+                    continue
+                if self.transitorio(error):
+                    # Se conservan en memoria para el siguiente ciclo
+                    self._devolver(tabla, filas[inicio:])
+                    break
+                rechazadas, devueltas = await self._aislar(tabla, bloque, error)
+                self._rechazar(tabla, rechazadas)
+                if devueltas:
+                    self._devolver(tabla, devueltas + filas[inicio + self.lote:])
+                    break
+
+    def _recuperar_respaldo(self):
+        # Devuelve a la cola las filas volcadas a disco, hasta el tope de la cola. Se lee a
+        # partir de lo ya recuperado: los volcados nuevos se agregan al final del archivo.
+        if not self.respaldo or not os.path.exists(self.respaldo):
+            return 0
+        with self._lock:
+            espacio = self.max_pendientes - self._cantidad
+            leido = self._leido
+        recuperadas, n = {}, 0
+        with open(self.respaldo, "rb") as f:
+            f.seek(leido)
+            while n < espacio:
+                linea = f.readline()
+                if not linea.endswith(b"\n"):
+                    break  # fin del archivo (o una línea que se está escribiendo)
+                leido += len(linea)
+                if linea.strip():
+                    evento = json.loads(linea)
+                    recuperadas.setdefault(evento["tabla"], []).append(evento["fila"])
+                    n += 1
+        with self._lock:
+            for tabla, filas in recuperadas.items():
+                self._pendientes.setdefault(tabla, []).extend(filas)
+            self._cantidad += n
+            self._leido = leido
+            if leido >= os.path.getsize(self.respaldo):
+                os.remove(self.respaldo)
+                self._leido = 0
+        if n:
+            logger.info("✅ %d eventos recuperados de %s", n, self.respaldo)
+        return n
+
+    async def _bucle(self):
+        while self._activo:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            await self.vaciar()
+            if self.respaldo and os.path.exists(self.respaldo):
+                await asyncio.to_thread(self._recuperar_respaldo)
+
+    def _volcar_respaldo(self):
+        pendientes = self._tomar()
+        if not self.respaldo:
+            return
+        with self._lock:
+            if self._leido and os.path.exists(self.respaldo):
+                # Solo queda en el archivo lo que no se recuperó
+                with open(self.respaldo, "rb") as f:
+                    f.seek(self._leido)
+                    resto = f.read()
+                temporal = f"{self.respaldo}.tmp"
+                with open(temporal, "wb") as f:
+                    f.write(resto)
+                os.replace(temporal, self.respaldo)
+                self._leido = 0
+            eventos = [{"tabla": tabla, "fila": fila} for tabla, filas in pendientes.items() for fila in filas]
+            if eventos:
+                self._escribir(self.respaldo, eventos)
+        if eventos:
+            logger.warning("⚠️ %d eventos guardados en %s", len(eventos), self.respaldo)
+
+    async def iniciar(self):
+        self._loop = asyncio.get_running_loop()
+        self._despertar = asyncio.Event()
+        self._recuperar_respaldo()
+        self._activo = True
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            # Se deja terminar el lote en curso en vez de cancelarlo a mitad
+            self._activo = False
+            self._despertar.set()
+            await self._tarea
+            self._tarea = None
+        # Un único intento al apagar; lo que falle queda en el archivo de respaldo
+        await self.vaciar(reintentos=0)
+        self._volcar_respaldo()
+
+    def estado(self):
+        with self._lock:
+            pendientes = {tabla: len(filas) for tabla, filas in self._pendientes.items()}
+            en_disco = os.path.getsize(self.respaldo) - self._leido if self.respaldo and os.path.exists(self.respaldo) else 0
+        return {"pendientes": pendientes, "insertadas": self.insertadas, "fallos": self.fallos,
+                "descartadas": self.descartadas, "volcadas": self.volcadas, "bytes_en_disco": en_disco}
@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ESTADISTICAS_TTL_S = float(os.getenv("ESTADISTICAS_TTL_S", "5"))
+# Cada cuánto se toman los agregados de la base (son consultas count/RPC, no recorridos);
+# entre una y otra cada worker suma lo que él mismo escribió
+ESTADISTICAS_RECONCILIAR_S = float(os.getenv("ESTADISTICAS_RECONCILIAR_S", "60"))
+ESTADISTICAS_REINTENTO_S = 30
+CONTADORES = ("personas", "reconocimientos", "alertas")
+ESTADISTICAS_TOP = 3
+
+
+class EstadisticasDashboard:
+    # Agregados del dashboard calculados en la base (conteos exactos y la función
+    # top_personas_reconocidas) y refrescados periódicamente, más los deltas de lo que este
+    # worker insertó desde entonces (también por persona, para el top). Con varios workers
+    # cada uno ve los agregados comunes y solo adelanta sus propias escrituras hasta el
+    # siguiente refresco.
+    def __init__(self, obtener_agregados, ttl_s=ESTADISTICAS_TTL_S, intervalo_s=ESTADISTICAS_RECONCILIAR_S):
+        self.obtener_agregados = obtener_agregados  # async () -> dict (ver reconciliar)
+        self.ttl_s = ttl_s
+        self.intervalo_s = intervalo_s
+        self._lock = threading.Lock()
+        self._base = {contador: 0 for contador in CONTADORES}
+        self._deltas = {contador: 0 for contador in CONTADORES}
+        self._top = []
+        self._por_persona = Counter()  # reconocimientos insertados por persona desde el último refresco
+        self._nombres = {}  # persona_id -> (nombre, apellidos, ronda en que se reconoció)
+        self._ronda = 0
+        self._requisitoriados_reconocidos = 0
+        self._reciente = {}
+        self._respuesta = None
+        self._respuesta_creada = 0.0
+        self._tarea = None
+        self._detener = None
+        self.reconciliaciones = 0
+
+    def registrar_persona(self, delta=1):
+        # Tras insertar (o borrar, delta < 0) personas en la base
+        self.registrar_insertadas("personas", delta)
+
+    def registrar_insertadas(self, tabla, n, personas=()):
+        # Tras insertar filas de reconocimientos o alertas (el sumidero las escribe por lotes);
+        # `personas`: el persona_id de cada reconocimiento insertado
+        if tabla in self._deltas:
+            with self._lock:
+                self._deltas[tabla] += n
+                self._por_persona.update(personas)
+
+    def registrar_reconocimiento(self, persona, fecha, hora):
+        with self._lock:
+            self._nombres[persona["id"]] = (persona["nombre"], persona["apellidos"], self._ronda)
+            if (fecha, hora) >= (self._reciente.get("fecha", ""), self._reciente.get("hora", "")):
+                self._reciente = {
+                    "fecha": fecha,
+                    "hora": hora,
+                    "personas": {"nombre": persona["nombre"], "apellidos": persona["apellidos"]},
+                }
+
+    async def reconciliar(self):
+        # Los deltas acumulados hasta aquí ya están en la base cuando se leen los agregados;
+        # los que lleguen durante la lectura se conservan (no se pisan con la base).
+        with self._lock:
+            al_empezar = dict(self._deltas)
+            por_persona = Counter(self._por_persona)
+            self._ronda += 1
+        agregados = await self.obtener_agregados()
+        with self._lock:
+            for contador in CONTADORES:
+                self._base[contador] = agregados[f"total_{contador}"]
+                self._deltas[contador] -= al_empezar[contador]
+            self._por_persona.subtract(por_persona)
+            self._por_persona = +self._por_persona
+            # Se olvidan los nombres de quien no tiene reconocimientos locales, salvo los
+            # reconocidos en esta ronda o la anterior (su fila puede no haberse insertado aún)
+            self._nombres = {persona_id: (nombre, apellidos, ronda)
+                             for persona_id, (nombre, apellidos, ronda) in self._nombres.items()
+                             if persona_id in self._por_persona or ronda >= self._ronda - 1}
+            self._top = agregados["top"]
+            self._requisitoriados_reconocidos = agregados["requisitoriados_reconocidos"]
+            reciente = agregados["persona_mas_reciente"] or {}
+            if (reciente.get("fecha", ""), reciente.get("hora", "")) >= (
+                    self._reciente.get("fecha", ""), self._reciente.get("hora", "")):
+                self._reciente = reciente
+            self._respuesta = None
+            self.reconciliaciones += 1
+
+    def _top_actual(self):
+        # Top de la base con los reconocimientos insertados desde entonces. Quien no estaba en
+        # el top de la base entra con sus reconocimientos locales (su total real puede ser
+        # mayor; la siguiente reconciliación lo corrige).
+        if not self._por_persona or any("persona_id" not in fila or "total" not in fila for fila in self._top):
+            return self._top
+        filas = {fila["persona_id"]: dict(fila) for fila in self._top}
+        for persona_id, n in self._por_persona.items():
+            if persona_id in filas:
+                filas[persona_id]["total"] += n
+            else:
+                nombre, apellidos, _ = self._nombres.get(persona_id, (None, None, None))
+                filas[persona_id] = {"persona_id": persona_id, "nombre": nombre, "apellidos": apellidos, "total": n}
+        return heapq.nlargest(ESTADISTICAS_TOP, filas.values(), key=lambda fila: fila["total"])
+
+    def resumen(self):
+        with self._lock:
+            if self._respuesta is not None and time.monotonic() - self._respuesta_creada < self.ttl_s:
+                return self._respuesta
+
+            total = {contador: self._base[contador] + self._deltas[contador] for contador in CONTADORES}
+            total_personas_count = total["personas"]
+            requisitoriados_detectados = self._requisitoriados_reconocidos
+
+            # Porcentaje requisitoriados
+            porcentaje_requisitoriados = (
+                f"{requisitoriados_detectados} de {total_personas_count} personas están requisitoriadas "
+                f"({round((requisitoriados_detectados / total_personas_count) * 100, 2)}%)"
+            ) if total_personas_count > 0 else "No hay personas registradas."
+
+            self._respuesta = {
+                "total_personas": total_personas_count,
+                "total_reconocimientos": total["reconocimientos"],
+                "total_alertas": total["alertas"],
+                "top_3": self._top_actual(),
+                "requisitoriados_reconocidos": requisitoriados_detectados,
+                "porcentaje_requisitoriados": porcentaje_requisitoriados,
+                "persona_mas_reciente": self._reciente,
+            }
+            self._respuesta_creada = time.monotonic()
+            return self._respuesta
+
+    async def _bucle(self):
+        # La primera reconciliación es inmediata (en segundo plano, no retrasa el arranque);
+        # si falla se reintenta antes del intervalo normal
+        espera = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._detener.wait(), espera)
+                break
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.reconciliar()
+                espera = self.intervalo_s
+            except Exception:
+                logger.exception("❌ Error al reconciliar estadísticas")
+                espera = min(self.intervalo_s, ESTADISTICAS_REINTENTO_S)
+
+    def iniciar(self):
+        self._detener = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._detener.set()
+            await self._tarea
+            self._tarea = None
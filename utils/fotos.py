@@ -0,0 +1,238 @@
+import asyncio
+import io
+import logging
+import os
+import posixpath
+from contextlib import suppress
+from uuid import uuid4
+
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# La foto se guarda re-codificada con el lado mayor acotado (la original no se sube)
+FOTO_MAX_LADO = int(os.getenv("FOTO_MAX_LADO", "1024"))
+FOTO_CALIDAD = int(os.getenv("FOTO_CALIDAD", "85"))
+FOTO_FORMATO = os.getenv("FOTO_FORMATO", "jpeg")  # "jpeg" o "webp"
+# Miniatura para el panel de administración
+MINIATURA_LADO = int(os.getenv("MINIATURA_LADO", "160"))
+MINIATURA_CALIDAD = int(os.getenv("MINIATURA_CALIDAD", "75"))
+
+FOTOS_COLA_MAX = int(os.getenv("FOTOS_COLA_MAX", "200"))
+# Tope de la cola por tamaño (las originales pueden pesar varios MB cada una)
+FOTOS_COLA_MAX_BYTES = int(os.getenv("FOTOS_COLA_MAX_BYTES", str(64 * 1024 * 1024)))
+# Carpeta donde quedan las fotos que no se pudieron subir (fallo o apagado); se reintentan al iniciar
+FOTOS_RESPALDO = os.getenv("FOTOS_RESPALDO", "fotos_pendientes")
+FOTOS_TRABAJADORES = int(os.getenv("FOTOS_TRABAJADORES", "4"))
+FOTOS_REINTENTOS = int(os.getenv("FOTOS_REINTENTOS", "5"))
+
+FORMATOS = {"jpeg": ("jpg", "image/jpeg"), "webp": ("webp", "image/webp")}
+PREFIJO_FOTO = "foto_"
+PREFIJO_MINIATURA = "min_"
+
+
+def _codificar(img, formato, calidad):
+    buffer = io.BytesIO()
+    if formato == "webp":
+        img.save(buffer, "WEBP", quality=calidad, method=4)
+    else:
+        img.save(buffer, "JPEG", quality=calidad, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def comprimir_foto(contenido, max_lado=FOTO_MAX_LADO, calidad=FOTO_CALIDAD, formato=FOTO_FORMATO,
+                   lado_miniatura=MINIATURA_LADO, calidad_miniatura=MINIATURA_CALIDAD):
+    # (foto, miniatura) re-codificadas; de paso se descartan los metadatos EXIF (incluido el GPS)
+    img = Image.open(io.BytesIO(contenido))
+    if img.format == "JPEG" and max(img.size) > max_lado:
+        # El decodificador JPEG reduce por 1/2, 1/4 o 1/8 sin pasar por la resolución completa
+        img.draft("RGB", (max_lado, max_lado))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+    foto = _codificar(img, formato, calidad)
+    img.thumbnail((lado_miniatura, lado_miniatura), Image.LANCZOS)
+    return foto, _codificar(img, formato, calidad_miniatura)
+
+
+def url_miniatura(url_foto):
+    # La miniatura vive junto a la foto con otro prefijo; las fotos anteriores al pipeline no tienen
+    if not url_foto:
+        return None
+    carpeta, nombre = posixpath.split(url_foto)
+    if not nombre.startswith(PREFIJO_FOTO):
+        return None
+    return posixpath.join(carpeta, PREFIJO_MINIATURA + nombre[len(PREFIJO_FOTO):])
+
+
+class SubidorFotos:
+    # Comprime y sube las fotos de personas fuera de la respuesta. La URL pública es
+    # determinista, así que la fila se guarda con ella antes de que termine la subida
+    # (puede no existir durante unos segundos). Cola acotada por cantidad y por bytes: si se
+    # llena, encolar() espera. Lo que no se sube (reintentos agotados o apagado) se guarda en
+    # la carpeta de respaldo con el nombre definitivo y se vuelve a encolar al iniciar.
+    def __init__(self, subir_foto, url_publica, cola_max=FOTOS_COLA_MAX, cola_max_bytes=FOTOS_COLA_MAX_BYTES,
+                 trabajadores=FOTOS_TRABAJADORES, reintentos=FOTOS_REINTENTOS, formato=FOTO_FORMATO,
+                 respaldo=FOTOS_RESPALDO):
+        self.subir_foto = subir_foto  # async (nombre, bytes, content_type) -> url
+        self.url_publica = url_publica  # (nombre) -> url
+        self.cola_max_bytes = cola_max_bytes
+        self.trabajadores = trabajadores
+        self.reintentos = reintentos
+        self.extension, self.content_type = FORMATOS[formato]
+        self.formato = formato
+        self.respaldo = respaldo
+        self._cola = asyncio.Queue(maxsize=cola_max)
+        self._espacio = asyncio.Condition()
+        self._bytes = 0
+        self._tareas = []
+        self.contadores = {"encoladas": 0, "subidas": 0, "fallidas": 0, "respaldadas": 0, "recuperadas": 0,
+                           "bytes_originales": 0, "bytes_subidos": 0}
+
+    def reservar(self):
+        # Nombre y URL definitiva de una foto nueva, para guardar la fila antes de encolarla
+        foto = f"{PREFIJO_FOTO}{uuid4().hex}.{self.extension}"
+        return foto, self.url_publica(foto)
+
+    async def encolar(self, contenido, foto=None):
+        if foto is None:
+            foto, _ = self.reservar()
+        await self._poner(contenido, foto)
+        self.contadores["encoladas"] += 1
+        return self.url_publica(foto)
+
+    async def _poner(self, contenido, foto):
+        # Una foto más grande que el tope entra igual si la cola está vacía
+        async with self._espacio:
+            await self._espacio.wait_for(
+                lambda: self._bytes == 0 or self._bytes + len(contenido) <= self.cola_max_bytes
+            )
+            self._bytes += len(contenido)
+        await self._cola.put((contenido, foto))
+
+    async def _liberar(self, n):
+        async with self._espacio:
+            self._bytes -= n
+            self._espacio.notify_all()
+
+    def _miniatura(self, foto):
+        return PREFIJO_MINIATURA + foto[len(PREFIJO_FOTO):]
+
+    def _respaldar(self, contenido, foto):
+        # La original (no la comprimida): al recuperarla se procesa como una foto nueva
+        if not self.respaldo:
+            return
+        os.makedirs(self.respaldo, exist_ok=True)
+        with open(os.path.join(self.respaldo, foto), "wb") as f:
+            f.write(contenido)
+        self.contadores["respaldadas"] += 1
+
+    def _descartar_respaldo(self, foto):
+        if self.respaldo:
+            with suppress(FileNotFoundError):
+                os.remove(os.path.join(self.respaldo, foto))
+
+    def _leer_respaldo(self):
+        if not self.respaldo or not os.path.isdir(self.respaldo):
+            return []
+        pendientes = []
+        for foto in sorted(os.listdir(self.respaldo)):
+            if foto.startswith(PREFIJO_FOTO):
+                with open(os.path.join(self.respaldo, foto), "rb") as f:
+                    pendientes.append((f.read(), foto))
+        return pendientes
+
+    async def _recuperar(self):
+        # Se encolan como cualquier otra foto (respetando el tope de bytes); el archivo se
+        # borra recién cuando la subida termina bien
+        pendientes = await asyncio.to_thread(self._leer_respaldo)
+        if pendientes:
+            logger.info("📦 %d fotos pendientes recuperadas de %s", len(pendientes), self.respaldo)
+        for contenido, foto in pendientes:
+            await self._poner(contenido, foto)
+            self.contadores["recuperadas"] += 1
+
+    async def _subir(self, nombre, contenido):
+        for intento in range(self.reintentos + 1):
+            try:
+                await self.subir_foto(nombre, contenido, self.content_type)
+                self.contadores["bytes_subidos"] += len(contenido)
+                return True
+            except Exception as e:
+                logger.warning("❌ Error al subir %s (intento %d): %s", nombre, intento + 1, e)
+                if intento < self.reintentos:
+                    await asyncio.sleep(min(60, 2 ** intento))
+        return False
+
+    async def _procesar(self, contenido, foto):
+        try:
+            comprimida, reducida = await asyncio.to_thread(comprimir_foto, contenido, formato=self.formato)
+        except Exception:
+            # No es una imagen válida: reintentarla no serviría
+            logger.exception("❌ No se pudo comprimir la foto %s", foto)
+            self.contadores["fallidas"] += 1
+            await asyncio.to_thread(self._descartar_respaldo, foto)
+            return
+        self.contadores["bytes_originales"] += len(contenido)
+        subidas = await asyncio.gather(self._subir(foto, comprimida), self._subir(self._miniatura(foto), reducida))
+        if all(subidas):
+            self.contadores["subidas"] += 1
+            await asyncio.to_thread(self._descartar_respaldo, foto)
+        else:
+            self.contadores["fallidas"] += 1
+            await asyncio.to_thread(self._respaldar, contenido, foto)
+            logger.error("❌ La foto %s quedó sin subir tras %d intentos; guardada en %s para reintentarla",
+                         foto, self.reintentos + 1, self.respaldo)
+
+    async def _trabajador(self):
+        while True:
+            contenido, foto = await self._cola.get()
+            try:
+                await self._procesar(contenido, foto)
+            except asyncio.CancelledError:
+                # Apagado con la subida a medias
+                self._respaldar(contenido, foto)
+                raise
+            finally:
+                try:
+                    await asyncio.shield(self._liberar(len(contenido)))
+                finally:
+                    self._cola.task_done()
+
+    def iniciar(self):
+        self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+        self._tareas.append(asyncio.create_task(self._recuperar()))
+
+    async def esperar(self):
+        await self._cola.join()
+
+    async def cerrar(self, espera_s=30):
+        respaldadas = self.contadores["respaldadas"]
+        try:
+            await asyncio.wait_for(self._cola.join(), espera_s)
+        except asyncio.TimeoutError:
+            pass
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        # Lo que quedó en la cola se guarda en disco: las filas ya apuntan a estas fotos
+        while not self._cola.empty():
+            contenido, foto = self._cola.get_nowait()
+            self._respaldar(contenido, foto)
+            self._cola.task_done()
+            self._bytes -= len(contenido)
+        if self.contadores["respaldadas"] > respaldadas:
+            logger.warning("⚠️ %d fotos sin subir al apagar, guardadas en %s",
+                           self.contadores["respaldadas"] - respaldadas, self.respaldo)
+
+    def estado(self):
+        return {
+            "pendientes": self._cola.qsize(),
+            "bytes_pendientes": self._bytes,
+            "formato": self.formato,
+            **self.contadores,
+        }
@@ -0,0 +1,479 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.codec_kp import DIMENSION_KP, MatrizCuantizada, decodificar_kp
+from utils.galeria_compartida import GaleriaCompartida
+from utils.similitud import normas_filas
+
+
+load_dotenv()
+
+# Galería residente en int8 con una escala por fila (~4 veces menos memoria que float32)
+GALERIA_CUANTIZADA = os.getenv("GALERIA_CUANTIZADA", "0") == "1"
+BLOQUE_CUANTIZACION = 65536
+# Directorio de la instantánea compartida entre workers (uvicorn --workers N); vacío = solo en memoria
+GALERIA_COMPARTIDA_DIR = os.getenv("GALERIA_COMPARTIDA_DIR", "")
+
+# Capacidad libre que se reserva al construir la galería para las altas que lleguen después
+GALERIA_HOLGURA = float(os.getenv("GALERIA_HOLGURA", "0.25"))
+GALERIA_HOLGURA_MIN = 1024
+# Fracción de bajas acumuladas a partir de la cual se compacta (reconstrucción completa)
+GALERIA_COMPACTAR = float(os.getenv("GALERIA_COMPACTAR", "0.1"))
+# Diferencia por componente por debajo de la cual un kp se considera el mismo (cubre f16/i8)
+TOLERANCIA_KP = 2e-3
+
+# Para saber si una instantánea publicada es de este mismo despliegue
+INICIO_PROCESO = time.time()
+
+
+def vector_kp(kp):
+    # El kp llega como lista JSON, texto JSON o codificado ("f16:...", "i8:..."); None si no es válido
+    return decodificar_kp(kp)
+
+
+class InstantaneaGaleria:
+    # Vista de la galería: matriz contigua + arreglos paralelos de metadatos
+    # (en la galería compartida todo son arreglos mapeados desde disco).
+    # Las instantáneas sucesivas en memoria comparten `reserva` (buffers con capacidad libre):
+    # cada una ve sus primeras len() filas, y las bajas quedan en False en `activos`
+    # hasta la siguiente compactación. `kp_cambiados` es el largo, al crear la instantánea,
+    # de la lista de filas reescritas en sitio (así el índice IVF solo reasigna esas).
+    def __init__(self, version, matriz, ids, nombres, apellidos, requisitoriados, normas=None, posiciones=None,
+                 activos=None, reserva=None, kp_cambiados=0):
+        self.version = version
+        self.matriz = matriz
+        self.ids = ids
+        self.nombres = nombres
+        self.apellidos = apellidos
+        self.requisitoriados = requisitoriados
+        if posiciones is None:
+            posiciones = {persona_id: i for i, persona_id in enumerate(ids)}
+        self.posiciones = posiciones
+        self.normas = normas if normas is not None else normas_filas(matriz)
+        self.activos = activos
+        self.reserva = reserva
+        self.kp_cambiados = kp_cambiados
+
+    def __len__(self):
+        return len(self.matriz)
+
+    def persona(self, i):
+        return {
+            "id": self.ids[i],
+            "nombre": self.nombres[i],
+            "apellidos": self.apellidos[i],
+            "requisitoriado": bool(self.requisitoriados[i]),
+        }
+
+
+def _vista(matriz, fin, inicio=0):
+    if isinstance(matriz, MatrizCuantizada):
+        return MatrizCuantizada(matriz.codigos[inicio:fin], matriz.escalas[inicio:fin])
+    return matriz[inicio:fin]
+
+
+class GaleriaResidente:
+    # Índice en memoria de los kp de `personas`. Las lecturas toman la instantánea
+    # actual sin bloquear. Las altas, cambios y bajas cuestan O(filas cambiadas): se
+    # escriben en sitio o al final de la reserva y se publica una instantánea nueva;
+    # solo se reconstruye todo al cargar, al llenarse la reserva o al compactar las bajas.
+    # Con GALERIA_COMPARTIDA_DIR la instantánea se publica en disco y todos los workers
+    # la mapean; las escrituras se serializan entre procesos con un flock.
+    def __init__(self, cuantizada=GALERIA_CUANTIZADA, directorio_compartido=GALERIA_COMPARTIDA_DIR):
+        self.cuantizada = cuantizada
+        self.compartida = GaleriaCompartida(directorio_compartido) if directorio_compartido else None
+        self._lock = threading.Lock()
+        # Galería compartida: cambios esperando al escritor (se aplican juntos, en una sola
+        # publicación) y plantillas que no se pudieron escribir porque el flock estaba tomado
+        self._lock_pendientes = threading.Lock()
+        self._cambios_pendientes = []
+        self._kp_pendientes = {}
+        # Última plantilla entrenada en este proceso que la base aún no devolvió por el
+        # registro de cambios (ver _conservar_plantillas)
+        self._kp_locales = {}
+        self.lotes_publicados = 0
+        self._eliminadas = 0
+        self.compactaciones = 0
+        self._instantanea = self._construir(0, [])
+
+    def _construir(self, version, filas):
+        validas = []
+        for fila in filas:
+            vector = vector_kp(fila.get("kp"))
+            if vector is not None:
+                validas.append((fila, vector))
+
+        n = len(validas)
+        capacidad = n + max(GALERIA_HOLGURA_MIN, int(n * GALERIA_HOLGURA))
+        if self.cuantizada:
+            # Se cuantiza por bloques para no tener la galería completa en float32
+            matriz = MatrizCuantizada.vacia(capacidad)
+            for inicio in range(0, n, BLOQUE_CUANTIZACION):
+                fin = min(n, inicio + BLOQUE_CUANTIZACION)
+                matriz[inicio:fin] = [v for _, v in validas[inicio:fin]]
+        else:
+            matriz = np.empty((capacidad, DIMENSION_KP), dtype=np.float32)
+            for i, (_, vector) in enumerate(validas):
+                matriz[i] = vector
+        normas = np.zeros(capacidad, dtype=np.float32)
+        normas[:n] = normas_filas(_vista(matriz, n))
+        activos = np.ones(capacidad, dtype=bool)
+
+        return InstantaneaGaleria(
+            version,
+            _vista(matriz, n),
+            [fila["id"] for fila, _ in validas],
+            [fila.get("nombre") for fila, _ in validas],
+            [fila.get("apellidos") for fila, _ in validas],
+            [bool(fila.get("requisitoriado")) for fila, _ in validas],
+            normas=normas[:n],
+            activos=activos[:n],
+            reserva=(matriz, normas, activos, []),
+        )
+
+    @property
+    def instantanea(self):
+        if self.compartida is not None:
+            # Cambio a la última versión publicada por cualquier worker
+            publicada = self.compartida.actual()
+            if publicada is not None:
+                self._instantanea = publicada
+        return self._instantanea
+
+    @property
+    def version(self):
+        return self.instantanea.version
+
+    @property
+    def total(self):
+        # Personas vigentes (sin contar las bajas pendientes de compactar)
+        return len(self.instantanea.posiciones)
+
+    @contextmanager
+    def _escritura(self):
+        # Un solo escritor: entre hilos con el lock y entre workers con el flock del directorio
+        with self._lock:
+            if self.compartida is None:
+                yield self._instantanea
+                return
+            with self.compartida.bloqueo():
+                actual = self.instantanea
+                # Antes de reconstruir, para que la versión nueva parta de las plantillas al día
+                self._escribir_kp_pendientes(actual)
+                yield actual
+
+    def _publicar(self, version, filas):
+        self._instalar(self._construir(version, filas))
+
+    def _instalar(self, instantanea):
+        if self.compartida is not None:
+            instantanea = self.compartida.publicar(instantanea)
+        self._instantanea = instantanea
+        self._eliminadas = 0
+
+    def usar_publicada(self, desde=INICIO_PROCESO):
+        # Al arrancar varios workers, el primero carga la galería desde la base de datos
+        # y la publica; los demás solo mapean esa instantánea.
+        if self.compartida is None or self.compartida.actual() is None:
+            return False
+        return self.compartida.creada >= desde
+
+    def cargar(self, filas):
+        with self._escritura() as actual:
+            self._publicar(actual.version + 1, self._conservar_plantillas(actual, filas))
+
+    @staticmethod
+    def _filas(actual):
+        return [
+            {**actual.persona(i), "kp": actual.matriz[i]}
+            for i in range(len(actual))
+            if actual.activos is None or actual.activos[i]
+        ]
+
+    def _conservar_plantillas(self, actual, filas):
+        # Filas leídas de la base (registro de cambios o recarga): el kp de `personas` solo se
+        # pone al día al guardar plantillas, así que la plantilla entrenada en este proceso es
+        # la más nueva hasta que la base la devuelva. Con galería compartida esto cubre las
+        # plantillas del worker que aplica el registro; las de los demás vuelven por el
+        # registro al guardarse.
+        resultado = []
+        for fila in filas:
+            i = actual.posiciones.get(fila["id"])
+            vector = vector_kp(fila.get("kp"))
+            if i is not None and vector is not None:
+                with self._lock_pendientes:
+                    local = self._kp_locales.get(fila["id"])
+                    if local is not None and np.allclose(vector, local, atol=TOLERANCIA_KP):
+                        # La base ya tiene la última plantilla de este proceso
+                        del self._kp_locales[fila["id"]]
+                if local is not None:
+                    fila = {**fila, "kp": actual.matriz[i]}
+            resultado.append(fila)
+        return resultado
+
+    @staticmethod
+    def _sin_cambios(actual, i, fila, vector):
+        return (
+            (actual.nombres[i] or "") == (fila.get("nombre") or "")
+            and (actual.apellidos[i] or "") == (fila.get("apellidos") or "")
+            and bool(actual.requisitoriados[i]) == bool(fila.get("requisitoriado"))
+            and np.allclose(actual.matriz[i], vector, atol=TOLERANCIA_KP)
+        )
+
+    def _planificar(self, actual, filas, eliminados):
+        # filas: personas nuevas o modificadas (con kp); eliminados: ids dados de baja.
+        # Solo lee la instantánea: (bajas, modificadas, altas, reconstruir).
+        bajas = [persona_id for persona_id in eliminados if persona_id in actual.posiciones]
+        modificadas, altas = [], []
+        # Si un id llega repetido vale la última versión
+        for fila in {fila["id"]: fila for fila in filas}.values():
+            vector = vector_kp(fila.get("kp"))
+            i = actual.posiciones.get(fila["id"])
+            if vector is None:
+                # Sin kp válido no puede estar en la galería
+                if i is not None:
+                    bajas.append(fila["id"])
+            elif i is None:
+                altas.append((fila, vector))
+            elif not self._sin_cambios(actual, i, fila, vector):
+                modificadas.append((i, fila, vector))
+
+        matriz, normas = (actual.reserva or (None, None))[:2]
+        # Reconstrucción completa: galería compartida (se publica en disco), reserva llena o
+        # demasiadas bajas acumuladas
+        reconstruir = (self.compartida is not None or matriz is None or len(actual) + len(altas) > len(normas)
+                       or self._eliminadas + len(bajas) > GALERIA_COMPACTAR * max(len(actual), 1))
+        return bajas, modificadas, altas, reconstruir
+
+    def _reconstruir(self, actual, plan):
+        bajas, modificadas, altas, _ = plan
+        por_id = {fila["id"]: fila for fila in self._filas(actual)}
+        for persona_id in bajas:
+            por_id.pop(persona_id, None)
+        por_id.update({fila["id"]: fila for _, fila, _ in modificadas})
+        por_id.update({fila["id"]: fila for fila, _ in altas})
+        return self._construir(actual.version + 1, list(por_id.values()))
+
+    def _aplicar(self, actual, filas, eliminados):
+        # Devuelve cuántas filas cambiaron de verdad (las repetidas se ignoran)
+        return self._ejecutar(actual, self._planificar(actual, filas, eliminados))
+
+    def _ejecutar(self, actual, plan, nueva=None):
+        # Se llama con el lock de escritura tomado. `nueva`: la reconstrucción ya hecha fuera
+        bajas, modificadas, altas, reconstruir = plan
+        cambios = len(bajas) + len(modificadas) + len(altas)
+        if not cambios:
+            return 0
+        if bajas and self._kp_locales:
+            with self._lock_pendientes:
+                for persona_id in bajas:
+                    self._kp_locales.pop(persona_id, None)
+
+        if reconstruir:
+            self._instalar(nueva if nueva is not None else self._reconstruir(actual, plan))
+            self.compactaciones += 1
+            return cambios
+
+        matriz, normas, activos, kp_cambiados = actual.reserva
+        n = len(actual)
+        for persona_id in bajas:
+            activos[actual.posiciones.pop(persona_id)] = False
+        self._eliminadas += len(bajas)
+        for i, fila, vector in modificadas:
+            matriz[i] = vector
+            fila_matriz = matriz[i]
+            normas[i] = np.sqrt(fila_matriz @ fila_matriz)
+            actual.nombres[i] = fila.get("nombre")
+            actual.apellidos[i] = fila.get("apellidos")
+            actual.requisitoriados[i] = bool(fila.get("requisitoriado"))
+            kp_cambiados.append(i)
+
+        # Las altas van al final de la reserva; las instantáneas anteriores no las ven
+        total = n + len(altas)
+        if altas:
+            matriz[n:total] = [vector for _, vector in altas]
+            normas[n:total] = normas_filas(_vista(matriz, total, n))
+            activos[n:total] = True
+        for j, (fila, _) in enumerate(altas):
+            actual.ids.append(fila["id"])
+            actual.nombres.append(fila.get("nombre"))
+            actual.apellidos.append(fila.get("apellidos"))
+            actual.requisitoriados.append(bool(fila.get("requisitoriado")))
+            actual.posiciones[fila["id"]] = n + j
+        self._instantanea = InstantaneaGaleria(
+            actual.version + 1, _vista(matriz, total), actual.ids, actual.nombres, actual.apellidos,
+            actual.requisitoriados, normas=normas[:total], posiciones=actual.posiciones,
+            activos=activos[:total], reserva=actual.reserva, kp_cambiados=len(kp_cambiados),
+        )
+        return cambios
+
+    def _resolver(self, actual, lote):
+        # lote: [(filas, eliminados, {persona_id: campos}, del_registro)] en orden de llegada.
+        # Devuelve (filas, eliminados) con el estado final de cada id; los campos sueltos se
+        # aplican sobre la fila vigente (la del mismo lote si la hay).
+        ultimo = {}
+        for filas, eliminados, campos, del_registro in lote:
+            if del_registro:
+                filas = self._conservar_plantillas(actual, filas)
+            ultimo.update((fila["id"], fila) for fila in filas)
+            ultimo.update((persona_id, None) for persona_id in eliminados)
+            for persona_id, cambios in campos.items():
+                fila = ultimo.get(persona_id)
+                if fila is None:
+                    i = actual.posiciones.get(persona_id)
+                    if persona_id in ultimo or i is None:
+                        continue
+                    fila = {**actual.persona(i), "kp": actual.matriz[i]}
+                fila = dict(fila)
+                for campo in ("nombre", "apellidos", "requisitoriado", "kp"):
+                    if campo in cambios:
+                        fila[campo] = cambios[campo]
+                ultimo[persona_id] = fila
+        return ([fila for fila in ultimo.values() if fila is not None],
+                [persona_id for persona_id, fila in ultimo.items() if fila is None])
+
+    def _cambiar(self, filas, eliminados=(), campos=None, del_registro=False):
+        cambio = (filas, eliminados, campos or {}, del_registro)
+        if self.compartida is None:
+            with self._escritura() as actual:
+                return self._aplicar(actual, *self._resolver(actual, [cambio]))
+        # Con galería compartida cada publicación reconstruye y escribe la galería completa
+        # (O(N)): quien toma el candado aplica también los cambios que llegaron mientras
+        # esperaba. Devuelve las filas cambiadas del lote aplicado (0 si lo aplicó otro hilo).
+        with self._lock_pendientes:
+            self._cambios_pendientes.append(cambio)
+        with self._escritura() as actual:
+            with self._lock_pendientes:
+                lote, self._cambios_pendientes = self._cambios_pendientes, []
+            if not lote:
+                return 0
+            self.lotes_publicados += 1
+            return self._aplicar(actual, *self._resolver(actual, lote))
+
+    def aplicar_cambios(self, filas, eliminados=(), del_registro=False):
+        # del_registro=True: filas leídas de la base, que no pisan plantillas más nuevas
+        return self._cambiar(filas, eliminados, del_registro=del_registro)
+
+    def preparar_cambios(self, filas, eliminados=()):
+        # Galería en memoria, desde un hilo: compara las filas del registro con la instantánea
+        # vigente y, si hace falta reconstruir, construye la nueva, sin tocar lo que el loop
+        # está leyendo. confirmar_cambios() lo aplica después en el loop.
+        actual = self._instantanea
+        version = actual.version
+        filas, eliminados = self._resolver(actual, [(filas, eliminados, {}, True)])
+        plan = self._planificar(actual, filas, eliminados)
+        nueva = self._reconstruir(actual, plan) if plan[3] and any(plan[:3]) else None
+        return actual, version, plan, nueva
+
+    def confirmar_cambios(self, preparado):
+        # En el loop y en O(filas cambiadas): altas al final de la reserva, filas modificadas
+        # en sitio o cambio de instantánea. None si la galería cambió mientras se preparaba
+        # (hay que volver a prepararlo).
+        actual, version, plan, nueva = preparado
+        with self._lock:
+            if self._instantanea is not actual or actual.version != version:
+                return None
+            return self._ejecutar(actual, plan, nueva)
+
+    def agregar(self, persona):
+        if vector_kp(persona.get("kp")) is None:
+            return
+        self.aplicar_cambios([persona])
+
+    def actualizar_datos(self, persona_id, campos):
+        if "kp" in campos:
+            with self._lock_pendientes:
+                self._kp_locales.pop(persona_id, None)
+        self._cambiar([], (), {persona_id: campos})
+
+    def actualizar_kp(self, persona_id, kp):
+        vector = vector_kp(kp)
+        if vector is None:
+            return
+        if self.compartida is not None:
+            # Se llama en el camino del reconocimiento: no se espera al flock. Si otro escritor
+            # lo tiene, la fila queda pendiente y la escribe el siguiente que lo tome.
+            with self._lock_pendientes:
+                self._kp_pendientes[persona_id] = vector
+            self.escribir_kp_pendientes(esperar=False)
+            return
+        with self._escritura() as actual:
+            i = actual.posiciones.get(persona_id)
+            if i is None:
+                return
+            # Cambio de una sola fila: se escribe en sitio, sin copiar la matriz
+            actual.matriz[i] = vector
+            fila = actual.matriz[i]
+            with self._lock_pendientes:
+                self._kp_locales[persona_id] = np.array(fila)
+            actual.normas[i] = np.sqrt(fila @ fila)
+            # Instantánea nueva sobre los mismos buffers, con la fila anotada como reescrita
+            # (igual que en _ejecutar) para que el índice IVF la reasigne de lista
+            kp_cambiados = actual.reserva[3]
+            kp_cambiados.append(i)
+            self._instantanea = InstantaneaGaleria(
+                actual.version + 1, actual.matriz, actual.ids, actual.nombres, actual.apellidos,
+                actual.requisitoriados, normas=actual.normas, posiciones=actual.posiciones,
+                activos=actual.activos, reserva=actual.reserva, kp_cambiados=len(kp_cambiados),
+            )
+
+    def kp(self, persona_id):
+        # Plantilla vigente de una persona, incluida la que aún espera el flock
+        with self._lock_pendientes:
+            pendiente = self._kp_pendientes.get(persona_id)
+        if pendiente is not None:
+            return pendiente
+        actual = self.instantanea
+        i = actual.posiciones.get(persona_id)
+        return None if i is None else actual.matriz[i]
+
+    def escribir_kp_pendientes(self, esperar=True):
+        # Solo galería compartida. Con esperar=False no bloquea: si el candado está tomado
+        # devuelve False y las filas siguen pendientes.
+        if self.compartida is None or not self._kp_pendientes:
+            return True
+        if not self._lock.acquire(blocking=esperar):
+            return False
+        try:
+            with self.compartida.bloqueo(esperar=esperar):
+                self._escribir_kp_pendientes(self.instantanea)
+            return True
+        except BlockingIOError:
+            return False
+        finally:
+            self._lock.release()
+
+    def _escribir_kp_pendientes(self, actual):
+        # Sobre el archivo mapeado: los demás workers lo ven sin cambiar de versión
+        with self._lock_pendientes:
+            pendientes, self._kp_pendientes = self._kp_pendientes, {}
+        for persona_id, vector in pendientes.items():
+            i = actual.posiciones.get(persona_id)
+            if i is not None:
+                self.compartida.escribir_fila(actual, i, vector)
+                with self._lock_pendientes:
+                    self._kp_locales[persona_id] = np.array(actual.matriz[i])
+
+    def eliminar(self, persona_id):
+        self.aplicar_cambios([], [persona_id])
+
+    def estado(self):
+        actual = self.instantanea
+        return {
+            "version": actual.version,
+            "total": len(actual.posiciones),
+            "filas": len(actual),
+            "eliminadas_sin_compactar": self._eliminadas,
+            "reconstrucciones": self.compactaciones,
+            "lotes_publicados": self.lotes_publicados,
+            "plantillas_pendientes": len(self._kp_pendientes),
+            "compartida": self.compartida.estado() if self.compartida is not None else None,
+        }
+
+
+galeria = GaleriaResidente()
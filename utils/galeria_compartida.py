@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.codec_kp import MatrizCuantizada
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Versiones anteriores que se conservan en disco (un worker puede estar a punto de mapearlas)
+GALERIA_COMPARTIDA_VERSIONES = int(os.getenv("GALERIA_COMPARTIDA_VERSIONES", "3"))
+
+PUNTERO = "actual"
+CANDADO = "escritor.lock"
+
+
+class TextosMapeados:
+    # Columna de texto guardada como arreglo de bytes UTF-8 de ancho fijo (mapeable)
+    def __init__(self, arreglo):
+        self.arreglo = arreglo
+
+    @classmethod
+    def codificar(cls, textos):
+        return np.array([(t or "").encode("utf-8") for t in textos], dtype=np.bytes_)
+
+    def __len__(self):
+        return len(self.arreglo)
+
+    def __getitem__(self, i):
+        return self.arreglo[i].decode("utf-8")
+
+
+class PosicionesMapeadas:
+    # Reemplaza al dict {persona_id: fila}: búsqueda binaria sobre los ids ordenados
+    def __init__(self, ids_ordenados, orden):
+        self.ids_ordenados = ids_ordenados
+        self.orden = orden
+
+    def _buscar(self, persona_id):
+        if not isinstance(persona_id, str) or not len(self.orden):
+            return None
+        clave = persona_id.encode("utf-8")
+        j = int(np.searchsorted(self.ids_ordenados, clave))
+        if j < len(self.orden) and self.ids_ordenados[j] == clave:
+            return int(self.orden[j])
+        return None
+
+    def get(self, persona_id, defecto=None):
+        i = self._buscar(persona_id)
+        return defecto if i is None else i
+
+    def __contains__(self, persona_id):
+        return self._buscar(persona_id) is not None
+
+    def __getitem__(self, persona_id):
+        i = self._buscar(persona_id)
+        if i is None:
+            raise KeyError(persona_id)
+        return i
+
+    def __iter__(self):
+        return (persona_id.decode("utf-8") for persona_id in self.ids_ordenados)
+
+    def __len__(self):
+        return len(self.orden)
+
+
+class GaleriaCompartida:
+    # Instantáneas de la galería publicadas en disco para que varios workers de uvicorn
+    # las mapeen en solo lectura (una sola copia en la caché de páginas del sistema).
+    #   <directorio>/v00000042/  matriz.npy (o codigos.npy + escalas.npy), normas.npy,
+    #                            ids.npy, nombres.npy, apellidos.npy, requisitoriados.npy,
+    #                            ids_ordenados.npy, orden.npy, metadatos.json
+    #   <directorio>/actual      nombre de la versión vigente; se reemplaza con os.replace
+    #   <directorio>/escritor.lock  flock: un solo escritor a la vez entre procesos
+    def __init__(self, directorio, versiones=GALERIA_COMPARTIDA_VERSIONES):
+        self.directorio = directorio
+        self.versiones = versiones
+        self._puntero = os.path.join(directorio, PUNTERO)
+        self._lock = threading.Lock()
+        self._firma = None
+        self._mapeada = None
+        self._escribible = None
+        self.creada = None  # time.time() de la publicación vigente
+        self.publicaciones = 0
+        self.recargas = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    @contextmanager
+    def bloqueo(self, esperar=True):
+        # fcntl solo existe en POSIX; se importa aquí para no exigirlo sin galería compartida.
+        # Con esperar=False lanza BlockingIOError si otro escritor lo tiene tomado.
+        import fcntl
+
+        with open(os.path.join(self.directorio, CANDADO), "a") as candado:
+            fcntl.flock(candado, fcntl.LOCK_EX if esperar else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(candado, fcntl.LOCK_UN)
+
+    def _ruta(self, nombre, archivo=""):
+        return os.path.join(self.directorio, nombre, archivo)
+
+    def _mapear(self, nombre, modo="r"):
+        from utils.galeria import InstantaneaGaleria
+
+        with open(self._ruta(nombre, "metadatos.json")) as f:
+            metadatos = json.load(f)
+        # mmap no admite archivos sin datos: una galería vacía se lee normal
+        modo = modo if metadatos["total"] else None
+
+        def cargar(archivo):
+            return np.load(self._ruta(nombre, archivo), mmap_mode=modo)
+
+        instantanea = InstantaneaGaleria(
+            metadatos["version"], self._matriz(nombre, metadatos["cuantizada"], modo),
+            TextosMapeados(cargar("ids.npy")),
+            TextosMapeados(cargar("nombres.npy")),
+            TextosMapeados(cargar("apellidos.npy")),
+            cargar("requisitoriados.npy"),
+            normas=cargar("normas.npy"),
+            posiciones=PosicionesMapeadas(cargar("ids_ordenados.npy"), cargar("orden.npy")),
+        )
+        instantanea.nombre_publicacion = nombre
+        return instantanea, metadatos["creada"]
+
+    def _matriz(self, nombre, cuantizada, modo):
+        if cuantizada:
+            return MatrizCuantizada(np.load(self._ruta(nombre, "codigos.npy"), mmap_mode=modo),
+                                    np.load(self._ruta(nombre, "escalas.npy"), mmap_mode=modo))
+        return np.load(self._ruta(nombre, "matriz.npy"), mmap_mode=modo)
+
+    def actual(self):
+        # Costo por llamada: un stat del puntero; solo se vuelve a mapear si cambió
+        try:
+            estado = os.stat(self._puntero)
+        except FileNotFoundError:
+            return None
+        firma = (estado.st_ino, estado.st_mtime_ns, estado.st_size)
+        if firma == self._firma:
+            return self._mapeada
+
+        with self._lock:
+            if firma != self._firma:
+                try:
+                    with open(self._puntero) as f:
+                        nombre = f.read().strip()
+                    self._mapeada, self.creada = self._mapear(nombre)
+                except FileNotFoundError:
+                    # El puntero cambió mientras se leía; se reintenta en la próxima llamada
+                    return self._mapeada
+                self._firma = firma
+                self.recargas += 1
+            return self._mapeada
+
+    def publicar(self, instantanea):
+        # Se llama con bloqueo() tomado. Se escribe en un directorio temporal que se renombra
+        # completo, y recién entonces se cambia el puntero: nadie ve una versión a medias.
+        nombre = f"v{instantanea.version:08d}"
+        temporal = self._ruta(f".tmp-{uuid4().hex}")
+        os.makedirs(temporal)
+
+        def guardar(archivo, arreglo):
+            np.save(os.path.join(temporal, archivo), arreglo)
+
+        if isinstance(instantanea.matriz, MatrizCuantizada):
+            guardar("codigos.npy", instantanea.matriz.codigos)
+            guardar("escalas.npy", instantanea.matriz.escalas)
+        else:
+            guardar("matriz.npy", instantanea.matriz)
+        ids = TextosMapeados.codificar(instantanea.ids)
+        orden = np.argsort(ids, kind="stable")
+        guardar("normas.npy", np.asarray(instantanea.normas))
+        guardar("ids.npy", ids)
+        guardar("nombres.npy", TextosMapeados.codificar(instantanea.nombres))
+        guardar("apellidos.npy", TextosMapeados.codificar(instantanea.apellidos))
+        guardar("requisitoriados.npy", np.asarray(instantanea.requisitoriados, dtype=bool))
+        guardar("ids_ordenados.npy", ids[orden])
+        guardar("orden.npy", orden)
+        with open(os.path.join(temporal, "metadatos.json"), "w") as f:
+            json.dump({
+                "version": instantanea.version,
+                "total": len(instantanea),
+                "cuantizada": isinstance(instantanea.matriz, MatrizCuantizada),
+                "creada": time.time(),
+                "pid": os.getpid(),
+            }, f)
+
+        if os.path.exists(self._ruta(nombre)):
+            shutil.rmtree(self._ruta(nombre))
+        os.rename(temporal, self._ruta(nombre))
+        puntero_temporal = f"{self._puntero}.{uuid4().hex}"
+        with open(puntero_temporal, "w") as f:
+            f.write(nombre)
+        os.replace(puntero_temporal, self._puntero)
+        self.publicaciones += 1
+        self._limpiar(nombre)
+        logger.info("✅ Galería publicada: %s (%d personas)", nombre, len(instantanea))
+        return self.actual()
+
+    def escribir_fila(self, instantanea, i, vector):
+        # Cambio de una sola fila (plantillas): se escribe en sitio sobre el mapeo compartido,
+        # que los demás workers ven sin volver a mapear. Se llama con bloqueo() tomado.
+        nombre = instantanea.nombre_publicacion
+        if self._escribible is None or self._escribible[0] != nombre:
+            cuantizada = isinstance(instantanea.matriz, MatrizCuantizada)
+            self._escribible = (nombre, self._matriz(nombre, cuantizada, "r+"),
+                                np.load(self._ruta(nombre, "normas.npy"), mmap_mode="r+"))
+        _, matriz, normas = self._escribible
+        matriz[i] = vector
+        fila = matriz[i]
+        normas[i] = np.sqrt(fila @ fila)
+
+    def _limpiar(self, vigente):
+        # Los workers que aún tengan mapeada una versión borrada la siguen leyendo sin problema
+        versiones = sorted(n for n in os.listdir(self.directorio) if n.startswith("v") and n != vigente)
+        for nombre in versiones[:max(0, len(versiones) - self.versiones)]:
+            shutil.rmtree(self._ruta(nombre), ignore_errors=True)
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith(".tmp-") and time.time() - os.path.getmtime(self._ruta(nombre)) > 3600:
+                shutil.rmtree(self._ruta(nombre), ignore_errors=True)
+
+    def estado(self):
+        return {
+            "directorio": self.directorio,
+            "version": self._mapeada.version if self._mapeada is not None else None,
+            "publicaciones": self.publicaciones,
+            "recargas": self.recargas,
+        }
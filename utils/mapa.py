@@ -0,0 +1,446 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, time as hora_dia
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.datos import DATOS_PAGINA
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se leen los reconocimientos nuevos (0 = solo la carga inicial)
+MAPA_INTERVALO_S = float(os.getenv("MAPA_INTERVALO_S", "5"))
+# Recarga completa periódica (recoge filas borradas, p. ej. por la retención)
+MAPA_RECONSTRUIR_S = float(os.getenv("MAPA_RECONSTRUIR_S", "3600"))
+MAPA_LOTE = int(os.getenv("MAPA_LOTE", str(DATOS_PAGINA)))
+# Ids que se vuelven a leer por debajo del último visto (transacciones que confirman fuera de orden)
+MAPA_SOLAPE = int(os.getenv("MAPA_SOLAPE", "100"))
+MAPA_CACHE_TESELAS = int(os.getenv("MAPA_CACHE_TESELAS", "4096"))
+MAPA_MAX_TESELAS = int(os.getenv("MAPA_MAX_TESELAS", "64"))
+MAPA_MAX_PUNTOS = int(os.getenv("MAPA_MAX_PUNTOS", "1000"))
+MAPA_ESPERA_S = float(os.getenv("MAPA_ESPERA_S", "10"))
+
+# Código espacial: Morton (Z-order) de la posición Web Mercator en una grilla de 2^24 x 2^24
+# (~2.4 m en el ecuador). Los puntos de una tesela z/x/y son un rango contiguo de códigos.
+NIVEL = 24
+# Cada tesela se agrupa en una grilla de 8x8 celdas
+BITS_CELDA = 3
+ZOOM_MAX = NIVEL - BITS_CELDA
+LATITUD_MAX = 85.05112878
+
+
+class MapaNoListo(Exception):
+    pass
+
+
+def _separar_bits(v):
+    # Intercala un cero entre cada bit (32 -> 64 bits)
+    v = np.asarray(v).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for desplazamiento, mascara in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                                    (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(desplazamiento))) & np.uint64(mascara)
+    return v
+
+
+def codigo_morton(x, y):
+    return _separar_bits(x) | (_separar_bits(y) << np.uint64(1))
+
+
+def proyectar(latitudes, longitudes, nivel=NIVEL):
+    # Web Mercator a enteros de `nivel` bits, con x e y como en las teselas z/x/y
+    lat = np.radians(np.clip(np.asarray(latitudes, dtype=np.float64), -LATITUD_MAX, LATITUD_MAX))
+    lon = np.clip(np.asarray(longitudes, dtype=np.float64), -180, 180)
+    n = 1 << nivel
+    x = np.clip(((lon + 180) / 360 * n).astype(np.int64), 0, n - 1)
+    y = np.clip(((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * n).astype(np.int64), 0, n - 1)
+    return x, y
+
+
+def instante(texto, fin_del_dia=False):
+    # "2026-10-01" o ISO 8601 -> segundos (hora local, como se guardan fecha y hora)
+    valor = datetime.fromisoformat(texto)
+    if valor.tzinfo is not None:
+        valor = valor.astimezone().replace(tzinfo=None)
+    if fin_del_dia and len(texto) <= 10:
+        valor = datetime.combine(valor.date(), hora_dia.max)
+    return int(np.datetime64(valor, "s").astype(np.int64))
+
+
+def rango_tiempo(desde=None, hasta=None):
+    try:
+        return (instante(desde) if desde else None), (instante(hasta, fin_del_dia=True) if hasta else None)
+    except ValueError:
+        raise ValueError("⚠️ Fechas inválidas: use AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS.")
+
+
+def validar_caja(caja):
+    if caja is None:
+        return None
+    min_lat, min_lon, max_lat, max_lon = caja
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise ValueError("⚠️ Caja inválida: se espera min_lat <= max_lat y min_lon <= max_lon (sin cruzar el antimeridiano).")
+    return caja
+
+
+def _texto_instantes(segundos):
+    return [s.replace("T", " ") for s in np.datetime_as_string(np.asarray(segundos).astype("datetime64[s]"))]
+
+
+class InstantaneaMapa:
+    # Reconocimientos con coordenadas, ordenados por código espacial, en arreglos paralelos.
+    # Cada actualización crea una instantánea nueva; las consultas usan la que tomaron.
+    # `personas` (código -> persona_id) solo crece y se comparte entre instantáneas.
+    def __init__(self, version, codigo, latitud, longitud, t, persona, personas, ultimo_id):
+        self.version = version
+        self.codigo = codigo
+        self.latitud = latitud
+        self.longitud = longitud
+        self.t = t
+        self.persona = persona
+        self.personas = personas
+        self.ultimo_id = ultimo_id
+
+    def __len__(self):
+        return len(self.codigo)
+
+    @classmethod
+    def vacia(cls, personas):
+        return cls(0, np.empty(0, np.uint64), np.empty(0, np.float32), np.empty(0, np.float32),
+                   np.empty(0, np.int64), np.empty(0, np.int32), personas, 0)
+
+
+class IndiceMapa:
+    # Índice espacial en memoria de la tabla reconocimientos para /mapa-reconocimientos.
+    # Se carga en segundo plano al iniciar y luego lee por id solo las filas nuevas. Las
+    # teselas agrupadas (celdas de 8x8 con conteo, centroide y último instante) se guardan
+    # en una caché LRU por (zoom, tesela, rango de fechas); al llegar puntos nuevos solo se
+    # invalidan las teselas que los contienen. Los puntos de personas borradas se descartan
+    # al consultar, según la galería.
+    def __init__(self, datos, galeria, intervalo_s=MAPA_INTERVALO_S, reconstruir_s=MAPA_RECONSTRUIR_S,
+                 lote=MAPA_LOTE, solape=MAPA_SOLAPE, cache_max=MAPA_CACHE_TESELAS):
+        self.datos = datos
+        self.galeria = galeria
+        self.intervalo_s = intervalo_s
+        self.reconstruir_s = reconstruir_s
+        self.lote = lote
+        self.solape = solape
+        self.cache_max = cache_max
+        self._codigos = {}
+        self._personas = []
+        self.instantanea = InstantaneaMapa.vacia(self._personas)
+        self._generacion = 0
+        self._vistos = set()
+        self._vivos = (None, None)
+        self._lock = threading.Lock()
+        self._lock_vivos = threading.Lock()
+        self._cache = OrderedDict()  # (z, prefijo, t0, t1) -> (etiqueta, clusters)
+        self._por_tesela = {}  # (z, prefijo) -> claves de la caché
+        self._cargado = None
+        self._aviso = None
+        self._tarea = None
+        self._ultima_reconstruccion = 0.0
+        self.actualizaciones = 0
+        self.reconstrucciones = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.ultima_actualizacion_ms = None
+
+    # Carga y actualización
+
+    def _columnas(self, filas):
+        filas = [f for f in filas if f.get("latitud") is not None and f.get("longitud") is not None and f.get("fecha")]
+        if not filas:
+            return None
+        for fila in filas:
+            if fila["persona_id"] not in self._codigos:
+                self._codigos[fila["persona_id"]] = len(self._personas)
+                self._personas.append(fila["persona_id"])
+        latitud = np.array([f["latitud"] for f in filas], dtype=np.float64)
+        longitud = np.array([f["longitud"] for f in filas], dtype=np.float64)
+        t = np.array([f"{f['fecha']}T{(f.get('hora') or '00:00:00')[:8]}" for f in filas], dtype="datetime64[s]")
+        return (codigo_morton(*proyectar(latitud, longitud)), latitud.astype(np.float32), longitud.astype(np.float32),
+                t.astype(np.int64), np.array([self._codigos[f["persona_id"]] for f in filas], dtype=np.int32))
+
+    def _fusionar(self, bloques, ultimo_id, desde_cero=False):
+        anterior = InstantaneaMapa.vacia(self._personas) if desde_cero else self.instantanea
+        if bloques:
+            nuevas = [np.concatenate(columna) for columna in zip(*bloques)]
+            orden = np.argsort(nuevas[0], kind="stable")
+            nuevas = [columna[orden] for columna in nuevas]
+            # Inserción ordenada: O(n) en memoria, sin volver a ordenar lo que ya estaba
+            posiciones = np.searchsorted(anterior.codigo, nuevas[0], side="right")
+            columnas = [np.insert(vieja, posiciones, nueva) for vieja, nueva in zip(
+                (anterior.codigo, anterior.latitud, anterior.longitud, anterior.t, anterior.persona), nuevas)]
+        else:
+            columnas = (anterior.codigo, anterior.latitud, anterior.longitud, anterior.t, anterior.persona)
+        instantanea = InstantaneaMapa(self.instantanea.version + 1, *columnas, self._personas, ultimo_id)
+        with self._lock:
+            self.instantanea = instantanea
+            if desde_cero:
+                self._generacion += 1
+                self._cache.clear()
+                self._por_tesela.clear()
+            elif bloques:
+                self._invalidar(nuevas[0])
+
+    def _invalidar(self, codigos):
+        if not self._cache:
+            return
+        for z in range(ZOOM_MAX + 1):
+            for prefijo in np.unique(codigos >> np.uint64(2 * (NIVEL - z))).tolist():
+                for clave in self._por_tesela.pop((z, prefijo), ()):
+                    self._cache.pop(clave, None)
+
+    async def _leer(self, desde):
+        # Bloques de columnas con los reconocimientos de id > desde (que no se hayan visto ya)
+        bloques, ultimo_id = [], self.instantanea.ultimo_id
+        while True:
+            filas = await self.datos.reconocimientos_posteriores(desde, self.lote)
+            nuevas = [f for f in filas if f["id"] not in self._vistos]
+            if nuevas:
+                ultimo_id = max(ultimo_id, max(f["id"] for f in nuevas))
+                self._vistos.update(f["id"] for f in nuevas)
+                self._vistos = {i for i in self._vistos if i > ultimo_id - self.solape}
+                bloque = self._columnas(nuevas)
+                if bloque is not None:
+                    bloques.append(bloque)
+            if len(filas) < self.lote:
+                return bloques, ultimo_id
+            desde = filas[-1]["id"]
+
+    async def actualizar(self):
+        inicio = time.perf_counter()
+        bloques, ultimo_id = await self._leer(max(0, self.instantanea.ultimo_id - self.solape))
+        if bloques or ultimo_id != self.instantanea.ultimo_id:
+            await asyncio.to_thread(self._fusionar, bloques, ultimo_id)
+        self.actualizaciones += 1
+        self.ultima_actualizacion_ms = round((time.perf_counter() - inicio) * 1000, 1)
+        return sum(len(b[0]) for b in bloques)
+
+    async def reconstruir(self):
+        inicio = time.perf_counter()
+        self._vistos = set()
+        bloques, ultimo_id = await self._leer(0)
+        await asyncio.to_thread(self._fusionar, bloques, ultimo_id, True)
+        self.reconstrucciones += 1
+        self._ultima_reconstruccion = time.monotonic()
+        logger.info("✅ Índice del mapa: %d puntos en %.2f s", len(self.instantanea), time.perf_counter() - inicio)
+
+    async def _bucle(self):
+        while True:
+            try:
+                if not self._cargado.is_set() or (
+                        self.reconstruir_s > 0 and time.monotonic() - self._ultima_reconstruccion > self.reconstruir_s):
+                    await self.reconstruir()
+                    self._cargado.set()
+                else:
+                    await self.actualizar()
+            except Exception:
+                logger.exception("❌ Error al actualizar el índice del mapa")
+            if self._cargado.is_set() and self.intervalo_s <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._aviso.wait(), self.intervalo_s or 5)
+            except asyncio.TimeoutError:
+                pass
+            self._aviso.clear()
+
+    def marcar_cambio(self):
+        # Tras insertar reconocimientos en este worker: se leen sin esperar al intervalo
+        if self._aviso is not None:
+            self._aviso.set()
+
+    def iniciar(self):
+        self._cargado = asyncio.Event()
+        self._aviso = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+
+    async def esperar(self, timeout_s=MAPA_ESPERA_S):
+        if self._cargado is None:
+            raise MapaNoListo("⏳ El índice del mapa no está iniciado.")
+        try:
+            await asyncio.wait_for(self._cargado.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            raise MapaNoListo("⏳ El índice del mapa se está cargando, intente en unos segundos.")
+
+    # Consultas
+
+    def _vivos_actuales(self, instantanea):
+        # Máscara por código de persona: False si ya no está en la galería (persona borrada).
+        # Se llama desde los hilos de asyncio.to_thread: la caché se lee y se reemplaza con lock.
+        galeria = self.galeria.instantanea
+        clave = (galeria.version, len(instantanea.personas))
+        with self._lock_vivos:
+            if self._vivos[0] != clave:
+                posiciones = galeria.posiciones
+                personas = instantanea.personas[:clave[1]]
+                vivos = np.fromiter((p in posiciones for p in personas), dtype=bool, count=len(personas))
+                self._vivos = (clave, (vivos, int(len(vivos) - vivos.sum())))
+            return self._vivos[1]
+
+    def _mascara(self, instantanea, vivos, inicio, fin, t0, t1):
+        mascara = vivos[instantanea.persona[inicio:fin]]
+        if t0 is not None:
+            mascara &= instantanea.t[inicio:fin] >= t0
+        if t1 is not None:
+            mascara &= instantanea.t[inicio:fin] <= t1
+        return mascara
+
+    def _agrupar_tesela(self, instantanea, vivos, z, prefijo, t0, t1):
+        desplazamiento = 2 * (NIVEL - z)
+        inicio, fin = np.searchsorted(
+            instantanea.codigo, np.array([prefijo << desplazamiento, (prefijo + 1) << desplazamiento], dtype=np.uint64))
+        seleccion = np.flatnonzero(self._mascara(instantanea, vivos, inicio, fin, t0, t1)) + inicio
+        if not len(seleccion):
+            return []
+        # Los códigos están ordenados: cada celda es un tramo contiguo, sin volver a ordenar
+        celdas = instantanea.codigo[seleccion] >> np.uint64(desplazamiento - 2 * BITS_CELDA)
+        cortes = np.flatnonzero(np.r_[True, celdas[1:] != celdas[:-1]])
+        totales = np.diff(np.r_[cortes, len(seleccion)])
+        latitudes = np.add.reduceat(instantanea.latitud[seleccion].astype(np.float64), cortes) / totales
+        longitudes = np.add.reduceat(instantanea.longitud[seleccion].astype(np.float64), cortes) / totales
+        ultimos = _texto_instantes(np.maximum.reduceat(instantanea.t[seleccion], cortes))
+        primeros = seleccion[cortes]
+        clusters = []
+        for k in range(len(cortes)):
+            cluster = {"latitud": round(float(latitudes[k]), 6), "longitud": round(float(longitudes[k]), 6),
+                       "total": int(totales[k]), "ultimo": ultimos[k]}
+            if totales[k] == 1:
+                cluster["persona_id"] = instantanea.personas[instantanea.persona[primeros[k]]]
+            clusters.append(cluster)
+        return clusters
+
+    def _tesela(self, instantanea, vivos, muertos, z, x, y, t0, t1):
+        prefijo = int(codigo_morton(x, y))
+        clave = (z, prefijo, t0, t1)
+        etiqueta = (self._generacion, muertos)
+        with self._lock:
+            guardada = self._cache.get(clave)
+            if guardada is not None and guardada[0] == etiqueta:
+                self._cache.move_to_end(clave)
+                self.aciertos += 1
+                return guardada[1]
+            self.fallos += 1
+        clusters = self._agrupar_tesela(instantanea, vivos, z, prefijo, t0, t1)
+        with self._lock:
+            # Si llegaron puntos mientras se calculaba, no se guarda (podría haber quedado vieja)
+            if instantanea is self.instantanea:
+                self._cache[clave] = (etiqueta, clusters)
+                self._por_tesela.setdefault((z, prefijo), set()).add(clave)
+                while len(self._cache) > self.cache_max:
+                    vieja, _ = self._cache.popitem(last=False)
+                    self._por_tesela.get(vieja[:2], set()).discard(vieja)
+        return clusters
+
+    def _una_tesela(self, z, x, y, t0, t1):
+        instantanea = self.instantanea
+        return self._tesela(instantanea, *self._vivos_actuales(instantanea), z, x, y, t0, t1)
+
+    def _con_nombres(self, clusters):
+        galeria = self.galeria.instantanea
+        resultado = []
+        for cluster in clusters:
+            if "persona_id" in cluster:
+                i = galeria.posiciones.get(cluster["persona_id"])
+                cluster = {**cluster, "nombre": galeria.nombres[i] if i is not None else None,
+                           "apellidos": galeria.apellidos[i] if i is not None else None}
+            resultado.append(cluster)
+        return resultado
+
+    def _teselas(self, z, caja, t0, t1):
+        instantanea = self.instantanea
+        vivos, muertos = self._vivos_actuales(instantanea)
+        if caja is None:
+            caja = (-LATITUD_MAX, -180, LATITUD_MAX, 180)
+        min_lat, min_lon, max_lat, max_lon = caja
+        (x0, x1), (y1, y0) = proyectar([min_lat, max_lat], [min_lon, max_lon], nivel=z)
+        n = (int(x1) - int(x0) + 1) * (int(y1) - int(y0) + 1)
+        if n > MAPA_MAX_TESELAS:
+            raise ValueError(f"⚠️ La caja abarca {n} teselas en zoom {z} (máximo {MAPA_MAX_TESELAS}): reduzca el zoom o el área.")
+        clusters = []
+        for x in range(int(x0), int(x1) + 1):
+            for y in range(int(y0), int(y1) + 1):
+                clusters += [c for c in self._tesela(instantanea, vivos, muertos, z, x, y, t0, t1)
+                             if min_lat <= c["latitud"] <= max_lat and min_lon <= c["longitud"] <= max_lon]
+        return n, clusters
+
+    async def tesela(self, z, x, y, desde=None, hasta=None):
+        if not 0 <= z <= ZOOM_MAX or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+            raise ValueError(f"⚠️ Tesela inválida: zoom entre 0 y {ZOOM_MAX} y x, y entre 0 y 2^zoom - 1.")
+        t0, t1 = rango_tiempo(desde, hasta)
+        await self.esperar()
+        clusters = await asyncio.to_thread(self._una_tesela, z, x, y, t0, t1)
+        return {"z": z, "x": x, "y": y, "total": sum(c["total"] for c in clusters),
+                "clusters": self._con_nombres(clusters)}
+
+    async def agrupar(self, zoom, caja=None, desde=None, hasta=None):
+        if not 0 <= zoom <= ZOOM_MAX:
+            raise ValueError(f"⚠️ El zoom debe estar entre 0 y {ZOOM_MAX}.")
+        caja = validar_caja(caja)
+        t0, t1 = rango_tiempo(desde, hasta)
+        await self.esperar()
+        teselas, clusters = await asyncio.to_thread(self._teselas, zoom, caja, t0, t1)
+        return {"zoom": zoom, "teselas": teselas, "total": sum(c["total"] for c in clusters),
+                "clusters": self._con_nombres(clusters)}
+
+    def _puntos(self, caja, t0, t1, limite):
+        # Filtro lineal vectorizado: con los límites de MAPA_MAX_PUNTOS no compensa usar rangos de códigos
+        instantanea = self.instantanea
+        vivos, _ = self._vivos_actuales(instantanea)
+        mascara = self._mascara(instantanea, vivos, 0, len(instantanea), t0, t1)
+        if caja is not None:
+            min_lat, min_lon, max_lat, max_lon = caja
+            mascara &= (instantanea.latitud >= min_lat) & (instantanea.latitud <= max_lat)
+            mascara &= (instantanea.longitud >= min_lon) & (instantanea.longitud <= max_lon)
+        seleccion = np.flatnonzero(mascara)
+        if len(seleccion) > limite:
+            seleccion = seleccion[np.argpartition(-instantanea.t[seleccion], limite - 1)[:limite]]
+        seleccion = seleccion[np.argsort(-instantanea.t[seleccion], kind="stable")]
+        galeria = self.galeria.instantanea
+        resultado = []
+        for i, instante_texto in zip(seleccion.tolist(), _texto_instantes(instantanea.t[seleccion])):
+            k = galeria.posiciones.get(instantanea.personas[instantanea.persona[i]])
+            resultado.append({
+                "nombre": galeria.nombres[k] if k is not None else None,
+                "apellidos": galeria.apellidos[k] if k is not None else None,
+                "latitud": round(float(instantanea.latitud[i]), 6),
+                "longitud": round(float(instantanea.longitud[i]), 6),
+                "timestamp": instante_texto,
+            })
+        return resultado
+
+    async def puntos(self, caja=None, desde=None, hasta=None, limite=100):
+        # Los `limite` reconocimientos más recientes dentro de la caja y el rango de fechas
+        caja = validar_caja(caja)
+        t0, t1 = rango_tiempo(desde, hasta)
+        await self.esperar()
+        return await asyncio.to_thread(self._puntos, caja, t0, t1, max(1, min(limite, MAPA_MAX_PUNTOS)))
+
+    def estado(self):
+        return {
+            "cargado": self._cargado is not None and self._cargado.is_set(),
+            "puntos": len(self.instantanea),
+            "ultimo_id": self.instantanea.ultimo_id,
+            "actualizaciones": self.actualizaciones,
+            "reconstrucciones": self.reconstrucciones,
+            "ultima_actualizacion_ms": self.ultima_actualizacion_ms,
+            "cache": {"teselas": len(self._cache), "aciertos": self.aciertos, "fallos": self.fallos},
+        }
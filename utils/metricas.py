@@ -0,0 +1,220 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Perfilador por muestreo del hilo del event loop (solo para peticiones lentas)
+PERFILADOR_ACTIVO = os.getenv("PERFILADOR_ACTIVO", "0") == "1"
+PERFILADOR_INTERVALO_MS = float(os.getenv("PERFILADOR_INTERVALO_MS", "5"))
+PERFILADOR_UMBRAL_MS = float(os.getenv("PERFILADOR_UMBRAL_MS", "500"))
+PERFILADOR_MUESTRAS_MAX = int(os.getenv("PERFILADOR_MUESTRAS_MAX", "20000"))
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas_texto(nombres, valores, extra=()):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in list(zip(nombres, valores)) + list(extra)]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Histograma:
+    # Histograma acumulativo por combinación de etiquetas (formato Prometheus)
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * len(self.buckets), 0, 0.0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += 1
+            serie[2] += valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = [(e, list(s[0]), s[1], s[2]) for e, s in self._series.items()]
+        for etiquetas, conteos, n, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, etiquetas, [('le', limite)])} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas_texto(self.etiquetas, etiquetas, [('le', '+Inf')])} {n}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas_texto(self.etiquetas, etiquetas)} {suma}")
+            lineas.append(f"{self.nombre}_count{_etiquetas_texto(self.etiquetas, etiquetas)} {n}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = Counter()
+        self._lock = threading.Lock()
+
+    def incrementar(self, *etiquetas, n=1):
+        with self._lock:
+            self._valores[etiquetas] += n
+
+    def exponer(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"] + [
+            f"{self.nombre}{_etiquetas_texto(self.etiquetas, etiquetas)} {valor}" for etiquetas, valor in valores
+        ]
+
+
+class Externa:
+    # Serie calculada al exponer a partir de contadores que ya lleva otro componente
+    def __init__(self, nombre, ayuda, tipo, etiquetas, leer):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.tipo = tipo
+        self.etiquetas = tuple(etiquetas)
+        self.leer = leer  # () -> [(valores_etiquetas, valor)]
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        try:
+            lecturas = self.leer()
+        except Exception:
+            logger.exception("No se pudo leer la métrica %s", self.nombre)
+            return lineas
+        return lineas + [
+            f"{self.nombre}{_etiquetas_texto(self.etiquetas, etiquetas)} {valor}" for etiquetas, valor in lecturas
+        ]
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+
+    def _registrar(self, metrica):
+        self._metricas[metrica.nombre] = metrica
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, buckets))
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._registrar(Contador(nombre, ayuda, etiquetas))
+
+    def externa(self, nombre, ayuda, tipo, etiquetas, leer):
+        return self._registrar(Externa(nombre, ayuda, tipo, etiquetas, leer))
+
+    def exponer(self):
+        lineas = []
+        for metrica in self._metricas.values():
+            lineas += metrica.exponer()
+        return "\n".join(lineas) + "\n"
+
+
+metricas = RegistroMetricas()
+
+ETAPAS = metricas.histograma(
+    "facecontrol_etapa_segundos",
+    "Duración por etapa: decodificacion, deteccion (face_locations), codificacion (face_encodings), "
+    "cola y total del pool de embeddings, y emparejamiento contra la galería",
+    ["etapa"],
+)
+DATOS = metricas.histograma(
+    "facecontrol_datos_segundos", "Duración de cada llamada al backend de datos", ["operacion", "tabla"]
+)
+ALERTAS = metricas.histograma(
+    "facecontrol_alerta_envio_segundos", "Duración del envío de una alerta por transporte", ["transporte"]
+)
+PETICIONES = metricas.histograma(
+    "facecontrol_peticion_segundos", "Duración de las peticiones HTTP", ["metodo", "ruta", "estado"]
+)
+COINCIDENCIAS = metricas.contador("facecontrol_coincidencias_total", "Coincidencias devueltas por el reconocimiento")
+ALERTAS_TOTAL = metricas.contador(
+    "facecontrol_alertas_total", "Alertas enviadas o fallidas por transporte", ["transporte", "resultado"]
+)
+
+
+@contextmanager
+def cronometro(histograma, *etiquetas):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, *etiquetas)
+
+
+class PerfiladorMuestreo:
+    # Un hilo toma la pila del event loop cada PERFILADOR_INTERVALO_MS en un buffer circular;
+    # al terminar una petición lenta se agregan las muestras de su intervalo y se registran.
+    def __init__(self, intervalo_ms=PERFILADOR_INTERVALO_MS, umbral_ms=PERFILADOR_UMBRAL_MS,
+                 maximo=PERFILADOR_MUESTRAS_MAX):
+        self.intervalo_s = intervalo_ms / 1000
+        self.umbral_s = umbral_ms / 1000
+        self._muestras = deque(maxlen=maximo)
+        self._hilo_objetivo = None
+        self._hilo = None
+        self._detener = threading.Event()
+
+    @staticmethod
+    def _pila(frame, profundidad=40):
+        partes = []
+        while frame is not None and len(partes) < profundidad:
+            codigo = frame.f_code
+            partes.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ";".join(reversed(partes))
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo_s):
+            frame = sys._current_frames().get(self._hilo_objetivo)
+            if frame is not None:
+                self._muestras.append((time.perf_counter(), self._pila(frame)))
+
+    def iniciar(self):
+        # Se llama desde el hilo del event loop
+        self._hilo_objetivo = threading.get_ident()
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="perfilador", daemon=True)
+        self._hilo.start()
+
+    def cerrar(self):
+        if self._hilo is not None:
+            self._detener.set()
+            self._hilo.join()
+            self._hilo = None
+
+    def revisar(self, descripcion, inicio, fin, top=10):
+        if self._hilo is None or fin - inicio < self.umbral_s:
+            return None
+        pilas = Counter(pila for instante, pila in list(self._muestras) if inicio <= instante <= fin)
+        if pilas:
+            logger.warning(
+                "Petición lenta %s (%.0f ms), %d muestras:\n%s", descripcion, (fin - inicio) * 1000,
+                sum(pilas.values()), "\n".join(f"{n:5d} {pila}" for pila, n in pilas.most_common(top)),
+            )
+        return pilas
+
+
+perfilador = PerfiladorMuestreo()
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from utils.similitud import scores_hibridos, UMBRAL_COINCIDENCIA
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Peso (en muestras) que se le da al kp guardado al empezar a promediar
+PLANTILLAS_MUESTRAS_INICIALES = int(os.getenv("PLANTILLAS_MUESTRAS_INICIALES", "10"))
+# La media pasa a ser exponencial cuando 1/(n+1) baja de este valor
+PLANTILLAS_ALFA_MIN = float(os.getenv("PLANTILLAS_ALFA_MIN", "0.05"))
+# Muestras con score menor contra la plantilla actual se descartan como atípicas. Por
+# defecto queda justo por debajo del umbral de reconocimiento: toda coincidencia aceptada
+# entrena, y solo se descartan las que ya no se parecen a la plantilla (que pudo moverse
+# desde que se reconoció la muestra, o la galería cuantizada dio un score algo distinto).
+PLANTILLAS_MARGEN_ATIPICO = float(os.getenv("PLANTILLAS_MARGEN_ATIPICO", "0.02"))
+PLANTILLAS_UMBRAL_ATIPICO = float(os.getenv("PLANTILLAS_UMBRAL_ATIPICO",
+                                            str(UMBRAL_COINCIDENCIA - PLANTILLAS_MARGEN_ATIPICO)))
+PLANTILLAS_PERSISTIR_S = float(os.getenv("PLANTILLAS_PERSISTIR_S", "30"))
+
+
+class EntrenadorPlantillas:
+    # Media incremental por persona aplicada directamente sobre la galería residente;
+    # los kp modificados se guardan en `personas` de forma periódica.
+    def __init__(self, galeria, guardar_kps, muestras_iniciales=PLANTILLAS_MUESTRAS_INICIALES,
+                 alfa_min=PLANTILLAS_ALFA_MIN, umbral_atipico=PLANTILLAS_UMBRAL_ATIPICO,
+                 intervalo_s=PLANTILLAS_PERSISTIR_S):
+        self.galeria = galeria
+        self.guardar_kps = guardar_kps  # async guardar_kps({persona_id: kp})
+        self.muestras_iniciales = muestras_iniciales
+        self.alfa_min = alfa_min
+        self.umbral_atipico = umbral_atipico
+        self.intervalo_s = intervalo_s
+        self._muestras = {}
+        self._pendientes = set()
+        self._lock = threading.Lock()
+        self._tarea = None
+        self._detener = None
+        self.aceptadas = 0
+        self.atipicas = 0
+        self.guardadas = 0
+
+    def agregar_muestra(self, persona_id, encoding, forzar=False):
+        # forzar=True (entrenamiento manual) omite el filtro de atípicos
+        muestra = np.asarray(encoding, dtype=np.float64)
+        with self._lock:
+            plantilla = self.galeria.kp(persona_id)
+            if plantilla is None:
+                return False
+
+            plantilla = plantilla.astype(np.float64)
+            if not forzar and scores_hibridos(muestra, plantilla[None, :])[0] < self.umbral_atipico:
+                self.atipicas += 1
+                return False
+
+            n = self._muestras.get(persona_id, self.muestras_iniciales)
+            alfa = max(1 / (n + 1), self.alfa_min)
+            self.galeria.actualizar_kp(persona_id, plantilla + alfa * (muestra - plantilla))
+            self._muestras[persona_id] = n + 1
+            self._pendientes.add(persona_id)
+            self.aceptadas += 1
+            return True
+
+    def olvidar(self, persona_id):
+        with self._lock:
+            self._muestras.pop(persona_id, None)
+            self._pendientes.discard(persona_id)
+
+    async def persistir(self):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, set()
+
+        kps = {}
+        for persona_id in pendientes:
+            kp = self.galeria.kp(persona_id)
+            if kp is not None:
+                kps[persona_id] = kp.tolist()
+        if not kps:
+            return
+        try:
+            await self.guardar_kps(kps)
+            self.guardadas += len(kps)
+        except Exception as e:
+            logger.warning("❌ Error al guardar %d plantillas: %s", len(kps), e)
+            with self._lock:
+                self._pendientes.update(kps)
+
+    async def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                await asyncio.wait_for(self._detener.wait(), self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            # Galería compartida: plantillas que quedaron sin escribir porque el flock estaba tomado
+            await asyncio.to_thread(self.galeria.escribir_kp_pendientes)
+            await self.persistir()
+
+    def iniciar(self):
+        self._detener = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._detener.set()
+            await self._tarea
+            self._tarea = None
+        await self.persistir()
+
+    def estado(self):
+        with self._lock:
+            return {
+                "aceptadas": self.aceptadas,
+                "atipicas": self.atipicas,
+                "guardadas": self.guardadas,
+                "pendientes": len(self._pendientes),
+            }
@@ -0,0 +1,16 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+FORMATO_LOG = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configurar_registro():
+    # La API y las herramientas de línea de comandos (migraciones) registran igual.
+    # LOG_NIVEL=DEBUG muestra cada coincidencia; por defecto los mensajes de depuración no se formatean
+    logging.basicConfig(level=LOG_NIVEL, format=FORMATO_LOG)
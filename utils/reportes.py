@@ -0,0 +1,202 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from datetime import date
+from uuid import uuid4
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+REPORTES_PAGINA = int(os.getenv("REPORTES_PAGINA", "500"))
+REPORTES_CACHE_MAX = int(os.getenv("REPORTES_CACHE_MAX", "8"))
+# Antigüedad máxima de un PDF en caché (cubre escrituras hechas por otras instancias)
+REPORTES_CACHE_TTL_S = float(os.getenv("REPORTES_CACHE_TTL_S", "300"))
+REPORTES_TRABAJOS_MAX = int(os.getenv("REPORTES_TRABAJOS_MAX", "20"))
+# Los PDF terminados se guardan en disco y se envían por bloques (vacío = directorio temporal)
+REPORTES_DIR = os.getenv("REPORTES_DIR", "")
+REPORTES_BLOQUE = 64 * 1024
+MODOS_REPORTE = ("todos", "top10", "hoy")
+
+RUTA_LOGO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logo_upao.png")
+
+COLUMNAS_ALERTAS = ["fecha", "hora", "nombre", "apellidos", "score", "metodo_envio"]
+COLUMNAS_RECONOCIMIENTOS = ["fecha", "hora", "nombre", "apellidos", "requisitoriado"]
+
+SELECT_ALERTAS = "id,fecha,hora,nombre,apellidos,score,metodo_envio"
+SELECT_RECONOCIMIENTOS = "id,fecha,hora,personas(nombre,apellidos,requisitoriado)"
+
+
+def bloques(archivo, tamano=REPORTES_BLOQUE):
+    # Cuerpo de StreamingResponse: lee el PDF abierto por partes y lo cierra al terminar
+    with archivo:
+        while True:
+            bloque = archivo.read(tamano)
+            if not bloque:
+                return
+            yield bloque
+
+
+class GeneradorReportes:
+    # Genera el PDF recorriendo las tablas por páginas (keyset sobre fecha, hora, id).
+    # Los PDF terminados (caché y trabajos) viven en archivos: en memoria solo quedan rutas.
+    def __init__(self, obtener_pagina, tamano_pagina=REPORTES_PAGINA, directorio=REPORTES_DIR):
+        # async obtener_pagina(tabla, columnas, cursor, limite, fecha) -> filas ordenadas desc
+        self.obtener_pagina = obtener_pagina
+        self.tamano_pagina = tamano_pagina
+        self._directorio_propio = not directorio
+        self.directorio = directorio or tempfile.mkdtemp(prefix="reportes_")
+        os.makedirs(self.directorio, exist_ok=True)
+        self._versiones = {"alertas": 0, "reconocimientos": 0}
+        self._cache = OrderedDict()
+        self._trabajos = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def marcar_cambio(self, tabla):
+        if tabla in self._versiones:
+            with self._lock:
+                self._versiones[tabla] += 1
+
+    def _filas(self, tabla, columnas, modo):
+        fecha = date.today().isoformat() if modo == "hoy" else None
+        limite = 10 if modo == "top10" else self.tamano_pagina
+        cursor = None
+        while True:
+            # El PDF se dibuja en un hilo; cada página se pide al event loop
+            pagina = asyncio.run_coroutine_threadsafe(
+                self.obtener_pagina(tabla, columnas, cursor, limite, fecha), self._loop
+            ).result()
+            yield from pagina
+            if modo == "top10" or len(pagina) < limite:
+                return
+            ultima = pagina[-1]
+            cursor = (ultima["fecha"], ultima["hora"], ultima["id"])
+
+    def _renderizar(self, modo):
+        # fpdf se importa con el primer reporte, no al arrancar la API
+        from fpdf import FPDF
+
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 16)
+        pdf.cell(0, 10, "Reporte General FACEAPP", ln=True, align="C")
+
+        def agregar_tabla(titulo, filas, columnas):
+            pdf.set_font("Arial", "B", 14)
+            pdf.set_fill_color(240, 240, 240)
+            pdf.cell(0, 10, f"\n{titulo}", ln=True, fill=True)
+            pdf.set_font("Arial", "B", 10)
+            for col in columnas:
+                pdf.cell(32, 8, col, border=1)
+            pdf.ln()
+            pdf.set_font("Arial", "", 10)
+            for row in filas:
+                for col in columnas:
+                    valor = str(row.get(col)) if col in row else str((row.get("personas") or {}).get(col, ""))
+                    pdf.cell(32, 8, valor, border=1)
+                pdf.ln()
+
+        agregar_tabla("1. ALERTAS", self._filas("alertas", SELECT_ALERTAS, modo), COLUMNAS_ALERTAS)
+        agregar_tabla("2. RECONOCIMIENTOS", self._filas("reconocimientos", SELECT_RECONOCIMIENTOS, modo),
+                      COLUMNAS_RECONOCIMIENTOS)
+
+        # Logo de UPAO en la esquina inferior derecha
+        if os.path.exists(RUTA_LOGO):
+            pdf.image(RUTA_LOGO, x=pdf.w - 45, y=pdf.h - 30, w=35)
+
+        # Se escribe con otro nombre y se renombra: nadie abre un PDF a medio escribir
+        ruta = os.path.join(self.directorio, f"reporte_{modo}_{uuid4().hex}.pdf")
+        pdf.output(ruta + ".tmp", "F")
+        os.replace(ruta + ".tmp", ruta)
+        return ruta
+
+    def _clave(self, modo):
+        with self._lock:
+            versiones = tuple(sorted(self._versiones.items()))
+        return (modo, date.today().isoformat() if modo == "hoy" else None, versiones)
+
+    def _borrar_si_libre(self, ruta):
+        # Se llama con el lock tomado: la caché y los trabajos pueden compartir un archivo.
+        # Un PDF que se está enviando sigue legible aunque se borre (el archivo ya está abierto).
+        if ruta in (ruta_cache for ruta_cache, _ in self._cache.values()):
+            return
+        if any(trabajo.get("ruta") == ruta for trabajo in self._trabajos.values()):
+            return
+        with suppress(FileNotFoundError):
+            os.remove(ruta)
+
+    def generar(self, modo, abrir=False):
+        # Devuelve la ruta del PDF (de la caché si está vigente) o, con abrir=True, el archivo
+        # ya abierto: se abre con el lock tomado, antes de que otra petición lo saque de la caché
+        clave = self._clave(modo)
+        with self._lock:
+            guardado = self._cache.get(clave)
+            if guardado is not None and time.monotonic() - guardado[1] < REPORTES_CACHE_TTL_S:
+                self._cache.move_to_end(clave)
+                return open(guardado[0], "rb") if abrir else guardado[0]
+
+        ruta = self._renderizar(modo)
+        with self._lock:
+            # Las entradas de versiones anteriores ya no se pueden volver a pedir
+            for vieja in [c for c in self._cache if c == clave or c[2] != clave[2]]:
+                self._borrar_si_libre(self._cache.pop(vieja)[0])
+            self._cache[clave] = (ruta, time.monotonic())
+            while len(self._cache) > REPORTES_CACHE_MAX:
+                _, (vieja, _) = self._cache.popitem(last=False)
+                self._borrar_si_libre(vieja)
+            return open(ruta, "rb") if abrir else ruta
+
+    async def abrir_async(self, modo):
+        self._loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(self.generar, modo, True)
+
+    async def generar_async(self, modo):
+        self._loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(self.generar, modo)
+
+    # Trabajos en segundo plano para reportes muy grandes
+
+    def crear_trabajo(self, modo):
+        trabajo_id = str(uuid4())
+        trabajo = {"id": trabajo_id, "modo": modo, "estado": "pendiente", "ruta": None, "error": None}
+        with self._lock:
+            self._trabajos[trabajo_id] = trabajo
+            while len(self._trabajos) > REPORTES_TRABAJOS_MAX:
+                _, viejo = self._trabajos.popitem(last=False)
+                if viejo.get("ruta"):
+                    self._borrar_si_libre(viejo["ruta"])
+
+        async def ejecutar():
+            try:
+                ruta = await self.generar_async(modo)
+                with self._lock:
+                    trabajo["ruta"] = ruta
+                    trabajo["estado"] = "listo"
+                    if trabajo_id not in self._trabajos:
+                        # Se descartó mientras se generaba
+                        self._borrar_si_libre(ruta)
+            except Exception as e:
+                trabajo["error"] = str(e)
+                trabajo["estado"] = "error"
+
+        trabajo["tarea"] = asyncio.create_task(ejecutar())
+        return trabajo_id
+
+    def trabajo(self, trabajo_id):
+        with self._lock:
+            return self._trabajos.get(trabajo_id)
+
+    def abrir_trabajo(self, trabajo):
+        with self._lock:
+            return open(trabajo["ruta"], "rb")
+
+    def cerrar(self):
+        if self._directorio_propio:
+            shutil.rmtree(self.directorio, ignore_errors=True)
@@ -0,0 +1,237 @@
+import asyncio
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import numpy as np
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+
+from utils.seguimiento import caja_conocida
+from utils.cache_embeddings import CacheEmbeddings, hash_perceptual, EMBEDDINGS_CACHE_MAX
+from utils.metricas import ETAPAS
+
+load_dotenv()
+
+EMBEDDINGS_PROCESOS = int(os.getenv("EMBEDDINGS_PROCESOS", "0")) or os.cpu_count() or 1
+# Máximo de imágenes esperando o en proceso; por encima se rechaza con 503
+EMBEDDINGS_COLA_MAX = int(os.getenv("EMBEDDINGS_COLA_MAX", "0")) or EMBEDDINGS_PROCESOS * 4
+
+# Lado máximo (px) al decodificar la imagen y al buscar rostros; 0 = resolución original
+DECODIFICACION_MAX_LADO = int(os.getenv("DECODIFICACION_MAX_LADO", "1600"))
+DETECCION_MAX_LADO = int(os.getenv("DETECCION_MAX_LADO", "800"))
+
+
+class ColaSaturada(Exception):
+    pass
+
+
+def _precalentar():
+    # Se ejecuta una vez por proceso: importar face_recognition carga los modelos de dlib
+    # y una pasada sobre una imagen vacía inicializa el detector HOG y el codificador,
+    # para que el primer /reconocer no pague esa inicialización.
+    import face_recognition
+    vacia = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(vacia)
+    face_recognition.face_encodings(vacia, [(0, 64, 64, 0)])
+
+
+def decodificar_imagen(file_bytes, max_lado=DECODIFICACION_MAX_LADO):
+    img = Image.open(io.BytesIO(file_bytes))
+    if max_lado and max(img.size) > max_lado:
+        factor = max_lado / max(img.size)
+        if img.format == "JPEG":
+            # El decodificador JPEG escala por 1/2, 1/4 o 1/8 sin pasar por la resolución completa
+            img.draft("RGB", (round(img.width * factor), round(img.height * factor)))
+        else:
+            img.thumbnail((max_lado, max_lado), Image.BILINEAR)
+    # Las fotos de celular suelen venir giradas mediante la etiqueta EXIF
+    img = ImageOps.exif_transpose(img)
+    return np.array(img.convert("RGB"))
+
+
+def detectar_rostros(img_np, max_lado=DETECCION_MAX_LADO):
+    import face_recognition
+
+    alto, ancho = img_np.shape[:2]
+    escala = max_lado / max(alto, ancho) if max_lado else 1.0
+    if escala >= 1:
+        return face_recognition.face_locations(img_np)
+
+    reducida = np.array(Image.fromarray(img_np).resize((round(ancho * escala), round(alto * escala)), Image.BILINEAR))
+    # Las cajas (top, right, bottom, left) se llevan de vuelta a la imagen decodificada
+    return [
+        (
+            max(0, int(top / escala)),
+            min(ancho, int(right / escala)),
+            min(alto, int(bottom / escala)),
+            max(0, int(left / escala)),
+        )
+        for top, right, bottom, left in face_recognition.face_locations(reducida)
+    ]
+
+
+def extraer_embeddings(file_bytes, max_decodificacion=DECODIFICACION_MAX_LADO, max_deteccion=DETECCION_MAX_LADO):
+    # Todos los rostros del fotograma: se localizan una vez y se codifican en una sola llamada
+    import face_recognition
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    img_np = decodificar_imagen(file_bytes, max_decodificacion)
+    tiempos["decodificacion"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    face_locations = detectar_rostros(img_np, max_deteccion)
+    tiempos["deteccion"] = time.perf_counter() - inicio
+    if not face_locations:
+        raise ValueError("No se detectó ningún rostro en la imagen.")
+
+    inicio = time.perf_counter()
+    embeddings = face_recognition.face_encodings(img_np, face_locations)
+    tiempos["codificacion"] = time.perf_counter() - inicio
+    if not embeddings:
+        raise ValueError("No se pudieron extraer las características del rostro.")
+
+    return [(tuple(caja), e.tolist()) for caja, e in zip(face_locations, embeddings)], tiempos
+
+
+def extraer_embedding(file_bytes, max_decodificacion=DECODIFICACION_MAX_LADO, max_deteccion=DETECCION_MAX_LADO):
+    rostros, tiempos = extraer_embeddings(file_bytes, max_decodificacion, max_deteccion)
+    return rostros[0][1], tiempos  # Vector de 128 valores
+
+
+def analizar_fotograma(file_bytes, cajas_omitibles, umbral_iou):
+    # Para streaming: detecta todos los rostros pero solo codifica los que no
+    # coinciden con una pista ya resuelta (devuelve None para esos)
+    import face_recognition
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    img_np = decodificar_imagen(file_bytes)
+    tiempos["decodificacion"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    cajas = [tuple(caja) for caja in detectar_rostros(img_np)]
+    tiempos["deteccion"] = time.perf_counter() - inicio
+
+    a_codificar = [caja for caja in cajas if not caja_conocida(caja, cajas_omitibles, umbral_iou)]
+    inicio = time.perf_counter()
+    embeddings = face_recognition.face_encodings(img_np, a_codificar) if a_codificar else []
+    tiempos["codificacion"] = time.perf_counter() - inicio
+
+    por_caja = {caja: e.tolist() for caja, e in zip(a_codificar, embeddings)}
+    return [(caja, por_caja.get(caja)) for caja in cajas], tiempos
+
+
+class EjecutorEmbeddings:
+    # Pool de procesos con los modelos de dlib precargados; los endpoints async
+    # esperan el resultado sin bloquear el event loop.
+    def __init__(self, procesos=EMBEDDINGS_PROCESOS, cola_max=EMBEDDINGS_COLA_MAX, cache=None):
+        self.procesos = procesos
+        self.cola_max = cola_max
+        self.cache = cache
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+        self._rechazadas = 0
+        self._etapas = {}
+
+    def iniciar(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.procesos, initializer=_precalentar)
+        # Enviar una tarea por proceso fuerza a crearlos (y calentarlos) todos ahora
+        wait([self._pool.submit(time.sleep, 0.1) for _ in range(self.procesos)])
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self.cache is not None:
+            self.cache.vaciar()
+
+    def _registrar(self, etapa, segundos):
+        n, total, maximo = self._etapas.get(etapa, (0, 0.0, 0.0))
+        self._etapas[etapa] = (n + 1, total + segundos, max(maximo, segundos))
+        ETAPAS.observar(segundos, etapa)
+
+    async def ejecutar(self, funcion, *args):
+        with self._lock:
+            if self._pendientes >= self.cola_max:
+                self._rechazadas += 1
+                raise ColaSaturada("⏳ Servidor ocupado procesando imágenes, intente de nuevo.")
+            self._pendientes += 1
+
+        inicio = time.perf_counter()
+        try:
+            resultado, tiempos = await asyncio.get_running_loop().run_in_executor(self._pool, funcion, *args)
+        finally:
+            with self._lock:
+                self._pendientes -= 1
+
+        total = time.perf_counter() - inicio
+        with self._lock:
+            for etapa, segundos in tiempos.items():
+                self._registrar(etapa, segundos)
+            self._registrar("cola", max(0.0, total - sum(tiempos.values())))
+            self._registrar("total", total)
+        return resultado
+
+    async def _extraer_con_cache(self, funcion, file_bytes, modo, casi_duplicados=False):
+        # casi_duplicados=True acepta el embedding de una imagen parecida (hash perceptual);
+        # no debe usarse donde el resultado identifica a alguien (p. ej. /reconocer)
+        if self.cache is None:
+            return await self.ejecutar(funcion, file_bytes)
+
+        clave = self.cache.clave(file_bytes, modo)
+        resultado = self.cache.obtener(clave)
+        if resultado is None and self.cache.con_disco:
+            resultado = await asyncio.to_thread(self.cache.obtener_disco, clave)
+        if resultado is not None:
+            return resultado
+
+        phash = None
+        if self.cache.usar_phash:
+            try:
+                phash = await asyncio.to_thread(hash_perceptual, file_bytes)
+            except Exception:
+                pass  # imagen ilegible: que el worker reporte el error
+        if phash is not None and casi_duplicados:
+            resultado = self.cache.obtener_parecido(clave, phash)
+            if resultado is not None:
+                return resultado
+
+        self.cache.registrar_fallo()
+        resultado = await self.ejecutar(funcion, file_bytes)
+        self.cache.guardar(clave, resultado, phash)
+        return resultado
+
+    async def extraer(self, file_bytes, casi_duplicados=False):
+        return await self._extraer_con_cache(extraer_embedding, file_bytes, "uno", casi_duplicados)
+
+    async def extraer_todos(self, file_bytes):
+        return await self._extraer_con_cache(extraer_embeddings, file_bytes, "todos")
+
+    async def analizar(self, file_bytes, cajas_omitibles, umbral_iou):
+        return await self.ejecutar(analizar_fotograma, file_bytes, cajas_omitibles, umbral_iou)
+
+    def estado(self):
+        with self._lock:
+            return {
+                "procesos": self.procesos,
+                "cola_max": self.cola_max,
+                "pendientes": self._pendientes,
+                "rechazadas": self._rechazadas,
+                "cache": self.cache.estado() if self.cache is not None else None,
+                "etapas_ms": {
+                    etapa: {
+                        "n": n,
+                        "promedio": round(total / n * 1000, 2),
+                        "max": round(maximo * 1000, 2),
+                    }
+                    for etapa, (n, total, maximo) in self._etapas.items()
+                },
+            }
+
+
+ejecutor_embeddings = EjecutorEmbeddings(cache=CacheEmbeddings() if EMBEDDINGS_CACHE_MAX > 0 else None)
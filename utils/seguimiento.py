@@ -0,0 +1,102 @@
+import itertools
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+STREAM_UMBRAL_IOU = float(os.getenv("STREAM_UMBRAL_IOU", "0.3"))
+# Score a partir del cual una pista identificada ya no se vuelve a codificar
+STREAM_CONFIANZA = float(os.getenv("STREAM_CONFIANZA", "0.8"))
+# Cada cuántos fotogramas se reintenta codificar una pista desconocida o dudosa
+STREAM_REINTENTO_FOTOGRAMAS = int(os.getenv("STREAM_REINTENTO_FOTOGRAMAS", "5"))
+# Fotogramas sin ver una pista antes de darla por perdida
+STREAM_MAX_PERDIDOS = int(os.getenv("STREAM_MAX_PERDIDOS", "10"))
+
+
+def iou(a, b):
+    # Cajas en formato face_recognition: (top, right, bottom, left)
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    interseccion = max(0, bottom - top) * max(0, right - left)
+    if not interseccion:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return interseccion / (area_a + area_b - interseccion)
+
+
+def caja_conocida(caja, conocidas, umbral=STREAM_UMBRAL_IOU):
+    return any(iou(caja, otra) >= umbral for otra in conocidas)
+
+
+class Pista:
+    def __init__(self, pista_id, caja, fotograma):
+        self.id = pista_id
+        self.caja = caja
+        self.persona = None
+        self.score = 0.0
+        self.ultimo_intento = None
+        self.ultimo_visto = fotograma
+
+    @property
+    def confiable(self):
+        return self.persona is not None and self.score >= STREAM_CONFIANZA
+
+    def identificar(self, persona, score):
+        # Solo se acepta una coincidencia que mejore el score de la pista. Devuelve True si la
+        # pista pasa a ser otra persona (hay que emitir "identificado"), False si no cambia.
+        if score <= self.score:
+            return False
+        ya_identificada = self.persona is not None and self.persona["id"] == persona["id"]
+        self.persona, self.score = persona, score
+        return not ya_identificada
+
+
+class SeguidorRostros:
+    # Seguimiento por IoU entre fotogramas consecutivos de una misma cámara
+    def __init__(self, umbral_iou=STREAM_UMBRAL_IOU, reintento=STREAM_REINTENTO_FOTOGRAMAS,
+                 max_perdidos=STREAM_MAX_PERDIDOS):
+        self.umbral_iou = umbral_iou
+        self.reintento = reintento
+        self.max_perdidos = max_perdidos
+        self.pistas = []
+        self.fotograma = 0
+        self._ids = itertools.count(1)
+
+    def cajas_omitibles(self):
+        # Cajas que el worker no necesita codificar en el siguiente fotograma
+        siguiente = self.fotograma + 1
+        return [
+            p.caja for p in self.pistas
+            if p.confiable or (p.ultimo_intento is not None and siguiente - p.ultimo_intento < self.reintento)
+        ]
+
+    def actualizar(self, cajas):
+        # Asocia cada caja detectada a una pista (existente o nueva) y devuelve
+        # (pistas por caja, pistas perdidas en este fotograma)
+        self.fotograma += 1
+        pares = sorted(
+            ((iou(caja, pista.caja), i, j) for i, caja in enumerate(cajas) for j, pista in enumerate(self.pistas)),
+            reverse=True,
+        )
+        asignadas = [None] * len(cajas)
+        usadas = set()
+        for valor, i, j in pares:
+            if valor < self.umbral_iou:
+                break
+            if asignadas[i] is None and j not in usadas:
+                asignadas[i] = self.pistas[j]
+                usadas.add(j)
+
+        for i, caja in enumerate(cajas):
+            if asignadas[i] is None:
+                asignadas[i] = Pista(next(self._ids), caja, self.fotograma)
+                self.pistas.append(asignadas[i])
+            asignadas[i].caja = caja
+            asignadas[i].ultimo_visto = self.fotograma
+
+        perdidas = [p for p in self.pistas if self.fotograma - p.ultimo_visto > self.max_perdidos]
+        self.pistas = [p for p in self.pistas if self.fotograma - p.ultimo_visto <= self.max_perdidos]
+        return asignadas, perdidas
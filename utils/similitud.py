@@ -0,0 +1,94 @@
+import numpy as np
+
+from utils.codec_kp import MatrizCuantizada
+
+
+UMBRAL_COINCIDENCIA = 0.75
+
+# Filas por bloque al calcular |galería - probe|, para no crear una matriz N×128 completa
+FILAS_POR_BLOQUE = 8192
+
+
+def score_similitud_hibrida(vec1, vec2):
+    # Versión de referencia por pares; scipy solo se importa si se usa (~0.3 s de arranque)
+    from scipy.spatial.distance import cosine, euclidean, cityblock
+
+    vec1 = np.array(vec1)
+    vec2 = np.array(vec2)
+
+    # Distancias
+    cos_sim = 1 - cosine(vec1, vec2)  # Similitud del coseno (1 - distancia)
+    euc_dist = euclidean(vec1, vec2)
+    l1_dist = cityblock(vec1, vec2)
+
+    # Normalización simple de distancias para el score final
+    score = (cos_sim * 0.6) + ((1 / (1 + euc_dist)) * 0.2) + ((1 / (1 + l1_dist)) * 0.2)
+    return score
+
+
+def normas_filas(matriz):
+    if isinstance(matriz, MatrizCuantizada):
+        return matriz.normas()
+    return np.sqrt(np.einsum("ij,ij->i", matriz, matriz))
+
+
+def scores_hibridos(probe, matriz, normas=None):
+    # Mismo score que score_similitud_hibrida, para un probe contra toda la matriz N×128
+    return scores_hibridos_lote(np.asarray(probe)[None, :], matriz, normas)[0]
+
+
+def scores_hibridos_lote(probes, matriz, normas=None):
+    # Scores F×N de varios probes (p. ej. todos los rostros de un fotograma) contra la galería
+    probes = np.asarray(probes, dtype=np.float32)
+    if normas is None:
+        normas = normas_filas(matriz)
+
+    scores = np.empty((len(probes), len(matriz)), dtype=np.float64)
+    if not len(matriz) or not len(probes):
+        return scores
+
+    normas_probes = normas_filas(probes)
+    if isinstance(matriz, MatrizCuantizada):
+        return _scores_cuantizados(probes, normas_probes, matriz, normas, scores)
+
+    productos = probes @ matriz.T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_sim = productos / (normas_probes[:, None] * normas[None, :])
+
+    filas = max(1, FILAS_POR_BLOQUE // len(probes))
+    for inicio in range(0, len(matriz), filas):
+        bloque = slice(inicio, inicio + filas)
+        diferencia = matriz[None, bloque] - probes[:, None, :]
+        euc_dist = np.sqrt(np.einsum("fij,fij->fi", diferencia, diferencia))
+        l1_dist = np.abs(diferencia).sum(axis=2)
+        scores[:, bloque] = (cos_sim[:, bloque] * 0.6) + ((1 / (1 + euc_dist)) * 0.2) + ((1 / (1 + l1_dist)) * 0.2)
+
+    return scores
+
+
+def _scores_cuantizados(probes, normas_probes, matriz, normas, scores):
+    # Galería int8: coseno y L2 salen del producto con los códigos (la escala se aplica
+    # al resultado) y de las normas; solo L1 necesita reconstruir el bloque en float32.
+    filas = max(1, FILAS_POR_BLOQUE // len(probes))
+    cuadrados_probes = normas_probes ** 2
+    for inicio in range(0, len(matriz), filas):
+        bloque = slice(inicio, inicio + filas)
+        codigos = matriz.codigos[bloque].astype(np.float32)
+        escalas = matriz.escalas[bloque]
+        productos = (probes @ codigos.T) * escalas[None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_sim = productos / (normas_probes[:, None] * normas[None, bloque])
+        euc_dist = np.sqrt(np.maximum(cuadrados_probes[:, None] - 2 * productos + normas[None, bloque] ** 2, 0))
+        diferencia = (codigos * escalas[:, None])[None] - probes[:, None, :]
+        l1_dist = np.abs(diferencia).sum(axis=2)
+        scores[:, bloque] = (cos_sim * 0.6) + ((1 / (1 + euc_dist)) * 0.2) + ((1 / (1 + l1_dist)) * 0.2)
+    return scores
+
+
+def mejores_coincidencias(scores, umbral=UMBRAL_COINCIDENCIA, k=None):
+    # Índices (ordenados de mayor a menor score) que superan el umbral
+    indices = np.flatnonzero(scores > umbral)
+    if k is not None and len(indices) > k:
+        indices = indices[np.argpartition(scores[indices], -k)[-k:]]
+    indices = indices[np.argsort(scores[indices])[::-1]]
+    return indices, scores[indices]